@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class AuthenticationConfig(AppConfig):
+    name = "authentication"
+
+    def ready(self):
+        from . import authentication  # noqa: F401  (connects the user cache invalidation receivers)
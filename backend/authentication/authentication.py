@@ -0,0 +1,70 @@
+from core.caching import is_process_local
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+KEY_PREFIX = 'auth:user:'
+# What views read on every request; anything else (password, mfa_secret, ...) loads lazily on first access
+# (in model field order, as Model.from_db expects)
+SNAPSHOT_FIELDS = tuple(field.attname for field in User._meta.concrete_fields if field.attname in {
+    'id', 'email', 'username', 'first_name', 'last_name', 'user_type', 'is_mfa_enabled', 'is_active', 'is_staff',
+    'is_superuser'})
+
+
+def _cache():
+    """The snapshot cache, or ``None``: a process-local cache would keep serving users other workers changed."""
+    alias = settings.AUTH_USER_CACHE_ALIAS
+    if not alias or is_process_local(caches[alias]):
+        return None
+    return caches[alias]
+
+
+def invalidate_user(user_id):
+    """Drop the cached snapshot of ``user_id`` once the change that made it stale commits."""
+    cache = _cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.delete(f'{KEY_PREFIX}{user_id}'))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that serves the token's user from a short-lived snapshot cache.
+
+    The token signature and expiry are still checked on every request; only
+    the user row lookup is skipped. Snapshots are dropped whenever the user is
+    saved or deleted (role changes, MFA setup, deactivation) and otherwise
+    expire after ``AUTH_USER_CACHE_TIMEOUT`` seconds. Without a shared
+    ``AUTH_USER_CACHE_ALIAS`` every request loads the user as usual.
+    """
+
+    def get_user(self, validated_token):
+        cache = _cache()
+        if cache is None or api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)  # revocation checks need the current password hash
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = f'{KEY_PREFIX}{user_id}'
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            return User.from_db(DEFAULT_DB_ALIAS, SNAPSHOT_FIELDS, snapshot)
+
+        user = super().get_user(validated_token)  # raises for unknown or inactive users, which are never cached
+        cache.set(key, [getattr(user, field) for field in SNAPSHOT_FIELDS], settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+
+@receiver(post_save, sender=User, dispatch_uid='auth_user_cache_saved')
+@receiver(post_delete, sender=User, dispatch_uid='auth_user_cache_deleted')
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
@@ -0,0 +1,46 @@
+import secrets
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, get_hasher
+
+from .models import User
+
+_dummy_hashes = {}
+
+
+def _dummy_hash():
+    """A hash of a random password made by the current preferred hasher, with its current parameters."""
+    hasher = get_hasher()
+    encoded = _dummy_hashes.get(hasher)
+    if encoded is None:
+        # Keyed by instance: get_hashers() builds new ones whenever PASSWORD_HASHERS changes
+        encoded = _dummy_hashes[hasher] = hasher.encode(secrets.token_urlsafe(), hasher.salt())
+    return encoded
+
+
+class UniformCostBackend(ModelBackend):
+    """
+    ModelBackend whose failed logins take as long whether or not the email is known.
+
+    Django hashes the password for unknown users, which costs a little less
+    than a verification, and rejects users without a usable password without
+    hashing at all. Here both verify the password against a dummy hash from
+    the preferred hasher, the same work as a real check. Successful logins
+    still upgrade outdated hashes through ``User.check_password``.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            user = None
+        if user is None or not user.has_usable_password():
+            check_password(password, _dummy_hash())
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,53 @@
+"""
+Password hashers whose cost parameters come from ``PASSWORD_HASHER_PARAMS``.
+
+They keep Django's algorithm names, so hashes written by Django's own
+hashers still verify. ``must_update`` compares a stored hash with the
+current parameters, so after ``PASSWORD_HASHER`` or its parameters change,
+each user's password is re-hashed on their next successful login.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class TunedHasherMixin:
+    params_key = None
+
+    def __init__(self):
+        # Hashers are instantiated once per PASSWORD_HASHERS value (get_hashers is cached)
+        for name, value in settings.PASSWORD_HASHER_PARAMS.get(self.params_key, {}).items():
+            setattr(self, name, value)
+
+
+class ScryptPasswordHasher(TunedHasherMixin, hashers.ScryptPasswordHasher):
+    params_key = 'scrypt'
+
+    @property
+    def memory_bytes(self):
+        return 128 * self.work_factor * self.block_size * self.parallelism
+
+
+class Argon2PasswordHasher(TunedHasherMixin, hashers.Argon2PasswordHasher):
+    params_key = 'argon2'
+
+    @property
+    def memory_bytes(self):
+        return self.memory_cost * 1024
+
+
+class PBKDF2PasswordHasher(TunedHasherMixin, hashers.PBKDF2PasswordHasher):
+    params_key = 'pbkdf2'
+    memory_bytes = 0
+
+
+BY_NAME = {
+    'scrypt': ScryptPasswordHasher,
+    'argon2': Argon2PasswordHasher,
+    'pbkdf2': PBKDF2PasswordHasher,
+}
+
+
+def hasher_stack(preferred):
+    """``settings.PASSWORD_HASHERS`` reordered to hash with ``preferred``; every other entry still verifies."""
+    path = f'{__name__}.{BY_NAME[preferred].__qualname__}'
+    return [path, *(other for other in settings.PASSWORD_HASHERS if other != path)]
@@ -0,0 +1,86 @@
+import importlib.util
+import json
+import os
+
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from files.benchmarking import Timer, scratch_environment, summarize
+from rest_framework.test import APIClient
+
+from authentication.hashers import BY_NAME, hasher_stack
+from authentication.models import User
+
+PASSWORD = 'correct horse battery staple'
+
+
+def available(name):
+    return name != 'argon2' or importlib.util.find_spec('argon2') is not None
+
+
+def time_calls(func, count):
+    samples = []
+    for _ in range(count):
+        with Timer() as timer:
+            func()
+        samples.append(timer.elapsed)
+    return summarize(samples)
+
+
+class Command(BaseCommand):
+    help = ('Reports logins per second per core for each password hasher, the cost of failed logins for '
+            'known and unknown emails, and checks that outdated hashes are upgraded on login')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verifications', type=int, default=20, help='Password checks timed per hasher')
+        parser.add_argument('--logins', type=int, default=10, help='Login requests timed per hasher and case')
+
+    def handle(self, *args, **options):
+        results = {'cpus': os.cpu_count()}
+        with scratch_environment():
+            client = APIClient()
+            for name in BY_NAME:
+                if not available(name):
+                    results[name] = {'available': False}
+                    continue
+                with override_settings(PASSWORD_HASHERS=hasher_stack(name)):
+                    hasher = get_hasher()
+                    encoded = make_password(PASSWORD)
+                    verify = time_calls(lambda: check_password(PASSWORD, encoded), options['verifications'])
+                    email = f'{name}@bench.example'
+                    User.objects.create_user(username=email, email=email, password=PASSWORD)
+
+                    def login(email, password, expected):
+                        response = client.post('/api/auth/login/', {'email': email, 'password': password},
+                                               format='json')
+                        assert response.status_code == expected, response.data
+
+                    logins = {
+                        case: time_calls(lambda: login(*credentials), options['logins'])
+                        for case, credentials in (('login', (email, PASSWORD, 200)),
+                                                  ('wrong_password', (email, 'wrong', 401)),
+                                                  ('unknown_email', ('nobody@bench.example', PASSWORD, 401)))
+                    }
+                results[name] = {
+                    'available': True,
+                    'algorithm': hasher.algorithm,
+                    'params': hasher.decode(encoded),
+                    'memory_mib': round(hasher.memory_bytes / 1048576, 1),
+                    'verify_p50_ms': verify['p50_ms'],
+                    'logins_per_s_per_core': round(1000 / verify['mean_ms'], 1),
+                    'login_p50_ms': logins['login']['p50_ms'],
+                    'wrong_password_p50_ms': logins['wrong_password']['p50_ms'],
+                    'unknown_email_p50_ms': logins['unknown_email']['p50_ms'],
+                }
+                for key in ('algorithm', 'salt', 'hash'):
+                    results[name]['params'].pop(key, None)
+
+            # A user hashed with the slowest stack is moved to the default one by their next login
+            with override_settings(PASSWORD_HASHERS=hasher_stack('pbkdf2')):
+                user = User.objects.create_user(username='legacy@bench.example', email='legacy@bench.example',
+                                                password=PASSWORD)
+            client.post('/api/auth/login/', {'email': user.email, 'password': PASSWORD}, format='json')
+            user.refresh_from_db()
+            results['upgrade_on_login'] = {'from': 'pbkdf2_sha256', 'to': identify_hasher(user.password).algorithm}
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -20,3 +20,8 @@ class User(AbstractUser):
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='user_recent_idx'),
+        ]
@@ -2,6 +2,7 @@ import re
 from datetime import timedelta, datetime, timezone
 
 from django.core.validators import EmailValidator
+from files.pagination import FieldProjectionMixin
 from rest_framework import serializers
 
 from .models import User
@@ -54,7 +55,7 @@ class MFASerializer(serializers.Serializer):
     code = serializers.CharField()
 
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(FieldProjectionMixin, serializers.ModelSerializer):
     name = serializers.CharField(source='first_name')
     member_since = serializers.DateTimeField(source='created_at')
 
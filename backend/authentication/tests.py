@@ -0,0 +1,80 @@
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.hashers import get_hasher, identify_hasher
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import KEY_PREFIX
+from .hashers import hasher_stack
+from .models import User
+
+
+@override_settings(THROTTLE_BUCKETS={})
+class UserCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com', email='user@example.com', password='pw')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def status(self):
+        return self.client.get('/api/files/user-data/').status_code
+
+    def deactivate_elsewhere(self):
+        # As another worker would: no signal reaches this process
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+    @override_settings(AUTH_USER_CACHE_ALIAS='default')
+    def test_process_local_alias_disables_snapshots(self):
+        self.assertEqual(self.status(), 200)
+        self.assertIsNone(caches['default'].get(f'{KEY_PREFIX}{self.user.pk}'))
+        self.deactivate_elsewhere()
+        self.assertEqual(self.status(), 401)
+
+    def test_shared_alias_serves_snapshots_until_the_user_is_saved(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                        'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                   'LOCATION': location}},
+                AUTH_USER_CACHE_ALIAS='shared'):
+            self.assertEqual(self.status(), 200)
+            self.assertIsNotNone(caches['shared'].get(f'{KEY_PREFIX}{self.user.pk}'))
+            self.deactivate_elsewhere()
+            self.assertEqual(self.status(), 200)
+
+            self.user.refresh_from_db()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.save()
+            self.assertEqual(self.status(), 401)
+
+
+# Cheap parameters: these tests are about which hasher runs, not how long it takes
+@override_settings(THROTTLE_BUCKETS={}, PASSWORD_HASHERS=hasher_stack('scrypt'), PASSWORD_HASHER_PARAMS={
+    'scrypt': {'work_factor': 2 ** 4}, 'pbkdf2': {'iterations': 1000}})
+class LoginHashingTests(TestCase):
+    def login(self, email, password):
+        return APIClient().post('/api/auth/login/', {'email': email, 'password': password}, format='json')
+
+    def test_outdated_hashes_are_upgraded_on_login(self):
+        with override_settings(PASSWORD_HASHERS=hasher_stack('pbkdf2')):
+            user = User.objects.create_user(username='user@example.com', email='user@example.com', password='pw')
+        self.assertEqual(identify_hasher(user.password).algorithm, 'pbkdf2_sha256')
+
+        self.assertEqual(self.login(user.email, 'wrong').status_code, 401)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, 'pbkdf2_sha256')
+
+        self.assertEqual(self.login(user.email, 'pw').status_code, 200)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, 'scrypt')
+        self.assertEqual(get_hasher().decode(user.password)['work_factor'], 2 ** 4)
+        self.assertEqual(self.login(user.email, 'pw').status_code, 200)
+
+    def test_unknown_emails_cost_one_verification_with_the_preferred_hasher(self):
+        User.objects.create_user(username='user@example.com', email='user@example.com', password='pw')
+        for email in ('user@example.com', 'nobody@example.com'):
+            with mock.patch.object(get_hasher(), 'verify', wraps=get_hasher().verify) as verify:
+                self.assertEqual(self.login(email, 'wrong').status_code, 401)
+            self.assertEqual(verify.call_count, 1, email)
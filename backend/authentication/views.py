@@ -1,19 +1,24 @@
 from datetime import timedelta
 
 import pyotp
+from core.throttling import LoginThrottle
 from django.contrib.auth import authenticate
 from django.utils import timezone
+from files.pagination import KeysetPagination, project, requested_fields
+from files.query_budget import query_budget
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken, TokenError
 
 from .models import User
-from .serializers import UserRegistrationSerializer, LoginSerializer, MFASerializer, MFAPendingUserSerializer
+from .serializers import UserRegistrationSerializer, LoginSerializer, MFASerializer, MFAPendingUserSerializer, \
+    UserListSerializer, UserRoleUpdateSerializer
 
 
 @api_view(["POST"])
+@throttle_classes([LoginThrottle])
 def register(request):
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
@@ -33,6 +38,7 @@ def register(request):
 
 
 @api_view(["POST"])
+@throttle_classes([LoginThrottle])
 def login(request):
     serializer = LoginSerializer(data=request.data)
     if serializer.is_valid():
@@ -56,6 +62,7 @@ def login(request):
 
 
 @api_view(["POST"])
+@throttle_classes([LoginThrottle])
 def verify_mfa(request):
     serializer = MFASerializer(data=request.data)
     if serializer.is_valid():
@@ -122,6 +129,7 @@ def setup_mfa(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LoginThrottle])
 def verify_mfa_setup(request):
     otp = request.data.get('otp')
     user = request.user
@@ -153,10 +161,11 @@ def verify_mfa_setup(request):
 
 
 # authentications/views.py
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated
 
 
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_all_users(request):
@@ -166,9 +175,12 @@ def get_all_users(request):
             "error": "Only admin users can access this endpoint"
         }, status=status.HTTP_403_FORBIDDEN)
 
-    users = User.objects.all().order_by('-created_at')
-    serializer = UserListSerializer(users, many=True)
-    return Response(serializer.data)
+    fields = requested_fields(request, UserListSerializer)
+    ordering = ('-created_at', '-id')
+    paginator = KeysetPagination(ordering=ordering)
+    page = paginator.paginate_queryset(project(User.objects.all(), UserListSerializer, fields, ordering), request)
+    serializer = UserListSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['PATCH'])
@@ -197,6 +209,7 @@ def update_user_role(request, user_id):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_mfa_pending_users(request):
@@ -0,0 +1,31 @@
+"""
+SQLite backend tuned for local development with several workers.
+
+WAL lets readers proceed while a writer commits, instead of every request
+queueing behind the database lock. WAL is a property of the database file,
+so it is switched on once by a migration (files 0012) rather than on every
+connection; the pragmas here only last for the connection and trade
+durability of the last transaction on power loss (never on a crash of the
+process) for fewer fsyncs. Lock waits are bounded by the ``timeout`` option.
+"""
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -20000',  # KiB, i.e. ~20MB of page cache per connection
+    'PRAGMA mmap_size = 134217728',
+)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        # A deferred transaction that reads and then writes fails with "database is locked" straight away,
+        # without waiting out ``timeout``, if another connection wrote in between; take the write lock up front
+        self.cursor().execute('BEGIN IMMEDIATE')
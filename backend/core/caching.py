@@ -0,0 +1,6 @@
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_process_local(cache):
+    """Whether ``cache`` lives in this process's memory, so other workers never see what it stores or deletes."""
+    return isinstance(cache, LocMemCache)
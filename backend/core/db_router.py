@@ -0,0 +1,136 @@
+"""
+Primary/replica routing.
+
+Only safe requests (GET, HEAD, OPTIONS) read from a replica; writes, reads
+inside transactions, management commands and anything outside a request use
+the primary. After a request writes, the client is pinned to the primary for
+``DATABASE_REPLICA_PIN_SECONDS`` so it reads its own writes despite
+replication lag: through a cookie, and through a per-user cache entry when
+``DATABASE_PIN_CACHE_ALIAS`` names a cache shared by all workers (API clients
+often drop cookies).
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.functional import empty
+
+PIN_COOKIE = 'db_pin'
+PIN_KEY_PREFIX = 'db:pin:'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def _pin_cache():
+    alias = settings.DATABASE_PIN_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def _resolved_user_id(request):
+    # Authentication runs inside the view, after this middleware; only use a user it has already resolved
+    user = request.__dict__.get('user')
+    if user is None or getattr(user, '_wrapped', None) is empty:
+        return None
+    return user.pk
+
+
+class RequestRouting:
+    """Routing state of one request, shared by every thread serving it."""
+
+    def __init__(self, request):
+        self.request = request
+        self.allow_replica = request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES
+        self.replica = None
+        self.wrote = False
+        self._user_checked = False
+
+    def use_replica(self):
+        if not self.allow_replica or self.wrote:
+            return False
+        if not self._user_checked and (cache := _pin_cache()) is not None:
+            user_id = _resolved_user_id(self.request)
+            if user_id is not None:
+                self._user_checked = True
+                self.allow_replica = not cache.get(f'{PIN_KEY_PREFIX}{user_id}')
+        return self.allow_replica
+
+    def pin(self, response):
+        seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        user_id = _resolved_user_id(self.request)
+        if user_id is not None and (cache := _pin_cache()) is not None:
+            cache.set(f'{PIN_KEY_PREFIX}{user_id}', True, seconds)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        aliases = replicas()
+        if not aliases or routing is None or transaction.get_connection().in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if not routing.use_replica():
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            # One replica per request, so its reads see a single consistent snapshot
+            routing.replica = random.choice(aliases)
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # replicas hold the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """Scope replica routing to the request and pin clients that just wrote to the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _finish(self, routing, response, token):
+        _routing.reset(token)
+        if routing.wrote and replicas():
+            routing.pin(response)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = RequestRouting(request)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _routing.reset(token)
+            raise
+        return self._finish(routing, response, token)
+
+    async def __acall__(self, request):
+        routing = RequestRouting(request)
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _routing.reset(token)
+            raise
+        return self._finish(routing, response, token)
@@ -0,0 +1,306 @@
+"""
+Request metrics in the Prometheus text format, served at ``/metrics``.
+
+``MetricsMiddleware`` times every request by view and counts its SQL
+queries and time, request and response body bytes, and open streaming
+responses. ``collector`` functions add values computed at scrape time
+(storage per user tier). Each process keeps its own registry, so with
+several workers per host scrape each worker, or aggregate with the
+``instance`` label.
+"""
+import bisect
+import contextvars
+import hmac
+import ipaddress
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """``(suffix, labels, value)`` triples for the exposition format."""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', dict(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then the sum
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), series):
+                cumulative += count
+                yield '_bucket', {**labels, 'le': _number(bound)}, cumulative
+            yield '_count', labels, cumulative
+            yield '_sum', labels, series[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register ``func``, which returns metrics computed afresh on every scrape."""
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            metrics.extend(collect())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'http_request_duration_seconds', 'Time from the first middleware to the response, by view.',
+    ('view', 'method', 'status')))
+request_queries = registry.register(Histogram(
+    'http_request_db_queries', 'SQL queries run per request, by view.', ('view',), buckets=QUERY_BUCKETS))
+request_db_time = registry.register(Counter(
+    'http_request_db_seconds_total', 'Time spent in SQL queries, by view.', ('view',)))
+request_bytes = registry.register(Counter(
+    'http_request_body_bytes_total', 'Request body bytes received (uploads), by view.', ('view',)))
+response_bytes = registry.register(Counter(
+    'http_response_body_bytes_total', 'Response body bytes sent (downloads), by view.', ('view',)))
+active_streams = registry.register(Gauge(
+    'http_active_streams', 'Streaming responses currently being sent, by view.', ('view',)))
+
+
+@registry.collector
+def storage_by_tier():
+    from files.models import UserStorage
+    from django.db.models import Count, Sum
+
+    used = Gauge('files_storage_used_bytes', 'Bytes stored, by user tier.', ('tier',))
+    allocated = Gauge('files_storage_allocated_bytes', 'Bytes allocated, by user tier.', ('tier',))
+    users = Gauge('files_users', 'Users with a storage record, by user tier.', ('tier',))
+    rows = UserStorage.objects.values('user__user_type').annotate(used=Sum('used_storage'), users=Count('pk'))
+    for row in rows:
+        tier = row['user__user_type']
+        used.set(row['used'] or 0, tier)
+        users.set(row['users'], tier)
+        allocated.set(UserStorage.allocation_for(tier) * row['users'], tier)
+    return [used, allocated, users]
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def _instrument(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Record per-view latency, SQL and transfer metrics; put it first so it times the whole stack."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(_instrument, dispatch_uid='core_metrics_instrument')
+        for connection in connections.all(initialized_only=True):
+            _instrument(connection)
+
+    def _record(self, request, response, started, stats):
+        view = view_name(request)
+        request_latency.observe(time.perf_counter() - started, view, request.method,
+                                f'{response.status_code // 100}xx')
+        request_queries.observe(stats.queries, view)
+        if stats.db_time:
+            request_db_time.inc(stats.db_time, view)
+        length = request.META.get('CONTENT_LENGTH')
+        if length and length.isdigit() and length != '0':
+            request_bytes.inc(int(length), view)
+        if not response.streaming:
+            response_bytes.inc(len(response.content), view)
+        elif getattr(response, 'file_to_stream', None) is not None:
+            # Handed to wsgi.file_wrapper (sendfile), which bypasses the body iterator
+            response_bytes.inc(int(response.get('Content-Length') or 0), view)
+        elif response.is_async:
+            response.streaming_content = _acount(response.streaming_content, view)
+        else:
+            response.streaming_content = _count(response.streaming_content, view)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started, stats = time.perf_counter(), RequestStats()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._record(request, response, started, stats)
+
+    async def __acall__(self, request):
+        started, stats = time.perf_counter(), RequestStats()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._record(request, response, started, stats)
+
+
+def _count(content, view):
+    # A stream only counts as active once the server starts pulling from it
+    active_streams.inc(1, view)
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        active_streams.inc(-1, view)
+        response_bytes.inc(sent, view)
+
+
+async def _acount(content, view):
+    active_streams.inc(1, view)
+    sent = 0
+    try:
+        async for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        active_streams.inc(-1, view)
+        response_bytes.inc(sent, view)
+
+
+def scrape_allowed(request):
+    """Whether ``request`` carries the ``METRICS_TOKEN`` bearer token or comes from ``METRICS_ALLOWED_NETWORKS``."""
+    token = settings.METRICS_TOKEN
+    supplied = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def metrics_view(request):
+    """Serve the registry to scrapers passing ``scrape_allowed``."""
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -10,9 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import importlib.util
 import os
+import tempfile
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
+    "files.log.RequestContextMiddleware",
+    "core.db_router.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -77,12 +84,49 @@ WSGI_APPLICATION = "core.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE=postgres switches to PostgreSQL (needs psycopg); SQLite stays the development default.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '60'))  # seconds a connection is reused; 0 = per request
+# Behind pgbouncer in transaction pooling mode server-side cursors cannot survive between transactions
+DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '').lower() in ('1', 'true', 'yes')
+DB_REPLICA_HOSTS = [host for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host]
+
+
+def _postgres(host):
+    return {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get('DB_NAME', 'fileshare'),
+        "USER": os.environ.get('DB_USER', 'fileshare'),
+        "PASSWORD": os.environ.get('DB_PASSWORD', ''),
+        "HOST": host,
+        "PORT": os.environ.get('DB_PORT', '5432'),
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": DB_PGBOUNCER,
+        "OPTIONS": {"connect_timeout": 5},
     }
-}
+
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {"default": _postgres(os.environ.get('DB_HOST', 'localhost'))}
+    for index, host in enumerate(DB_REPLICA_HOSTS, 1):
+        DATABASES[f"replica{index}"] = {**_postgres(host), "TEST": {"MIRROR": "default"}}
+else:
+    DATABASES = {
+        "default": {
+            # django.db.backends.sqlite3 with WAL and tuned pragmas (see core/backends/sqlite3)
+            "ENGINE": "core.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {"timeout": 20},  # seconds to wait for the write lock instead of failing at once
+            # On disk rather than in memory, so concurrency tests' threads wait on the lock instead of failing
+            "TEST": {"NAME": os.path.join(tempfile.gettempdir(), "filesharing-test.sqlite3")},
+        }
+    }
+
+# Safe requests read from a replica unless the client wrote within the last few seconds
+DATABASE_ROUTERS = ["core.db_router.PrimaryReplicaRouter"]
+DATABASE_REPLICA_PIN_SECONDS = 5
+DATABASE_PIN_CACHE_ALIAS = os.environ.get('DATABASE_PIN_CACHE_ALIAS') or None
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -102,22 +146,185 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# New and re-hashed passwords use PASSWORD_HASHER: 'scrypt' (the default), 'argon2' (needs argon2-cffi) or
+# 'pbkdf2'. Hashes made by the others still verify and are upgraded on the user's next login, as are hashes
+# made with parameters other than PASSWORD_HASHER_PARAMS. scrypt with N=2**14, r=8 (16 MiB) costs about a
+# fifth of the CPU of Django's 720k PBKDF2 iterations; compare with `manage.py bench_hashers`.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'scrypt')
+PASSWORD_HASHER_PARAMS = {
+    'scrypt': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    'argon2': {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1},  # argon2id, 19 MiB
+    'pbkdf2': {'iterations': 720000},
+}
+_PASSWORD_HASHER_CLASSES = {
+    'scrypt': 'authentication.hashers.ScryptPasswordHasher',
+    'argon2': 'authentication.hashers.Argon2PasswordHasher',
+    'pbkdf2': 'authentication.hashers.PBKDF2PasswordHasher',
+}
+if PASSWORD_HASHER not in _PASSWORD_HASHER_CLASSES:
+    raise ImproperlyConfigured(f"PASSWORD_HASHER must be one of {', '.join(_PASSWORD_HASHER_CLASSES)}")
+if PASSWORD_HASHER == 'argon2' and not importlib.util.find_spec('argon2'):
+    raise ImproperlyConfigured("PASSWORD_HASHER='argon2' requires the argon2-cffi package")
+PASSWORD_HASHERS = [_PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Failed logins cost one password verification whether or not the email exists
+AUTHENTICATION_BACKENDS = ['authentication.backends.UniformCostBackend']
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'authentication.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'core.throttling.UserThrottle',
+    ),
+    # Number of trusted reverse proxies in front of the app. Per-address limits use X-Forwarded-For only
+    # when this is set (0 = no proxy, use REMOTE_ADDR); left unset, they key on REMOTE_ADDR alone
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
+    # `Accept: application/json; version=2` opts into the compact encryption_metadata encoding
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.AcceptHeaderVersioning',
+    'DEFAULT_VERSION': '1',
+    'ALLOWED_VERSIONS': ('1', '2'),
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+if importlib.util.find_spec('msgpack'):
+    # Optional binary response/request mode (raw IV bytes instead of text encodings)
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('files.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('files.renderers.MessagePackParser')
+
+# Token-bucket request limits per scope: (sustained requests per second, burst); see core/throttling.py.
+# Buckets live in each process unless THROTTLE_CACHE_ALIAS names a cache shared by all workers.
+THROTTLE_BUCKETS = {
+    'user': (20, 200),  # every API call, per user (per address when anonymous)
+    'upload': (2, 20),  # uploads and upload sessions started, per user
+    'login': (5 / 60, 10),  # login, registration and MFA codes, per address and per account
+    'download_ip': (10, 50),  # public downloads per address
+    'download_link': (20, 100),  # downloads of any single public link
+}
+THROTTLE_CACHE_ALIAS = os.environ.get('THROTTLE_CACHE_ALIAS') or None
+
+# /metrics (core/metrics.py) is served to `Authorization: Bearer <METRICS_TOKEN>` when a token is set, and
+# to clients whose REMOTE_ADDR falls in METRICS_ALLOWED_NETWORKS (addresses or CIDR ranges, loopback by default)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+METRICS_ALLOWED_NETWORKS = [network for network in os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.1,::1')
+                            .split(',') if network]
+
 # Custom user model
 AUTH_USER_MODEL = 'authentication.User'
 
+# Authenticated requests reuse a snapshot of the token's user for this long instead of loading the row;
+# saving the user drops it. Only enabled with a shared (non-LocMem) cache alias, so a role change or
+# deactivation reaches every worker at once.
+AUTH_USER_CACHE_ALIAS = os.environ.get('AUTH_USER_CACHE_ALIAS') or None
+AUTH_USER_CACHE_TIMEOUT = 30
+
 # media
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Where uploaded bytes live: 'sharded' (MEDIA_ROOT fanned out as ab/cd/<name>), 'local' (flat MEDIA_ROOT),
+# 'multivolume' (sharded across FILES_STORAGE_VOLUMES by free space) or 's3' (any S3-compatible service).
+# Move existing files between backends with `manage.py migrate_storage`.
+FILES_STORAGE_BACKEND = os.environ.get('FILES_STORAGE_BACKEND', 'sharded')
+FILES_STORAGE_VOLUMES = [volume for volume in os.environ.get('FILES_STORAGE_VOLUMES', '').split(os.pathsep)
+                         if volume] or [MEDIA_ROOT]
+FILES_S3_BUCKET = os.environ.get('FILES_S3_BUCKET', '')
+FILES_S3_ENDPOINT_URL = os.environ.get('FILES_S3_ENDPOINT_URL') or None  # e.g. http://localhost:9000 for MinIO
+FILES_S3_REGION = os.environ.get('FILES_S3_REGION') or None
+FILES_S3_ACCESS_KEY_ID = os.environ.get('FILES_S3_ACCESS_KEY_ID') or None
+FILES_S3_SECRET_ACCESS_KEY = os.environ.get('FILES_S3_SECRET_ACCESS_KEY') or None
+FILES_S3_PREFIX = os.environ.get('FILES_S3_PREFIX', '')
+FILES_S3_URL_EXPIRY = 300  # seconds a presigned download redirect stays valid
+
+STORAGES = {
+    'default': {
+        'BACKEND': {
+            'local': 'django.core.files.storage.FileSystemStorage',
+            'sharded': 'files.storage.ShardedFileSystemStorage',
+            'multivolume': 'files.storage.MultiVolumeStorage',
+            's3': 'files.storage.S3Storage',
+        }[FILES_STORAGE_BACKEND],
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Encryption at rest: wrap the storage above in chunked AES-256-GCM envelope encryption
+# (needs `cryptography`). Keys are base64 32-byte master keys, newest first; older ones
+# stay listed until nothing encrypted under them remains.
+FILES_ENCRYPTION_AT_REST = os.environ.get('FILES_ENCRYPTION_AT_REST', '').lower() in ('1', 'true', 'yes')
+FILES_ENCRYPTION_KEYS = [key for key in os.environ.get('FILES_ENCRYPTION_KEYS', '').split(',') if key]
+FILES_ENCRYPTION_CHUNK_SIZE = 64 * 1024
+if FILES_ENCRYPTION_AT_REST:
+    STORAGES['default'] = {'BACKEND': 'files.storage.EncryptedStorage'}
+
+# File uploads (per user type, in bytes)
+FILES_MAX_UPLOAD_SIZE = {
+    'admin': 10 * 1024 * 1024,  # 10MB
+    'regular': 5 * 1024 * 1024,  # 5MB
+}
+FILES_MAX_CHUNKED_UPLOAD_SIZE = {
+    'admin': 5 * 1024 * 1024 * 1024,  # 5GB
+    'regular': 1024 * 1024 * 1024,  # 1GB
+}
+FILES_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # 5MB
+FILES_UPLOAD_SESSION_TTL_HOURS = 24  # idle chunked sessions are aborted by reap_expired_files
+FILES_MAX_BULK_SHARE = 1000  # files, and separately recipients, per bulk share request
+# Files per batch upload; multipart batches are also capped by Django's DATA_UPLOAD_MAX_NUMBER_FILES
+FILES_MAX_BATCH_UPLOAD = 100
+FILES_MAX_BUNDLE = 1000  # files per zip/tar bundle download
+# Callables run over every upload by the files.process_upload task, e.g. a virus scanner; see files.processing
+FILES_UPLOAD_PROCESSORS = []
+
+# Background tasks (files.tasks), executed by `python manage.py run_tasks`: 'database' (the Task table),
+# 'redis' (FILES_TASK_REDIS_URL) or 'local' (in-process once the transaction commits; tests and development)
+FILES_TASK_QUEUE = os.environ.get('FILES_TASK_QUEUE', 'database')
+FILES_TASK_REDIS_URL = os.environ.get('FILES_TASK_REDIS_URL', 'redis://localhost:6379/0')
+FILES_TASK_LEASE = 300  # seconds a worker may hold a task before another worker retries it
+FILES_TASK_RETENTION_DAYS = 7  # finished tasks (and their idempotency keys) are kept this long
+
+# Resolved public download links are cached in FILES_LINK_CACHE_ALIAS, which must name a cache
+# shared by every process (e.g. redis) so evictions reach them all; without one (or with a LocMem
+# alias) links are resolved from the database on every download.
+FILES_LINK_CACHE_TIMEOUT = 60  # seconds
+FILES_LINK_CACHE_ALIAS = os.environ.get('FILES_LINK_CACHE_ALIAS') or None
+
+# Download bandwidth per user_type tier in bytes per second, shared by all of a client's downloads
+# ('anonymous' covers public links fetched without logging in); missing or None = unlimited, e.g.
+# {'anonymous': 2 * 1024 * 1024, 'guest': 2 * 1024 * 1024, 'regular': 10 * 1024 * 1024}.
+# Paced downloads cannot use the 'sendfile' backend's wsgi.file_wrapper, so a limited tier streams through Python.
+FILES_DOWNLOAD_BANDWIDTH = {}
+
+# Serve uploads, downloads and the file listings from the async views (use with an ASGI server)
+FILES_ASYNC_VIEWS = os.environ.get('FILES_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+FILES_ASYNC_IO_CONCURRENCY = 32  # blocking storage reads in flight per event loop
+
+# File downloads: 'stream' (Python streaming), 'sendfile' (wsgi.file_wrapper / os.sendfile),
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile)
+FILES_DOWNLOAD_BACKEND = os.environ.get('FILES_DOWNLOAD_BACKEND', 'stream')
+FILES_X_ACCEL_REDIRECT_PREFIX = '/protected/'  # nginx `internal` location aliased to the storage root
+# Under 'multivolume' every other volume needs its own `internal` location, e.g. {'/mnt/disk2': '/protected-2/'}
+FILES_X_ACCEL_REDIRECT_PREFIXES = {}
+
+# Keyset pagination for listing endpoints, used when a request sends `limit` or `cursor`
+FILES_PAGE_SIZE = 500  # page size for a `cursor` without `limit`
+FILES_MAX_PAGE_SIZE = 1000
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified', 'Link', 'X-Next-Cursor']
 ALLOWED_HOSTS = ['*']  # Only for development
 
 # Internationalization
@@ -141,9 +348,21 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Files app logging: leveled, structured (one JSON object per line) and, with FILES_LOG_QUEUE,
+# written by a background listener thread so requests never wait on log I/O.
+FILES_LOG_LEVEL = os.environ.get('FILES_LOG_LEVEL', 'INFO')
+FILES_LOG_QUEUE = True
+FILES_LOG_QUEUE_SIZE = 10000  # records beyond this are dropped rather than blocking requests
+FILES_LOG_SAMPLE_RATE = 0.1  # fraction of high-volume success events (uploads saved) that are logged
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {
+            '()': 'files.log.RequestContextFilter',
+        },
+    },
     'formatters': {
         'verbose': {
             'format': '### {levelname} {asctime} {module} {process:d} {thread:d} {message}',
@@ -153,6 +372,9 @@ LOGGING = {
             'format': '### {levelname} {message}',
             'style': '{',
         },
+        'structured': {
+            '()': 'files.log.StructuredFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -163,7 +385,8 @@ LOGGING = {
         'file': {
             'class': 'logging.FileHandler',
             'filename': 'debug.log',
-            'formatter': 'verbose',
+            'formatter': 'structured',
+            'filters': ['request_context'],
             'level': 'DEBUG',
         },
     },
@@ -173,10 +396,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
-        'files': {  # Change 'app' to 'files' since that's your app name
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
-            'propagate': True,
+        'files': {
+            'handlers': ['file'],
+            'level': FILES_LOG_LEVEL,
+            'propagate': False,
         },
     },
     'root': {
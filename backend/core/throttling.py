@@ -0,0 +1,195 @@
+"""
+Token-bucket rate limiting and download bandwidth shaping.
+
+A bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+second; a request spends one token, a streamed download spends one per byte.
+Buckets live in process memory unless ``THROTTLE_CACHE_ALIAS`` names a cache
+shared by all workers, in which case limits hold across the whole deployment
+(updates there are read-modify-write, so concurrent workers may overshoot a
+limit slightly, never undershoot it by much).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class MemoryBucketStore:
+    """Thread-safe, size-bounded map of buckets in this process."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst, cost=1, debt=False):
+        """
+        Spend ``cost`` tokens from bucket ``key``; returns ``(allowed, wait)``.
+
+        Without ``debt`` a bucket that cannot cover the cost is left untouched
+        and ``wait`` says when it will. With ``debt`` the cost is always spent,
+        possibly driving the bucket negative, and ``wait`` is how long the
+        caller should pause to pay it back; concurrent consumers of one bucket
+        then share its rate.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (burst, now))
+            tokens, allowed, wait = _spend(min(burst, tokens + (now - stamp) * rate), rate, cost, debt)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+
+class CacheBucketStore:
+    """Buckets kept in a Django cache so every worker shares them."""
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def consume(self, key, rate, burst, cost=1, debt=False):
+        now = time.time()
+        tokens, stamp = self.cache.get(key) or (burst, now)
+        tokens, allowed, wait = _spend(min(burst, tokens + max(0.0, now - stamp) * rate), rate, cost, debt)
+        # A bucket untouched for this long is full again, so the entry can lapse
+        self.cache.set(key, (tokens, now), timeout=int((burst - tokens) / rate) + 1)
+        return allowed, wait
+
+
+def _spend(tokens, rate, cost, debt):
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    if debt:
+        tokens -= cost
+        return tokens, True, -tokens / rate
+    return tokens, False, (cost - tokens) / rate
+
+
+_stores = {}
+
+
+def get_store():
+    alias = settings.THROTTLE_CACHE_ALIAS
+    if alias not in _stores:
+        _stores[alias] = CacheBucketStore(alias) if alias else MemoryBucketStore()
+    return _stores[alias]
+
+
+def client_address(request):
+    """
+    The address per-address buckets are keyed on.
+
+    ``X-Forwarded-For`` is only believed when ``REST_FRAMEWORK['NUM_PROXIES']``
+    says how many trusted proxies append to it; otherwise any client could
+    claim a fresh address, and so a fresh bucket, on every request.
+    """
+    if api_settings.NUM_PROXIES is None:
+        return request.META.get('REMOTE_ADDR')
+    return BaseThrottle().get_ident(request)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    DRF throttle over the ``THROTTLE_BUCKETS[scope]`` limit, ``(requests per second, burst)``.
+
+    A request is charged to every bucket named by ``get_idents`` and is
+    refused when any of them is empty; scopes without a configured limit are
+    not throttled.
+    """
+    scope = None
+
+    def get_idents(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.delay = 0.0
+        limit = settings.THROTTLE_BUCKETS.get(self.scope)
+        if not limit:
+            return True
+        rate, burst = limit
+        store = get_store()
+        for ident in self.get_idents(request, view):
+            allowed, wait = store.consume(f'throttle:{self.scope}:{ident}', rate, burst)
+            if not allowed:
+                self.delay = max(self.delay, wait)
+        return not self.delay
+
+    def get_ident(self, request):
+        return client_address(request)
+
+    def wait(self):
+        return self.delay
+
+
+class UserThrottle(TokenBucketThrottle):
+    """Overall request rate of each user, or of each client address for anonymous requests."""
+    scope = 'user'
+
+    def get_idents(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return [f'user:{request.user.pk}']
+        return [f'ip:{self.get_ident(request)}']
+
+
+class UploadThrottle(TokenBucketThrottle):
+    scope = 'upload'
+
+    def get_idents(self, request, view):
+        return [f'user:{request.user.pk}']
+
+
+class LoginThrottle(TokenBucketThrottle):
+    """Credential attempts, limited per client address and per targeted account."""
+    scope = 'login'
+
+    def get_idents(self, request, view):
+        idents = [f'ip:{self.get_ident(request)}']
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if isinstance(email, str) and email:
+            idents.append(f'account:{email.strip().lower()}')
+        return idents
+
+
+class DownloadThrottle(TokenBucketThrottle):
+    """Public downloads per client address."""
+    scope = 'download_ip'
+
+    def get_idents(self, request, view):
+        return [f'ip:{self.get_ident(request)}']
+
+
+class DownloadLinkThrottle(TokenBucketThrottle):
+    """Downloads of one public link, however many clients share it."""
+    scope = 'download_link'
+
+    def get_idents(self, request, view):
+        return [f"link:{view.kwargs.get('download_link')}"]
+
+
+class Shaper:
+    """Paces one download against a bandwidth bucket shared by all of the same client's downloads."""
+
+    def __init__(self, key, rate):
+        self.key = key
+        self.rate = rate
+
+    def delay(self, nbytes):
+        """Seconds to pause after sending ``nbytes`` so the client's downloads stay within ``rate``."""
+        # One second of burst, so short downloads are not slowed down at all
+        return get_store().consume(self.key, self.rate, self.rate, cost=nbytes, debt=True)[1]
+
+
+def download_shaper(request):
+    """The ``Shaper`` for a download by ``request``'s client, or ``None`` when its tier is unlimited."""
+    user = getattr(request, 'user', None)
+    authenticated = bool(user and user.is_authenticated)
+    rate = settings.FILES_DOWNLOAD_BANDWIDTH.get(user.user_type if authenticated else 'anonymous')
+    if not rate:
+        return None
+    ident = f'user:{user.pk}' if authenticated else f'ip:{client_address(request)}'
+    return Shaper(f'bandwidth:{ident}', rate)
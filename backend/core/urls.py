@@ -19,8 +19,11 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from core.metrics import metrics_view
+
 urlpatterns = [
                   path("admin/", admin.site.urls),
                   path('api/auth/', include('authentication.urls')),
                   path('api/files/', include('files.urls')),
+                  path('metrics', metrics_view, name='metrics'),
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
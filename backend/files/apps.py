@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class FilesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "files"
+
+    def ready(self):
+        from . import processing, receivers  # noqa: F401  (registers the tasks, connects the counter receivers)
+
+        if settings.FILES_DOWNLOAD_BACKEND == 'x-accel-redirect':
+            from django.core.files.storage import default_storage
+            from .downloads import check_x_accel_locations
+            check_x_accel_locations(default_storage)
+
+        if settings.FILES_LOG_QUEUE:
+            from .log import install_queue
+            install_queue('files', maxsize=settings.FILES_LOG_QUEUE_SIZE)
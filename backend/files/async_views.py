@@ -0,0 +1,158 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from authentication.models import User
+from core.throttling import DownloadLinkThrottle, DownloadThrottle, UploadThrottle, UserThrottle
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import link_cache
+from .conditional import alisting_validators, not_modified, with_validators
+from .downloads import build_download_response
+from .models import File
+from .pagination import KeysetPagination, project, requested_fields
+from .query_budget import query_budget
+from .serializers import FileSerializer, FileUploadSerializer
+from .views import FILE_LISTING_ORDER, _link_target, _max_upload_size, _save_upload, _with_checksum
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines.
+
+    Authentication, permission and throttle checks may hit the database, so
+    ``initial()`` runs in Django's sync thread; the handler itself runs on the
+    event loop and offloads its own blocking work.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class FileListingView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+    kind = None
+
+    def get_queryset(self, request):
+        raise NotImplementedError
+
+    async def get(self, request):
+        etag, last_modified = await alisting_validators(request, self.kind)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        fields = requested_fields(request, FileSerializer)
+        paginator = KeysetPagination(ordering=FILE_LISTING_ORDER)
+        files = project(self.get_queryset(request), FileSerializer, fields, FILE_LISTING_ORDER)
+        page = await paginator.apaginate_queryset(files, request)
+        serializer = FileSerializer(page, many=True, fields=fields, context={'request': request})
+        return with_validators(paginator.get_paginated_response(serializer.data), etag, last_modified)
+
+
+class UploadedFilesView(FileListingView):
+    kind = 'uploaded_files'
+
+    def get_queryset(self, request):
+        return File.objects.filter(uploaded_by=request.user)
+
+
+class SharedFilesView(FileListingView):
+    kind = 'shared_files'
+
+    def get_queryset(self, request):
+        return File.objects.filter(shared_with=request.user)
+
+
+class UploadFileView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [UserThrottle, UploadThrottle]
+
+    async def post(self, request):
+        if request.user.user_type == User.UserType.GUEST:
+            return Response({
+                'error': 'Guests cannot upload files'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        # Parsing may spool the body to disk; keep it off the event loop
+        data = await asyncio.to_thread(lambda: request.data)
+        serializer = FileUploadSerializer(data=data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        file = serializer.validated_data['file']
+        max_size = _max_upload_size(request.user, 'FILES_MAX_UPLOAD_SIZE')
+        if file.size > max_size:
+            return Response({
+                'error': f'File size exceeds limit. Maximum size allowed is {max_size / 1048576}MB'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return await sync_to_async(_save_upload)(request, serializer, file.size)
+
+
+class DownloadFileView(AsyncAPIView):
+    throttle_classes = [DownloadThrottle, DownloadLinkThrottle]
+
+    async def get(self, request, download_link):
+        try:
+            link = uuid.UUID(download_link)
+        except ValueError:
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        file = None
+        target = await sync_to_async(link_cache.get)(link)  # a network round trip with a shared cache
+        if target is None:
+            try:
+                file = await File.objects.only('id', 'name', 'file', 'checksum', 'uploaded_date', 'expiry_date',
+                                               'processing_status').aget(download_link=link)
+            except File.DoesNotExist:
+                return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+            if file.processing_status == File.FAILED:
+                return Response({'error': 'File failed processing'}, status=status.HTTP_409_CONFLICT)
+            target = _link_target(file)
+
+        if target.expiry is not None and target.expiry < datetime.now(timezone.utc).timestamp():
+            return Response({'error': 'File has expired'}, status=status.HTTP_410_GONE)
+
+        if file is not None:
+            target = await sync_to_async(_with_checksum)(file, target)
+            if file.processing_status == File.READY:
+                await sync_to_async(link_cache.put)(link, target)
+
+        file = File(id=target.file_id, name=target.name, file=target.storage_name, checksum=target.checksum,
+                    uploaded_date=datetime.fromtimestamp(target.uploaded, timezone.utc))
+        try:
+            # Opening and stat-ing the stored file blocks; keep it off the event loop
+            return await sync_to_async(build_download_response, thread_sensitive=False)(
+                request, file, content_type=target.content_type, asynchronous=True)
+        except FileNotFoundError:
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
+get_uploaded_files = query_budget(2)(UploadedFilesView.as_view())
+get_shared_files = query_budget(2)(SharedFilesView.as_view())
+upload_file = UploadFileView.as_view()
+download_file = DownloadFileView.as_view()
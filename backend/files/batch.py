@@ -0,0 +1,52 @@
+"""
+Batch uploads: several files, or the members of one tar/zip archive, stored in one request.
+
+Tar archives (plain or compressed) are read in a single forward pass, so
+members are stored as they are decompressed; zip archives need their
+central directory and are read from the spooled upload.
+"""
+import tarfile
+import zipfile
+import zlib
+
+
+class BatchError(Exception):
+    """The batch as a whole cannot be stored (unreadable archive, too many files, over quota)."""
+
+
+def display_name(name):
+    """``name`` without drive, leading slashes or dot segments, so archive paths cannot escape anything."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts)[-255:]
+
+
+def entries(files=(), archive=None):
+    """Yield ``(name, stream, size)`` for each uploaded file, then for each regular file in ``archive``."""
+    for upload in files:
+        yield upload.name, upload, upload.size
+    if archive is not None:
+        yield from archive_members(archive)
+
+
+def archive_members(upload):
+    if zipfile.is_zipfile(upload):
+        upload.seek(0)
+        try:
+            with zipfile.ZipFile(upload) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as member:
+                            yield info.filename, member, info.file_size
+        except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError) as e:
+            # RuntimeError: encrypted members; NotImplementedError: unsupported compression
+            raise BatchError(f'Unreadable zip archive: {e}')
+        return
+
+    upload.seek(0)
+    try:
+        with tarfile.open(fileobj=upload, mode='r|*') as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info), info.size
+    except (tarfile.TarError, zlib.error, EOFError, OSError) as e:
+        raise BatchError(f'Archive must be a tar (optionally compressed) or zip file: {e}')
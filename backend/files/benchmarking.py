@@ -0,0 +1,78 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils.functional import empty
+
+
+@contextmanager
+def scratch_environment():
+    """
+    Run the enclosed block against a throw-away test database and MEDIA_ROOT.
+
+    SQLite test databases are created as fresh files rather than in memory:
+    Django never releases an in-memory test database within a process, and
+    worker threads need independent connections.
+    """
+    setup_test_environment()
+    # One private directory holds the media and the database, so no name in it can be claimed by anyone else
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    media_root = os.path.join(scratch, 'media')
+    os.mkdir(media_root)
+    connection = connections['default']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(scratch, 'db.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        # Benchmarks measure the application, not the limits put in front of it
+        with override_settings(MEDIA_ROOT=media_root, THROTTLE_BUCKETS={}, FILES_DOWNLOAD_BANDWIDTH={}):
+            default_storage._wrapped = empty
+            yield
+    finally:
+        default_storage._wrapped = empty
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = test_name
+        shutil.rmtree(scratch, ignore_errors=True)
+        teardown_test_environment()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, total_bytes=0, elapsed=None):
+    """Summarize per-request wall times (seconds) as a JSON-friendly dict."""
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    summary = {
+        'requests': len(samples),
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+    if total_bytes:
+        summary['throughput_mb_s'] = round(total_bytes / 1048576 / elapsed, 2) if elapsed else 0.0
+    return summary
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,109 @@
+import hashlib
+import io
+
+from django.core.files import File as DjangoFile
+
+
+class HashingReader:
+    """Read-only wrapper that hashes and counts bytes as storage pulls them from a stream."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.bytes_read = 0
+        self.overflow = False
+        self._hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        remaining = self.limit - self.bytes_read
+        if remaining <= 0:
+            # Probe a single byte so oversized bodies are detected, not silently truncated
+            if self.stream.read(1):
+                self.overflow = True
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        self._hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+
+
+class ChunkedFileReader(io.RawIOBase):
+    """Sequential reader that concatenates the stored chunks of an upload session."""
+
+    def __init__(self, storage, names):
+        self.storage = storage
+        self.names = list(names)
+        self._current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self._current is None:
+                if not self.names:
+                    return 0
+                self._current = self.storage.open(self.names.pop(0), 'rb')
+            data = self._current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+            self._current.close()
+            self._current = None
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
+
+
+def file_checksum(fileobj):
+    """SHA-256 hex digest of a Django ``File``/``UploadedFile``, read in chunks."""
+    digest = hashlib.sha256()
+    for block in fileobj.chunks():
+        digest.update(block)
+    try:
+        fileobj.seek(0)
+    except (AttributeError, io.UnsupportedOperation):
+        pass
+    return digest.hexdigest()
+
+
+def wrap_chunk(stream, limit):
+    """Return a (django File, HashingReader) pair suitable for ``Storage.save``."""
+    reader = HashingReader(stream, limit)
+    return DjangoFile(reader), reader
+
+
+def assemble_chunks(storage, session):
+    """
+    Return a (django File, HashingReader) pair streaming the session's chunks in order.
+
+    The reader hashes the bytes as storage pulls them, so the assembled
+    upload is written and checksummed in a single pass over the chunks.
+    """
+    names = [session.chunk_name(index) for index in range(session.total_chunks)]
+    content, reader = wrap_chunk(io.BufferedReader(ChunkedFileReader(storage, names)), session.total_size)
+    content.size = session.total_size
+    return content, reader
+
+
+def received_ranges(indexes):
+    """Collapse sorted chunk indexes into inclusive ``[first, last]`` runs."""
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .models import ListingVersion
+
+
+def listing_validators(request, kind):
+    """
+    Return a weak ``(etag, last_modified)`` pair for one of the caller's listings.
+
+    ``kind`` is ``'uploaded_files'`` or ``'shared_files'``. The validators come
+    from the per-user change counter, so they cost a single primary-key read and
+    never touch the files themselves. The query string and ``Accept`` header
+    are folded into the ETag so each page, projection and encoding is validated
+    separately.
+    """
+    # A plain read first, so safe requests stay on a replica; the row is only created once per user
+    version = (ListingVersion.objects.filter(user=request.user).first() or
+               ListingVersion.objects.get_or_create(user=request.user)[0])
+    return _validators(request, kind, version)
+
+
+async def alisting_validators(request, kind):
+    """Async variant of :func:`listing_validators`."""
+    version = (await ListingVersion.objects.filter(user=request.user).afirst() or
+               (await ListingVersion.objects.aget_or_create(user=request.user))[0])
+    return _validators(request, kind, version)
+
+
+def _validators(request, kind, version):
+    counter = getattr(version, kind)
+    modified = getattr(version, f'{kind}_modified')
+    variant = f"{request.META.get('QUERY_STRING', '')}|{request.META.get('HTTP_ACCEPT', '')}"
+    query = hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()[:8]
+    etag = f'W/"{kind}-{request.user.id}-{counter}-{query}"'
+    # Kept sub-second: Last-Modified is sent truncated, so an If-Modified-Since naming the second of the last
+    # change no longer matches and a listing changed again within that second is not answered with a 304
+    return etag, modified.timestamp()
+
+
+def not_modified(request, etag, last_modified):
+    """Return a 304 (or 412) response when the client's validators still match, otherwise ``None``."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        with_validators(response, etag, last_modified)
+    return response
+
+
+def with_validators(response, etag, last_modified):
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,265 @@
+import asyncio
+import mimetypes
+import os
+import re
+import time
+import weakref
+
+from core.throttling import download_shaper
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import parse_http_date_safe
+
+from .conditional import not_modified, with_validators
+from .storage import local_path
+
+BACKEND_STREAM = 'stream'
+BACKEND_SENDFILE = 'sendfile'
+BACKEND_X_ACCEL_REDIRECT = 'x-accel-redirect'
+BACKEND_X_SENDFILE = 'x-sendfile'
+BACKENDS = (BACKEND_STREAM, BACKEND_SENDFILE, BACKEND_X_ACCEL_REDIRECT, BACKEND_X_SENDFILE)
+
+BLOCK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.IGNORECASE)
+UNSATISFIABLE = 'unsatisfiable'
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header against a file of ``size`` bytes.
+
+    Returns an inclusive ``(start, end)`` tuple, ``None`` when the whole file
+    should be served (no header, malformed or multi-range requests), or
+    ``UNSATISFIABLE`` when the range lies entirely outside the file.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header)
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            return UNSATISFIABLE
+        return max(0, size - length), size - 1
+    start = int(first)
+    if start >= size:
+        return UNSATISFIABLE
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def if_range_matches(header, etag, last_modified):
+    """Evaluate ``If-Range``: a missing header or a validator match means the range may be honoured."""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        # Only strong validators can satisfy If-Range
+        return bool(etag) and header == etag and not etag.startswith('W/')
+    since = parse_http_date_safe(header)
+    return since is not None and last_modified is not None and since == last_modified
+
+
+def requested_range(request, size, etag=None, last_modified=None):
+    if not if_range_matches(request.headers.get('If-Range'), etag, last_modified):
+        return None
+    return parse_range(request.headers.get('Range'), size)
+
+
+class RangeFile:
+    """File-like view over ``[start, start + length)`` of an open file that keeps ``fileno()`` usable."""
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        self.fileobj.seek(start)
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def _stream_range(open_file, start, length, shaper=None):
+    with open_file() as fileobj:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = fileobj.read(min(BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            if shaper is not None:
+                time.sleep(shaper.delay(len(data)))
+            yield data
+
+
+_io_slots = weakref.WeakKeyDictionary()
+
+
+def _io_slot():
+    """The running loop's semaphore bounding how many blocking reads are in flight at once."""
+    loop = asyncio.get_running_loop()
+    if loop not in _io_slots:
+        _io_slots[loop] = asyncio.Semaphore(settings.FILES_ASYNC_IO_CONCURRENCY)
+    return _io_slots[loop]
+
+
+async def _astream_range(open_file, start, length, shaper=None):
+    """
+    Async counterpart of ``_stream_range`` for ASGI.
+
+    Each block is read in a worker thread, so the event loop only waits on
+    slow clients and on bandwidth pacing; at most
+    ``FILES_ASYNC_IO_CONCURRENCY`` reads run at a time however many
+    downloads are open.
+    """
+    async with _io_slot():
+        fileobj = await asyncio.to_thread(open_file)
+    try:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            async with _io_slot():
+                data = await asyncio.to_thread(fileobj.read, min(BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            if shaper is not None:
+                await asyncio.sleep(shaper.delay(len(data)))
+            yield data
+    finally:
+        fileobj.close()
+
+
+def build_download_response(request, file, backend=None, content_type=None, asynchronous=False):
+    """
+    Build the response body for ``file`` once all access checks have passed.
+
+    ``stream`` and ``sendfile`` serve the bytes from this process (``sendfile``
+    hands the open descriptor to the server's ``wsgi.file_wrapper`` so servers
+    such as gunicorn can use ``os.sendfile``); ``x-accel-redirect`` and
+    ``x-sendfile`` only emit headers and let nginx/Apache transfer the file and
+    apply ``Range``/``If-Range`` themselves; for storages without local paths
+    (S3) they redirect to the object's presigned URL instead, or stream when
+    there is none (encryption at rest) or the download is paced. With ``asynchronous`` (ASGI views)
+    both in-process backends stream through the async reader, since the ASGI
+    handler would otherwise buffer a synchronous body in memory.
+
+    Downloads by tiers with a ``FILES_DOWNLOAD_BANDWIDTH`` limit are paced in
+    process (so ``sendfile`` falls back to streaming for them), or get nginx's
+    per-connection ``X-Accel-Limit-Rate``.
+    """
+    backend = backend or settings.FILES_DOWNLOAD_BACKEND
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured(f'Unknown FILES_DOWNLOAD_BACKEND {backend!r}; expected one of {BACKENDS}')
+    storage, name = file.file.storage, file.file.name
+    etag = file.etag
+    last_modified = int(file.uploaded_date.timestamp())
+
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    if content_type is None:
+        # Blobs are stored under their digest, so the type comes from the user-facing name
+        content_type = mimetypes.guess_type(file.name)[0] or 'application/octet-stream'
+
+    path = local_path(storage, name)
+    shaper = download_shaper(request)
+    if backend in (BACKEND_X_ACCEL_REDIRECT, BACKEND_X_SENDFILE) and path is None:
+        download_url = getattr(storage, 'download_url', None)
+        if download_url is not None and shaper is None:
+            # Remote storage: the object store's own (presigned) URL is the offload target
+            response = HttpResponseRedirect(download_url(name, _disposition(file), content_type))
+            return _finish(response, file, etag, last_modified)
+        # Encrypted at rest (only this process can produce the plaintext), or paced and accounted here
+        backend = BACKEND_STREAM
+    if backend in (BACKEND_X_ACCEL_REDIRECT, BACKEND_X_SENDFILE):
+        response = HttpResponse(content_type=content_type)
+        if backend == BACKEND_X_ACCEL_REDIRECT:
+            response['X-Accel-Redirect'] = x_accel_location(storage, name)
+            if shaper is not None:
+                response['X-Accel-Limit-Rate'] = str(int(shaper.rate))
+        else:
+            response['X-Sendfile'] = path
+        return _finish(response, file, etag, last_modified)
+
+    size = storage.size(name)
+    byte_range = requested_range(request, size, etag=etag, last_modified=last_modified)
+    if byte_range == UNSATISFIABLE:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return _finish(response, file, etag, last_modified)
+
+    start, end = byte_range or (0, size - 1)
+    length = max(0, end - start + 1)
+
+    def open_file():
+        return storage.open(name, 'rb')
+
+    if asynchronous:
+        response = StreamingHttpResponse(_astream_range(open_file, start, length, shaper), content_type=content_type)
+    elif backend == BACKEND_SENDFILE and path is not None and shaper is None:
+        response = FileResponse(RangeFile(open(path, 'rb'), start, length), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(_stream_range(open_file, start, length, shaper), content_type=content_type)
+
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    return _finish(response, file, etag, last_modified)
+
+
+def x_accel_prefix(root, default_root):
+    """The nginx ``internal`` location aliased to the storage volume ``root``."""
+    root = os.path.abspath(root)
+    for volume, prefix in settings.FILES_X_ACCEL_REDIRECT_PREFIXES.items():
+        if os.path.abspath(volume) == root:
+            return prefix
+    if root == os.path.abspath(default_root):
+        return settings.FILES_X_ACCEL_REDIRECT_PREFIX
+    raise ImproperlyConfigured(f'Storage volume {root} has no nginx location in FILES_X_ACCEL_REDIRECT_PREFIXES')
+
+
+def x_accel_location(storage, name):
+    if hasattr(storage, 'split_path'):
+        root, relative = storage.split_path(name)
+    else:
+        root, relative = storage.location, name
+    return x_accel_prefix(root, storage.location) + relative
+
+
+def check_x_accel_locations(storage):
+    """Refuse to start when a volume of ``storage`` could not be handed to nginx."""
+    for root in storage.roots() if hasattr(storage, 'roots') else ():
+        x_accel_prefix(root, storage.location)
+
+
+def _disposition(file):
+    return f'attachment; filename="{file.name}"'
+
+
+def _finish(response, file, etag, last_modified):
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = _disposition(file)
+    return with_validators(response, etag, last_modified)
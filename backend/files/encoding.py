@@ -0,0 +1,52 @@
+import base64
+
+from rest_framework import serializers
+
+# encryption_metadata wire formats. Version 1 is the original JSON array of byte
+# values; version 2 is base64url in JSON and raw bytes in MessagePack.
+METADATA_V1 = '1'
+METADATA_V2 = '2'
+
+
+def encode_iv(iv, request=None):
+    """Represent an IV for the response format negotiated on ``request``."""
+    iv = bytes(iv) if iv else b''
+    if request is not None and getattr(request.accepted_renderer, 'format', None) == 'msgpack':
+        return iv
+    if request is not None and request.version == METADATA_V2:
+        return base64.urlsafe_b64encode(iv).decode().rstrip('=')
+    return list(iv)
+
+
+def encode_metadata(key, iv, request=None):
+    metadata = {'key': key if key else None, 'iv': encode_iv(iv, request)}
+    if request is not None and (request.version == METADATA_V2 or
+                                getattr(request.accepted_renderer, 'format', None) == 'msgpack'):
+        metadata['v'] = 2
+    return metadata
+
+
+def decode_iv(value):
+    """Accept every supported IV encoding: raw bytes, base64url text or the legacy byte array."""
+    if value is None or value == '' or value == []:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, str):
+        try:
+            return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        except ValueError:
+            raise serializers.ValidationError("IV must be base64url encoded")
+    if isinstance(value, list):
+        try:
+            return bytes(value)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("IV array must contain byte values (0-255)")
+    raise serializers.ValidationError("Unsupported IV encoding")
+
+
+def validate_metadata(value):
+    """Normalize client encryption_metadata to ``{'key': ..., 'iv': bytes or None}``."""
+    if not isinstance(value, dict):
+        raise serializers.ValidationError("Encryption metadata must be an object")
+    return {'key': value.get('key'), 'iv': decode_iv(value.get('iv'))}
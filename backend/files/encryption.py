@@ -0,0 +1,242 @@
+"""
+Chunked AES-256-GCM format for encryption at rest.
+
+An encrypted object is a fixed-size header followed by the plaintext split
+into ``chunk_size`` pieces, each sealed on its own (ciphertext + 16-byte tag)::
+
+    magic "FGCM" | version | chunk_size (u32) | key id (8) | wrap nonce (12)
+    | wrapped data key (48) | nonce prefix (7) | chunk 0 | chunk 1 | ...
+
+Every object gets a random data key, stored wrapped by the master key named
+in the header. Chunk nonces are ``prefix | index (u32) | last flag`` (the
+STREAM construction), and the header is each chunk's associated data, so
+chunks cannot be reordered, truncated or moved between objects without
+failing authentication. Any chunk can be decrypted on its own, which is what
+makes ranged reads cheap.
+"""
+import base64
+import hashlib
+import io
+import os
+import struct
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .signals import decryption_failed
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # optional dependency
+    AESGCM = None
+
+    class InvalidTag(Exception):
+        pass
+
+MAGIC = b'FGCM'
+VERSION = 1
+TAG_SIZE = 16
+KEY_ID_SIZE = 8
+NONCE_PREFIX_SIZE = 7
+HEADER = struct.Struct('>4sBI8s12s48s7s')
+WRAP_AAD = b'files-data-key'
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def _failed(message):
+    decryption_failed.send(sender=DecryptionError, message=message)
+    return DecryptionError(message)
+
+
+def parse_keys(values):
+    """Decode base64 master keys into ``{key id: key}``; the first key is the one new objects use."""
+    keys = {}
+    for value in values:
+        key = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        if len(key) != 32:
+            raise ImproperlyConfigured('Encryption master keys must be 32 bytes (base64-encoded)')
+        keys[key_id(key)] = key
+    return keys
+
+
+def key_id(key):
+    return hashlib.sha256(key).digest()[:KEY_ID_SIZE]
+
+
+def encrypted_size(plaintext_size, chunk_size):
+    chunks = max(1, -(-plaintext_size // chunk_size))
+    return HEADER.size + plaintext_size + chunks * TAG_SIZE
+
+
+def plaintext_size(stored_size, chunk_size):
+    body = stored_size - HEADER.size
+    chunks = max(1, -(-body // (chunk_size + TAG_SIZE)))
+    return body - chunks * TAG_SIZE
+
+
+class Envelope:
+    """Parsed header of one object: the unwrapped data key plus what is needed to derive chunk nonces."""
+
+    def __init__(self, header, chunk_size, data_key, nonce_prefix):
+        self.header = header
+        self.chunk_size = chunk_size
+        self.aead = AESGCM(data_key)
+        self.nonce_prefix = nonce_prefix
+
+    @classmethod
+    def create(cls, master_keys, chunk_size):
+        if AESGCM is None:
+            raise ImproperlyConfigured('Encryption at rest requires the cryptography package')
+        active_id, master_key = next(iter(master_keys.items()))
+        data_key = AESGCM.generate_key(bit_length=256)
+        wrap_nonce = os.urandom(12)
+        wrapped = AESGCM(master_key).encrypt(wrap_nonce, data_key, WRAP_AAD)
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        header = HEADER.pack(MAGIC, VERSION, chunk_size, active_id, wrap_nonce, wrapped, nonce_prefix)
+        return cls(header, chunk_size, data_key, nonce_prefix)
+
+    @classmethod
+    def parse(cls, header, master_keys):
+        if AESGCM is None:
+            raise ImproperlyConfigured('Encryption at rest requires the cryptography package')
+        if len(header) != HEADER.size:
+            raise _failed('Truncated header')
+        magic, version, chunk_size, kid, wrap_nonce, wrapped, nonce_prefix = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise _failed('Not an encrypted object')
+        if kid not in master_keys:
+            raise _failed('Object was encrypted with an unknown master key')
+        try:
+            data_key = AESGCM(master_keys[kid]).decrypt(wrap_nonce, wrapped, WRAP_AAD)
+        except InvalidTag:
+            raise _failed('Data key failed authentication')
+        return cls(header, chunk_size, data_key, nonce_prefix)
+
+    def nonce(self, index, last):
+        return self.nonce_prefix + struct.pack('>IB', index, 1 if last else 0)
+
+    def seal(self, index, plaintext, last):
+        return self.aead.encrypt(self.nonce(index, last), plaintext, self.header)
+
+    def open(self, index, ciphertext, last):
+        try:
+            return self.aead.decrypt(self.nonce(index, last), ciphertext, self.header)
+        except InvalidTag:
+            raise _failed(f'Chunk {index} failed authentication')
+
+
+def is_encrypted(prefix):
+    return prefix[:len(MAGIC)] == MAGIC
+
+
+class EncryptingReader(io.RawIOBase):
+    """
+    Non-seekable stream of the encrypted form of ``source``, produced one chunk at a time.
+
+    Only the current and the look-ahead plaintext chunk are held in memory;
+    the look-ahead tells whether the current chunk is the last one.
+    """
+
+    def __init__(self, source, envelope):
+        self.source = source
+        self.envelope = envelope
+        self._chunks = self._generate()
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def _read_plain(self):
+        size = self.envelope.chunk_size
+        parts, remaining = [], size
+        while remaining:
+            data = self.source.read(remaining)
+            if not data:
+                break
+            parts.append(data)
+            remaining -= len(data)
+        return b''.join(parts)
+
+    def _generate(self):
+        yield self.envelope.header
+        index, current = 0, self._read_plain()
+        while True:
+            following = self._read_plain() if len(current) == self.envelope.chunk_size else b''
+            last = not following
+            yield self.envelope.seal(index, current, last)
+            if last:
+                return
+            index, current = index + 1, following
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        count = min(len(buffer), len(self._buffer))
+        buffer[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+
+class DecryptingReader(io.RawIOBase):
+    """
+    Seekable plaintext view of an encrypted object.
+
+    A read decrypts only the chunks it overlaps, so a ranged download of a
+    large file touches a few chunks of it. At most one decrypted chunk is
+    cached.
+    """
+
+    def __init__(self, fileobj, envelope, stored_size, name=None):
+        self.fileobj = fileobj
+        self.envelope = envelope
+        self.name = name
+        self.size = plaintext_size(stored_size, envelope.chunk_size)
+        self.chunk_count = max(1, -(-self.size // envelope.chunk_size))
+        self._position = 0
+        self._cached = (None, b'')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        else:
+            position = self.size + offset
+        self._position = max(0, position)
+        return self._position
+
+    def _chunk(self, index):
+        if self._cached[0] != index:
+            chunk_size = self.envelope.chunk_size
+            self.fileobj.seek(HEADER.size + index * (chunk_size + TAG_SIZE))
+            ciphertext = self.fileobj.read(chunk_size + TAG_SIZE)
+            self._cached = (index, self.envelope.open(index, ciphertext, index == self.chunk_count - 1))
+        return self._cached[1]
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        index, offset = divmod(self._position, self.envelope.chunk_size)
+        data = self._chunk(index)[offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super().close()
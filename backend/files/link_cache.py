@@ -0,0 +1,66 @@
+from typing import NamedTuple
+
+from core.caching import is_process_local
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+KEY_PREFIX = 'files:link:'
+
+
+class LinkTarget(NamedTuple):
+    """Everything ``download_file`` needs to serve a public link without loading the File row."""
+    file_id: int
+    name: str
+    storage_name: str
+    checksum: str
+    uploaded: float
+    expiry: float | None
+    content_type: str
+
+
+def _shared():
+    alias = settings.FILES_LINK_CACHE_ALIAS
+    if not alias:
+        return None
+    cache = caches[alias]
+    # A LocMem alias lives in one worker, which would keep serving links other workers changed
+    return None if is_process_local(cache) else cache
+
+
+def enabled():
+    """
+    Whether links may be cached at all.
+
+    Links live only in the shared backend, never in a per-process layer in
+    front of it: files change in every web worker, in ``run_tasks`` and in
+    the management commands, and only a shared backend sees all of their
+    evictions. Without one, nothing is cached.
+    """
+    return _shared() is not None
+
+
+def get(link):
+    """Return the cached ``LinkTarget`` for ``link``, or ``None``."""
+    if (shared := _shared()) is None:
+        return None
+    target = shared.get(KEY_PREFIX + str(link))
+    return None if target is None else LinkTarget(*target)
+
+
+def put(link, target):
+    """Cache ``target``; only for files that are ``ready``, whose stored bytes no longer move."""
+    if (shared := _shared()) is not None:
+        shared.set(KEY_PREFIX + str(link), tuple(target), settings.FILES_LINK_CACHE_TIMEOUT)
+
+
+def invalidate(links):
+    """
+    Forget ``links`` once the current transaction commits.
+
+    Waiting for the commit keeps a concurrent download from re-caching the old
+    row in between.
+    """
+    keys = [KEY_PREFIX + str(link) for link in links if link]
+    if keys and (shared := _shared()) is not None:
+        transaction.on_commit(lambda: shared.delete_many(keys))
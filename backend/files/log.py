@@ -0,0 +1,193 @@
+"""
+Structured logging for the files app.
+
+Events are logged as ``event(logger, 'upload.saved', size=...)`` and written
+as one JSON object per line, tagged with the id, method, path and user of the
+request that produced them. ``install_queue`` moves a logger's handlers
+behind a ``QueueHandler`` so request threads only enqueue records and a
+single listener thread does the formatting and file I/O.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import empty
+
+_request = contextvars.ContextVar('files_log_request', default=None)
+
+CONTEXT_FIELDS = ('request_id', 'method', 'path', 'user_id')
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+
+def event(logger, name, level=logging.INFO, sample=1.0, exc_info=False, **fields):
+    """
+    Log the event ``name`` with ``fields`` as structured data.
+
+    ``sample`` keeps only that fraction of the events, decided before a
+    record is even built; the rate is logged alongside so counts can be
+    scaled back up.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample < 1.0 and random.random() >= sample:
+        return
+    if sample < 1.0:
+        fields['sample_rate'] = sample
+    logger.log(level, name, exc_info=exc_info, extra={'event': name, 'fields': fields})
+
+
+def _user_id(request):
+    # Only report a user that authentication has already resolved; never trigger a lookup from a log call
+    user = request.__dict__.get('user')
+    if user is None or getattr(user, '_wrapped', None) is empty:
+        return None
+    return user.pk
+
+
+def current_context():
+    request = _request.get()
+    if request is None:
+        return {}
+    return {
+        'request_id': request.log_request_id,
+        'method': request.method,
+        'path': request.path,
+        'user_id': _user_id(request),
+    }
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request's context; must run in the thread that logged them."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            context = current_context()
+            for field in CONTEXT_FIELDS:
+                setattr(record, field, context.get(field))
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', None) or record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        payload.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or erroring when the listener falls behind."""
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare, keep the structured attributes instead of pre-formatting everything
+        # into the message; only what cannot cross threads (args, live tracebacks) is resolved here.
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listeners = []
+_traceback_formatter = logging.Formatter()
+
+
+def install_queue(name, maxsize=10000):
+    """
+    Move the handlers of logger ``name`` onto a background listener thread.
+
+    Request context is captured before the hand-off, since the listener
+    thread cannot see the request's context variables.
+    """
+    logger = logging.getLogger(name)
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+    if not handlers:
+        return None
+    handler = DroppingQueueHandler(queue.Queue(maxsize))
+    handler.addFilter(RequestContextFilter())
+    listener = logging.handlers.QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    for existing in handlers:
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    listener.start()
+    _listeners.append(listener)
+    return handler
+
+
+@atexit.register
+def _stop_listeners():
+    while _listeners:
+        _listeners.pop().stop()  # drains whatever is still queued
+
+
+class RequestContextMiddleware:
+    """Give every request an id (the client's ``X-Request-ID`` or a fresh one) and expose it to log records."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        request.log_request_id = request.headers.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex
+        return _request.set(request)
+
+    def _finish(self, request, response, token):
+        _request.reset(token)
+        response[REQUEST_ID_HEADER] = request.log_request_id
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _request.reset(token)
+            raise
+        return self._finish(request, response, token)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _request.reset(token)
+            raise
+        return self._finish(request, response, token)
+
@@ -0,0 +1,259 @@
+import hashlib
+import io
+import json
+import platform
+import random
+
+import django
+from authentication.models import User
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from files.benchmarking import Timer, scratch_environment, summarize
+from files.models import File, RoleUpgradeRequest
+
+PASSWORD = 'bench-password'
+BATCH_SIZE = 5000
+# Compared between runs; a run is worse when these grow (or throughput drops) by more than the threshold
+COMPARED = ('p50_ms', 'p95_ms', 'queries_mean', 'throughput_rps')
+
+
+def seed(rng, users, files, shares, applicants, payload):
+    """
+    Bulk-insert ``users`` users, ``files`` files owned by the non-guests among
+    them, ``shares`` share edges per file, and ``applicants`` guests with a
+    pending upgrade request. Every file row points at the same stored
+    ``payload``, so seeding a million rows writes one object to storage.
+    """
+    # One hash for everyone: hashing per user would dominate seeding
+    password = make_password(PASSWORD)
+    types = [User.UserType.ADMIN] + [
+        rng.choices((User.UserType.ADMIN, User.UserType.REGULAR, User.UserType.GUEST), (5, 60, 35))[0]
+        for _ in range(users - 1)]
+    User.objects.bulk_create(
+        [User(username=f'user{index}@bench.example', email=f'user{index}@bench.example', password=password,
+              user_type=user_type) for index, user_type in enumerate(types)] +
+        [User(username=f'applicant{index}@bench.example', email=f'applicant{index}@bench.example',
+              password=password, user_type=User.UserType.GUEST) for index in range(applicants)],
+        batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.filter(username__startswith='user').order_by('id').values_list('id', flat=True))
+    owners = [user_id for user_id, user_type in zip(user_ids, types) if user_type != User.UserType.GUEST]
+    RoleUpgradeRequest.objects.bulk_create(
+        [RoleUpgradeRequest(user_id=user_id, current_role=User.UserType.GUEST,
+                            requested_role=User.UserType.REGULAR)
+         for user_id in User.objects.filter(username__startswith='applicant').values_list('id', flat=True)],
+        batch_size=BATCH_SIZE)
+
+    name = default_storage.save('uploads/bench-payload.bin', ContentFile(payload))
+    checksum = hashlib.sha256(payload).hexdigest()
+    through = File.shared_with.through
+    for start in range(0, files, BATCH_SIZE):
+        with transaction.atomic():
+            created = File.objects.bulk_create([
+                File(name=f'file{index}.bin', file=name, extension='bin', size=len(payload), checksum=checksum,
+                     uploaded_by_id=rng.choice(owners), status='public' if rng.random() < 0.2 else 'private')
+                for index in range(start, min(start + BATCH_SIZE, files))])
+            edges = {(file.id, user_id) for file in created
+                     for user_id in rng.sample(user_ids, min(shares, len(user_ids)))
+                     if user_id != file.uploaded_by_id}
+            through.objects.bulk_create([through(file_id=file_id, user_id=user_id) for file_id, user_id in edges],
+                                        batch_size=BATCH_SIZE)
+
+    # Bulk inserts skip the receivers that keep the dashboard counters current
+    call_command('reconcile_storage', stdout=io.StringIO())
+    return user_ids, owners
+
+
+class Scenarios:
+    """
+    Each scenario method returns the next request to send: ``(user id to
+    authenticate as or None, method, path, data, format, expected status)``.
+    """
+
+    def __init__(self, rng, user_ids, owners, applicants, upload_kb):
+        self.rng = rng
+        self.user_ids = user_ids
+        self.owners = owners
+        self.applicants = applicants
+        self.payload = b'\0' * (upload_kb * 1024)
+        # Bulk-created ids are contiguous, so a random offset from the first is a uniform sample
+        self.first_file = File.objects.order_by('id').values_list('id', flat=True).first()
+        self.file_count = File.objects.count()
+        self.admin_id = user_ids[0]
+        self.uploads = 0
+
+    def random_file(self):
+        return File.objects.values('id', 'uploaded_by_id', 'download_link').get(
+            id=self.first_file + self.rng.randrange(self.file_count))
+
+    def login(self):
+        email = f'user{self.rng.randrange(len(self.user_ids))}@bench.example'
+        return None, 'post', '/api/auth/login/', {'email': email, 'password': PASSWORD}, 'json', 200
+
+    def list_uploaded(self):
+        return self.rng.choice(self.owners), 'get', '/api/files/uploaded-files/', None, None, 200
+
+    def list_shared(self):
+        return self.rng.choice(self.user_ids), 'get', '/api/files/shared-files/', None, None, 200
+
+    def upload(self):
+        self.uploads += 1
+        upload = SimpleUploadedFile(f'upload{self.uploads}.bin', self.payload)
+        return (self.rng.choice(self.owners), 'post', '/api/files/upload/',
+                {'file': upload, 'encryption_metadata': '{}'}, 'multipart', 201)
+
+    def download(self):
+        file = self.random_file()
+        return None, 'get', f'/api/files/download/{file["download_link"]}/', None, None, 200
+
+    def share(self):
+        file = self.random_file()
+        emails = [f'user{self.rng.randrange(len(self.user_ids))}@bench.example' for _ in range(2)]
+        return (file['uploaded_by_id'], 'post', '/api/files/share/', {'file_ids': [file['id']], 'emails': emails},
+                'json', 200)
+
+    def approve(self):
+        applicant = self.applicants.pop()
+        return self.admin_id, 'post', f'/api/files/approve-upgrade/{applicant}/', None, None, 200
+
+
+SCENARIOS = ('login', 'list_uploaded', 'list_shared', 'upload', 'download', 'share', 'approve')
+
+
+def compare(baseline, candidate, threshold):
+    """One row per scenario and metric present in both reports, flagged when it got worse by over ``threshold`` %."""
+    rows = []
+    for scenario, before in baseline['scenarios'].items():
+        after = candidate['scenarios'].get(scenario)
+        if after is None:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            if old:
+                change = round((new - old) / old * 100, 1)
+                regressed = (-change if metric == 'throughput_rps' else change) > threshold
+            else:
+                # Nothing to take a percentage of: any growth from zero (say, queries) is a regression
+                change, regressed = None, new > old and metric != 'throughput_rps'
+            rows.append({'scenario': scenario, 'metric': metric, 'baseline': old, 'candidate': new,
+                         'change_pct': change, 'regressed': regressed})
+    return rows
+
+
+class Command(BaseCommand):
+    help = ('Seeds a synthetic dataset and drives the API endpoints end to end, reporting throughput, latency '
+            'percentiles and queries per request as JSON; --compare fails on regressions against a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Seeded users')
+        parser.add_argument('--files', type=int, default=10000, help='Seeded File rows (up to millions)')
+        parser.add_argument('--shares-per-file', type=int, default=3, help='shared_with edges per seeded file')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario first')
+        parser.add_argument('--upload-kb', type=int, default=64, help='Size of each uploaded and seeded file')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help='Run only this scenario (repeatable); all by default')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the dataset and request mix')
+        parser.add_argument('--output', help='Also write the report to this file')
+        parser.add_argument('--compare', nargs='+', metavar='REPORT',
+                            help='Baseline report to compare this run against, or a baseline and a candidate '
+                                 'report to compare without running')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Regression threshold for --compare, in percent')
+
+    def handle(self, *args, **options):
+        if options['compare'] and len(options['compare']) > 2:
+            raise CommandError('--compare takes a baseline report and optionally a candidate report')
+        if options['compare'] and len(options['compare']) == 2:
+            report = self.load(options['compare'][1])
+        else:
+            report = self.run(options)
+            self.stdout.write(json.dumps(report, indent=2))
+            if options['output']:
+                with open(options['output'], 'w') as output:
+                    json.dump(report, output, indent=2)
+
+        if options['compare']:
+            baseline = self.load(options['compare'][0])
+            if baseline['config'] != report['config']:
+                self.stderr.write('Warning: the reports were produced with different configurations')
+            rows = compare(baseline, report, options['threshold'])
+            self.stdout.write(json.dumps({'threshold_pct': options['threshold'], 'comparison': rows}, indent=2))
+            regressions = [row for row in rows if row['regressed']]
+            if regressions:
+                raise CommandError(f'{len(regressions)} metric(s) regressed by more than {options["threshold"]}%: '
+                                   + ', '.join(f'{row["scenario"]}.{row["metric"]}' for row in regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def load(self, path):
+        try:
+            with open(path) as report:
+                return json.load(report)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read report {path}: {e}')
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        scenarios = options['scenario'] or SCENARIOS
+        calls = options['warmup'] + options['requests']
+        applicants = calls if 'approve' in scenarios else 0
+        report = {'config': {key: options[key] for key in ('users', 'files', 'shares_per_file', 'requests',
+                                                             'warmup', 'upload_kb', 'seed')},
+                  'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                                  'database': connection.vendor},
+                  'scenarios': {}}
+        report['config']['scenarios'] = list(scenarios)
+
+        # As in production; with DEBUG on every seeding INSERT would also be kept in connection.queries
+        with scratch_environment(), override_settings(DEBUG=False):
+            with Timer() as timer:
+                user_ids, owners = seed(rng, options['users'], options['files'], options['shares_per_file'],
+                                        applicants, b'\0' * (options['upload_kb'] * 1024))
+            report['seed_s'] = round(timer.elapsed, 2)
+            applicant_ids = list(User.objects.filter(username__startswith='applicant')
+                                 .order_by('-id').values_list('id', flat=True))
+            builder = Scenarios(rng, user_ids, owners, applicant_ids, options['upload_kb'])
+            client = APIClient()
+            tokens = {}
+            failures = []
+
+            for scenario in scenarios:
+                samples, queries = [], []
+                for call in range(calls):
+                    user_id, method, path, data, format, expected = getattr(builder, scenario)()
+                    if user_id is None:
+                        client.credentials()
+                    else:
+                        if user_id not in tokens:
+                            tokens[user_id] = str(RefreshToken.for_user(User(id=user_id)).access_token)
+                        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[user_id]}')
+                    with CaptureQueriesContext(connection) as captured, Timer() as timer:
+                        response = getattr(client, method)(path, data, format=format)
+                        if response.streaming:
+                            for _ in response.streaming_content:
+                                pass
+                        response.close()
+                    if response.status_code != expected:
+                        failures.append(f'{scenario}: {method.upper()} {path} returned {response.status_code}')
+                    if call >= options['warmup']:
+                        samples.append(timer.elapsed)
+                        queries.append(len(captured.captured_queries))
+
+                summary = summarize(samples)
+                summary['queries_mean'] = round(sum(queries) / len(queries), 2) if queries else 0.0
+                summary['queries_max'] = max(queries, default=0)
+                report['scenarios'][scenario] = summary
+
+        if failures:
+            raise CommandError(f'{len(failures)} request(s) got an unexpected status, first: {failures[0]}')
+        return report
@@ -0,0 +1,153 @@
+import asyncio
+import io
+import json
+import os
+import threading
+import time
+
+from authentication.models import User
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import path
+
+from files import async_views, views
+from files.benchmarking import Timer, scratch_environment, summarize
+from files.models import File
+
+
+class WSGIRoutes:
+    urlpatterns = [path('download/<str:download_link>/', views.download_file)]
+
+
+class ASGIRoutes:
+    urlpatterns = [path('download/<str:download_link>/', async_views.download_file)]
+
+
+def run_wsgi(url, options):
+    """
+    Closed-loop clients against the WSGI handler with a fixed pool of worker threads.
+
+    A worker stays occupied while it writes the body to a slow client, exactly
+    as a threaded WSGI server's worker would.
+    """
+    handler = WSGIHandler()
+    workers = threading.Semaphore(options['threads'])
+    delay = options['client_delay_ms'] / 1000
+    samples, sent = [], [0]
+    lock = threading.Lock()
+    remaining = [options['requests']]
+
+    def next_request():
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def client():
+        while next_request():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+            }
+            with Timer() as timer:
+                with workers:
+                    body = handler(environ, lambda status, headers, exc_info=None: None)
+                    nbytes = 0
+                    try:
+                        for block in body:
+                            nbytes += len(block)
+                            time.sleep(delay)
+                    finally:
+                        body.close()
+            with lock:
+                samples.append(timer.elapsed)
+                sent[0] += nbytes
+
+    threads = [threading.Thread(target=client) for _ in range(options['clients'])]
+    with Timer() as total:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return summarize(samples, sent[0], total.elapsed)
+
+
+def run_asgi(url, options):
+    """The same closed-loop clients against the ASGI handler on a single event loop."""
+    handler = ASGIHandler()
+    delay = options['client_delay_ms'] / 1000
+    samples, sent = [], [0]
+    remaining = [options['requests']]
+
+    async def request():
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url, 'raw_path': url.encode(), 'query_string': b'', 'root_path': '', 'headers': [],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        }
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.Future()  # the client never disconnects early
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                sent[0] += len(message['body'])
+                await asyncio.sleep(delay)
+
+        await handler(scope, receive, send)
+
+    async def client():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            with Timer() as timer:
+                await request()
+            samples.append(timer.elapsed)
+
+    async def main():
+        await asyncio.gather(*(client() for _ in range(options['clients'])))
+
+    with Timer() as total:
+        asyncio.run(main())
+    return summarize(samples, sent[0], total.elapsed)
+
+
+class Command(BaseCommand):
+    help = 'Load-tests public downloads through the WSGI and ASGI handlers, reporting throughput and p99 latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=400, help='Downloads per handler')
+        parser.add_argument('--size-kb', type=int, default=1024, help='Size of the benchmark file')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI server')
+        parser.add_argument('--client-delay-ms', type=float, default=20,
+                            help='Time a slow client takes to accept each 64KB block')
+
+    def handle(self, *args, **options):
+        size = options['size_kb'] * 1024
+        results = {}
+
+        with scratch_environment():
+            user = User.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                            password='bench', user_type=User.UserType.REGULAR)
+            file = File.objects.create(name='bench.bin', file=ContentFile(os.urandom(size), name='bench.bin'),
+                                       extension='bin', size=size, uploaded_by=user)
+            url = f'/download/{file.download_link}/'
+
+            with override_settings(ROOT_URLCONF=WSGIRoutes):
+                results['wsgi'] = run_wsgi(url, options)
+            with override_settings(ROOT_URLCONF=ASGIRoutes):
+                results['asgi'] = run_asgi(url, options)
+
+        results['config'] = {key: options[key] for key in ('clients', 'requests', 'size_kb', 'threads',
+                                                           'client_delay_ms')}
+        self.stdout.write(json.dumps(results, indent=2))
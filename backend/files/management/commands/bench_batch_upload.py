@@ -0,0 +1,60 @@
+import json
+import os
+
+from authentication.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from files.benchmarking import Timer, scratch_environment, summarize
+
+
+class Command(BaseCommand):
+    help = 'Compares storing N files through N upload/ calls against one upload/batch/ call'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=50, help='Files per round')
+        parser.add_argument('--size-kb', type=int, default=16, help='Size of each file')
+        parser.add_argument('--rounds', type=int, default=10, help='Rounds per mode')
+
+    def handle(self, *args, **options):
+        count, size = options['files'], options['size_kb'] * 1024
+        samples = {'sequential': [], 'batch': []}
+        queries = {}
+        with scratch_environment():
+            user = User.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                            password='bench', user_type=User.UserType.ADMIN)
+            client = APIClient()
+            client.force_authenticate(user)
+
+            def sequential(round_):
+                for index in range(count):
+                    client.post('/api/files/upload/', {
+                        'file': SimpleUploadedFile(f's{round_}-{index}.bin', os.urandom(size)),
+                        'encryption_metadata': '{}',
+                    }, format='multipart')
+
+            def batch(round_):
+                files = [SimpleUploadedFile(f'b{round_}-{index}.bin', os.urandom(size)) for index in range(count)]
+                response = client.post('/api/files/upload/batch/', {'files': files}, format='multipart')
+                assert response.status_code == 201, response.data
+
+            # Alternate the modes so database growth and warm-up affect both equally
+            for round_ in range(options['rounds']):
+                for label, run in (('sequential', sequential), ('batch', batch)):
+                    with CaptureQueriesContext(connection) as captured, Timer() as timer:
+                        run(round_)
+                    samples[label].append(timer.elapsed)
+                    queries[label] = len(captured.captured_queries)
+
+        results = {}
+        for label, values in samples.items():
+            summary = summarize(values, total_bytes=count * size * len(values))
+            summary['files_per_s'] = round(count * len(values) / summary['elapsed_s'], 1)
+            summary['queries_per_round'] = queries[label]
+            results[label] = summary
+        results['speedup'] = round(results['batch']['files_per_s'] / results['sequential']['files_per_s'], 2)
+        results['config'] = {key: options[key] for key in ('files', 'size_kb', 'rounds')}
+        self.stdout.write(json.dumps(results, indent=2))
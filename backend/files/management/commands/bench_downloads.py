@@ -0,0 +1,77 @@
+import json
+import os
+
+from authentication.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from files.benchmarking import Timer, scratch_environment, summarize
+from files.downloads import BACKENDS
+from files.models import File
+from files.views import download_file
+
+
+def deliver(response):
+    """Do the work a worker does after the view returns; returns the bytes it pushed itself."""
+    if response.has_header('X-Accel-Redirect') or response.has_header('X-Sendfile'):
+        return 0  # the front-end server transfers the body
+    filelike = getattr(response, 'file_to_stream', None)
+    if filelike is not None and hasattr(filelike, 'fileno'):
+        # What a server's wsgi.file_wrapper does: zero-copy from the descriptor
+        length = int(response['Content-Length'])
+        offset = filelike.fileobj.tell()
+        sink = os.open(os.devnull, os.O_WRONLY)
+        try:
+            sent = 0
+            while sent < length:
+                count = os.sendfile(sink, filelike.fileno(), offset + sent, length - sent)
+                if not count:
+                    break
+                sent += count
+        finally:
+            os.close(sink)
+            response.close()
+        return sent
+    sent = sum(len(block) for block in response.streaming_content)
+    response.close()
+    return sent
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the download backends, reporting throughput and worker occupancy per mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=16, help='Size of the benchmark file')
+        parser.add_argument('--requests', type=int, default=20, help='Downloads per backend')
+        parser.add_argument('--range', action='store_true', help='Request the second half of the file via Range')
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * 1024 * 1024
+        factory = RequestFactory()
+        headers = {'Range': f'bytes={size // 2}-'} if options['range'] else {}
+        results = {}
+
+        with scratch_environment():
+            user = User.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                            password='bench', user_type=User.UserType.REGULAR)
+            file = File.objects.create(name='bench.bin', file=ContentFile(os.urandom(size), name='bench.bin'),
+                                       extension='bin', size=size, uploaded_by=user)
+
+            for backend in BACKENDS:
+                samples = []
+                total_bytes = 0
+                with override_settings(FILES_DOWNLOAD_BACKEND=backend):
+                    for _ in range(options['requests']):
+                        request = factory.get(f'/api/files/download/{file.download_link}/', headers=headers)
+                        with Timer() as timer:
+                            response = download_file(request, download_link=str(file.download_link))
+                            total_bytes += deliver(response)
+                        samples.append(timer.elapsed)
+
+                summary = summarize(samples, total_bytes)
+                summary['worker_ms_per_request'] = summary['mean_ms']
+                summary['bytes_served_by_worker'] = total_bytes
+                results[backend] = summary
+
+        self.stdout.write(json.dumps(results, indent=2))
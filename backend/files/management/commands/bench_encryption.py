@@ -0,0 +1,68 @@
+import base64
+import io
+import json
+import os
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from files.benchmarking import Timer, summarize
+from files.encryption import AESGCM, DecryptingReader, EncryptingReader, Envelope, HEADER, parse_keys
+
+
+class Command(BaseCommand):
+    help = 'Measures single-core throughput of encryption at rest: encrypt, full decrypt and random ranged reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=64, help='Size of the benchmark object')
+        parser.add_argument('--chunk-kb', type=int, default=settings.FILES_ENCRYPTION_CHUNK_SIZE // 1024,
+                            help='Encryption chunk size')
+        parser.add_argument('--ranges', type=int, default=2000, help='Random ranged reads to time')
+        parser.add_argument('--range-kb', type=int, default=64, help='Length of each ranged read')
+        parser.add_argument('--block-kb', type=int, default=64, help='Read size used when streaming')
+
+    def handle(self, *args, **options):
+        if AESGCM is None:
+            raise CommandError('Encryption at rest requires the cryptography package')
+        size = options['size_mb'] * 1048576
+        block = options['block_kb'] * 1024
+        range_length = options['range_kb'] * 1024
+        keys = parse_keys([base64.urlsafe_b64encode(os.urandom(32)).decode()])
+        plaintext = os.urandom(size)
+        results = {}
+
+        envelope = Envelope.create(keys, options['chunk_kb'] * 1024)
+        reader = EncryptingReader(io.BytesIO(plaintext), envelope)
+        parts = []
+        with Timer() as timer:
+            while data := reader.read(block):
+                parts.append(data)
+        stored = b''.join(parts)
+        results['encrypt'] = summarize([timer.elapsed], size)
+
+        def open_plaintext():
+            fileobj = io.BytesIO(stored)
+            return DecryptingReader(fileobj, Envelope.parse(fileobj.read(HEADER.size), keys), len(stored))
+
+        reader = open_plaintext()
+        with Timer() as timer:
+            while reader.read(block):
+                pass
+        results['decrypt'] = summarize([timer.elapsed], size)
+
+        samples = []
+        for _ in range(options['ranges']):
+            start = random.randrange(max(1, size - range_length))
+            with Timer() as timer:
+                reader = open_plaintext()
+                reader.seek(start)
+                remaining = range_length
+                while remaining > 0 and (data := reader.read(min(block, remaining))):
+                    remaining -= len(data)
+            samples.append(timer.elapsed)
+        results['ranged_read'] = summarize(samples, options['ranges'] * range_length)
+
+        results['overhead_bytes'] = len(stored) - size
+        results['config'] = {key: options[key] for key in ('size_mb', 'chunk_kb', 'ranges', 'range_kb', 'block_kb')}
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,149 @@
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+from authentication.models import User
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from files import log
+from files.benchmarking import Timer, scratch_environment, summarize
+
+# Roughly what the upload view used to print and log on every request
+REQUEST_DATA = {
+    'file': SimpleUploadedFile('report-final-v2.pdf', b'', content_type='application/pdf'),
+    'status': 'private', 'expiry_days': '7',
+    'encryption_metadata': json.dumps({'key': 'k' * 44, 'iv': list(range(12))}),
+}
+
+
+def emit_legacy(logger):
+    print('=== Upload File View Started ===')
+    logger.error('=== Upload File View Started ===')
+    print(f'Request Data: {REQUEST_DATA}')
+    logger.error(f'Request Data: {REQUEST_DATA}')
+    print('=== File Upload Successful ===')
+    logger.error('=== File Upload Successful ===')
+
+
+def emit_structured(logger):
+    log.event(logger, 'upload.saved', file_id=1, size=1048576)
+
+
+def emit_sampled(logger):
+    log.event(logger, 'upload.saved', sample=settings.FILES_LOG_SAMPLE_RATE, file_id=1, size=1048576)
+
+
+def run(emit, logger, threads, calls):
+    """Call ``emit`` ``calls`` times from each of ``threads`` threads; per-call latency as seen by the caller."""
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for _ in range(calls):
+            with Timer() as timer:
+                emit(logger)
+            local.append(timer.elapsed)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    with Timer() as total:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    summary = summarize(samples, elapsed=total.elapsed)
+    summary['mean_us'] = round(summary['mean_ms'] * 1000, 2)
+    return summary
+
+
+def make_logger(name, handler, queued):
+    logger = logging.getLogger(f'files.bench.{name}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = []
+    if queued:
+        queue_handler = log.DroppingQueueHandler(queue.Queue(settings.FILES_LOG_QUEUE_SIZE))
+        queue_handler.addFilter(log.RequestContextFilter())
+        listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+        logger.addHandler(queue_handler)
+        return logger, listener
+    logger.addHandler(handler)
+    return logger, None
+
+
+class Command(BaseCommand):
+    help = 'Measures what logging costs the upload path: legacy print/logger.error vs structured, queued and sampled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent request threads')
+        parser.add_argument('--calls', type=int, default=2000, help='Log calls per thread')
+        parser.add_argument('--uploads', type=int, default=200, help='Uploads for the end-to-end comparison')
+
+    def handle(self, *args, **options):
+        results = {}
+        directory = tempfile.mkdtemp(prefix='bench-log-')
+        verbose = logging.Formatter('### {levelname} {asctime} {module} {process:d} {thread:d} {message}', style='{')
+
+        cases = {
+            'legacy_sync': (emit_legacy, verbose, False),
+            'structured_sync': (emit_structured, log.StructuredFormatter(), False),
+            'structured_queued': (emit_structured, log.StructuredFormatter(), True),
+            'sampled_queued': (emit_sampled, log.StructuredFormatter(), True),
+        }
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for name, (emit, formatter, queued) in cases.items():
+                handler = logging.FileHandler(os.path.join(directory, f'{name}.log'))
+                handler.setFormatter(formatter)
+                logger, listener = make_logger(name, handler, queued)
+                if listener:
+                    listener.start()
+                results[name] = run(emit, logger, options['threads'], options['calls'])
+                if listener:
+                    listener.stop()
+                    results[name]['dropped'] = logger.handlers[0].dropped
+                handler.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+        results['upload_request'] = self.bench_uploads(options['uploads'])
+        results['config'] = {key: options[key] for key in ('threads', 'calls', 'uploads')}
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def bench_uploads(self, count):
+        """
+        Upload latency with the files logger enabled vs disabled; the difference is its overhead.
+
+        The two modes alternate request by request so drift (database growth,
+        warm-up) affects both equally.
+        """
+        files_logger = logging.getLogger('files')
+        samples = {'logging_off': [], 'logging_on': []}
+        with scratch_environment():
+            user = User.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                            password='bench', user_type=User.UserType.REGULAR)
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for index in range(count):
+                    for label in samples:
+                        files_logger.disabled = label == 'logging_off'
+                        upload = SimpleUploadedFile(f'{label}-{index}.txt', os.urandom(1024))
+                        with Timer() as timer:
+                            client.post('/api/files/upload/', {'file': upload, 'encryption_metadata': '{}'},
+                                        format='multipart')
+                        samples[label].append(timer.elapsed)
+            finally:
+                files_logger.disabled = False
+        timings = {label: summarize(values) for label, values in samples.items()}
+        timings['overhead_us'] = round((timings['logging_on']['p50_ms'] - timings['logging_off']['p50_ms']) * 1000, 1)
+        return timings
@@ -0,0 +1,83 @@
+import json
+
+from authentication.models import User
+from core import metrics
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from files.benchmarking import Timer, scratch_environment, summarize
+from files.models import File
+
+METRICS_MIDDLEWARE = 'core.metrics.MetricsMiddleware'
+
+
+def bench_observe(calls):
+    """Cost of one histogram observation, the most expensive per-request registry call."""
+    histogram = metrics.Histogram('bench_seconds', 'Benchmark histogram.', ('view', 'method', 'status'))
+    samples = []
+    for index in range(calls):
+        with Timer() as timer:
+            histogram.observe(index % 100 / 1000, 'bench', 'GET', '2xx')
+        samples.append(timer.elapsed)
+    summary = summarize(samples)
+    return {'p50_us': round(summary['p50_ms'] * 1000, 2), 'p99_us': round(summary['p99_ms'] * 1000, 2)}
+
+
+class Command(BaseCommand):
+    help = 'Measures what MetricsMiddleware adds to each request and fails when it exceeds the budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+        parser.add_argument('--budget-us', type=float, default=150,
+                            help='Largest acceptable median overhead per request, in microseconds')
+
+    def handle(self, *args, **options):
+        results = {'histogram_observe': bench_observe(100000)}
+        with scratch_environment():
+            user = User.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                            password='bench', user_type=User.UserType.REGULAR)
+            file = File(name='bench.bin', extension='bin', size=65536, uploaded_by=user)
+            file.file.save('bench.bin', ContentFile(b'\0' * 65536), save=False)
+            file.save()
+
+            # A test client builds its middleware chain on its first request and keeps it
+            clients = {}
+            for label, middleware in (('metrics_off', [m for m in settings.MIDDLEWARE if m != METRICS_MIDDLEWARE]),
+                                      ('metrics_on', [METRICS_MIDDLEWARE, *settings.MIDDLEWARE[1:]])):
+                with override_settings(MIDDLEWARE=middleware):
+                    client = clients[label] = APIClient()
+                    client.force_authenticate(user)
+                    client.get('/api/files/user-data/')
+
+            endpoints = {
+                'user_data': lambda client: client.get('/api/files/user-data/'),
+                'download': lambda client: b''.join(
+                    client.get(f'/api/files/download/{file.download_link}/').streaming_content),
+            }
+            worst = 0.0
+            for endpoint, request in endpoints.items():
+                samples = {label: [] for label in clients}
+                # Alternate the modes request by request so drift affects both equally
+                for _ in range(options['requests']):
+                    for label, client in clients.items():
+                        with Timer() as timer:
+                            request(client)
+                        samples[label].append(timer.elapsed)
+                timings = {label: summarize(values) for label, values in samples.items()}
+                timings['overhead_us'] = round(
+                    (timings['metrics_on']['p50_ms'] - timings['metrics_off']['p50_ms']) * 1000, 1)
+                worst = max(worst, timings['overhead_us'])
+                results[endpoint] = timings
+
+            with Timer() as timer:
+                body = metrics.registry.render()
+            results['scrape'] = {'ms': round(timer.elapsed * 1000, 2), 'bytes': len(body)}
+
+        results['budget_us'] = options['budget_us']
+        results['config'] = {'requests': options['requests']}
+        self.stdout.write(json.dumps(results, indent=2))
+        if worst > options['budget_us']:
+            raise CommandError(f'Metrics overhead {worst}us per request exceeds the {options["budget_us"]}us budget')
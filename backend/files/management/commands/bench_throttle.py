@@ -0,0 +1,129 @@
+import io
+import json
+import threading
+import time
+
+from authentication.models import User
+from core.throttling import CacheBucketStore, MemoryBucketStore, Shaper, UserThrottle
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from files.benchmarking import Timer, scratch_environment, summarize
+from files.downloads import _stream_range
+
+
+def bench_store(store, calls, threads):
+    """Per-call latency of ``consume`` on hot buckets, ``threads`` callers at a time."""
+    samples, lock = [], threading.Lock()
+
+    def worker(index):
+        local = []
+        for _ in range(calls):
+            with Timer() as timer:
+                store.consume(f'bench:{index % 4}', 1e9, 1e9)
+            local.append(timer.elapsed)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return _microseconds(summarize(samples))
+
+
+def _microseconds(summary):
+    return {key.replace('_ms', '_us'): round(value * 1000, 2) if key.endswith('_ms') else value
+            for key, value in summary.items()}
+
+
+def bench_limit(rate, burst, seconds):
+    """Fire requests as fast as possible for ``seconds``; a correct limiter admits about burst + rate * seconds."""
+    store = MemoryBucketStore()
+    allowed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        allowed += store.consume('limit', rate, burst)[0]
+    return {'allowed': allowed, 'expected': round(burst + rate * seconds)}
+
+
+def bench_shaping(rate, size, streams):
+    """Achieved aggregate rate of ``streams`` concurrent downloads paced by one shared bandwidth bucket."""
+    payload = b'\0' * size
+    shaper = Shaper(f'bandwidth:bench:{time.monotonic()}', rate)
+
+    def download():
+        for _ in _stream_range(lambda: io.BytesIO(payload), 0, size, shaper):
+            pass
+
+    workers = [threading.Thread(target=download) for _ in range(streams)]
+    with Timer() as timer:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    # The first second of a bucket is burst allowance, so the sustained rate excludes it
+    return {'streams': streams, 'bytes': size * streams, 'limit_mb_s': round(rate / 1048576, 2),
+            'achieved_mb_s': round((size * streams - rate) / 1048576 / max(timer.elapsed, 1e-9), 2)}
+
+
+class Command(BaseCommand):
+    help = 'Measures the token-bucket limiter: per-call and per-request overhead, accuracy, and download shaping'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=20000, help='consume() calls per thread')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent callers')
+        parser.add_argument('--requests', type=int, default=500, help='API requests per mode in the end-to-end run')
+        parser.add_argument('--shape-mb', type=float, default=2, help='Bandwidth limit for the shaping run (MB/s)')
+
+    def handle(self, *args, **options):
+        results = {
+            'memory_store': bench_store(MemoryBucketStore(), options['calls'], options['threads']),
+            'cache_store_locmem': bench_store(CacheBucketStore('default'), options['calls'] // 10,
+                                              options['threads']),
+            'limit_accuracy': bench_limit(rate=50, burst=20, seconds=2),
+        }
+
+        with scratch_environment():
+            user = User.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                            password='bench', user_type=User.UserType.REGULAR)
+            results['throttle_check'] = self.bench_throttle_check(user, options['calls'])
+            results['api_request'] = self.bench_requests(user, options['requests'])
+
+        rate = int(options['shape_mb'] * 1048576)
+        results['shaping'] = [bench_shaping(rate, rate * 3, streams) for streams in (1, 4)]
+        results['config'] = {key: options[key] for key in ('calls', 'threads', 'requests', 'shape_mb')}
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def bench_throttle_check(self, user, calls):
+        """What DRF's check_throttles pays per request for the default UserThrottle."""
+        request = Request(RequestFactory().get('/api/files/user-data/'))
+        request.user = user
+        throttle = UserThrottle()
+        samples = []
+        with override_settings(THROTTLE_BUCKETS={'user': (1e9, 1e9)}):
+            for _ in range(calls):
+                with Timer() as timer:
+                    throttle.allow_request(request, None)
+                samples.append(timer.elapsed)
+        return _microseconds(summarize(samples))
+
+    def bench_requests(self, user, count):
+        """Latency of an authenticated GET with throttling on vs off, alternating request by request."""
+        client = APIClient()
+        client.force_authenticate(user)
+        samples = {'throttling_off': [], 'throttling_on': []}
+        generous = {'user': (1e9, 1e9)}
+        for _ in range(count):
+            for label in samples:
+                with override_settings(THROTTLE_BUCKETS=generous if label == 'throttling_on' else {}):
+                    with Timer() as timer:
+                        client.get('/api/files/user-data/')
+                samples[label].append(timer.elapsed)
+        timings = {label: summarize(values) for label, values in samples.items()}
+        timings['overhead_us'] = round(
+            (timings['throttling_on']['p50_ms'] - timings['throttling_off']['p50_ms']) * 1000, 1)
+        return timings
@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from files.chunked import file_checksum
+from files.models import Blob, File
+
+
+class Command(BaseCommand):
+    help = 'Reports blob deduplication savings; optionally backfills legacy files and collects garbage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='Move files uploaded before deduplication into the blob store')
+        parser.add_argument('--gc', action='store_true', help='Delete blobs that are no longer referenced')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill()
+        if options['gc']:
+            blobs, reclaimed = Blob.collect_garbage()
+            self.stdout.write(f'Collected {blobs} unreferenced blob(s), {reclaimed} bytes')
+
+        report = self.report()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['files']} files ({report['logical_bytes']} bytes) stored in {report['blobs']} blobs "
+            f"+ {report['legacy_files']} legacy files ({report['physical_bytes']} bytes)\n"
+            f"Deduplication ratio {report['dedup_ratio']:.2f}x, {report['bytes_saved']} bytes saved"
+        )
+
+    def report(self):
+        files = File.objects.aggregate(count=Count('id'), logical=Sum('size'))
+        legacy = File.objects.filter(blob__isnull=True).aggregate(count=Count('id'), size=Sum('size'))
+        blobs = Blob.objects.aggregate(count=Count('id'), size=Sum('size'))
+        logical = files['logical'] or 0
+        physical = (blobs['size'] or 0) + (legacy['size'] or 0)
+        return {
+            'files': files['count'],
+            'legacy_files': legacy['count'],
+            'blobs': blobs['count'],
+            'logical_bytes': logical,
+            'physical_bytes': physical,
+            'bytes_saved': logical - physical,
+            'dedup_ratio': logical / physical if physical else 1.0,
+        }
+
+    def backfill(self):
+        migrated = 0
+        for file in File.objects.filter(blob__isnull=True).iterator():
+            old_name = file.file.name
+            with file.file.open('rb'):
+                checksum = file.checksum or file_checksum(file.file)
+                with transaction.atomic():
+                    blob = Blob.ingest(file.file, checksum)
+                    File.objects.filter(pk=file.pk).update(blob=blob, file=blob.file.name, checksum=checksum)
+            if old_name != blob.file.name:
+                file.file.storage.delete(old_name)
+            migrated += 1
+        self.stdout.write(f'Moved {migrated} legacy file(s) into the blob store')
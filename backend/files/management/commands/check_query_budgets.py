@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from authentication.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import get_resolver
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from files.benchmarking import scratch_environment
+from files.models import File, RoleUpgradeRequest
+from files.query_budget import QueryBudgetExceeded, assert_max_queries
+
+
+def budgeted_endpoints(resolver=None, prefix=''):
+    """Yield ``(path, view)`` for every argument-less URL whose view declares a query budget."""
+    resolver = resolver or get_resolver()
+    for pattern in resolver.url_patterns:
+        route = prefix + str(pattern.pattern)
+        if hasattr(pattern, 'url_patterns'):
+            yield from budgeted_endpoints(pattern, route)
+        elif hasattr(pattern.callback, 'query_budget') and '<' not in route:
+            yield '/' + route, pattern.callback
+
+
+def seed(admin, rows):
+    """Create ``rows`` of everything the budgeted endpoints list, with bulk inserts only."""
+    sharer = User.objects.create_user(username='sharer@example.com', email='sharer@example.com', password='x',
+                                      user_type=User.UserType.REGULAR)
+    users = User.objects.bulk_create([
+        User(username=f'user{i}@example.com', email=f'user{i}@example.com', first_name=f'User {i}',
+             password='!', date_joined=timezone.now() - timedelta(days=1))
+        for i in range(rows)
+    ], batch_size=1000)
+    users = list(User.objects.filter(email__startswith='user').order_by('id'))
+
+    def files(owner, tag):
+        return [File(name=f'{tag}{i}.bin', file=f'uploads/{tag}{i}.bin', extension='bin', size=1024,
+                     uploaded_by=owner, encryption_key='key', encryption_iv=b'\x00' * 12)
+                for i in range(rows)]
+
+    File.objects.bulk_create(files(admin, 'own'), batch_size=1000)
+    File.objects.bulk_create(files(sharer, 'shared'), batch_size=1000)
+    Through = File.shared_with.through
+    Through.objects.bulk_create([Through(file_id=file_id, user_id=admin.id)
+                                 for file_id in File.objects.filter(uploaded_by=sharer).values_list('id', flat=True)],
+                                batch_size=1000)
+    RoleUpgradeRequest.objects.bulk_create([
+        RoleUpgradeRequest(user=user, current_role=User.UserType.GUEST, requested_role=User.UserType.REGULAR)
+        for user in users
+    ], batch_size=1000)
+
+
+class Command(BaseCommand):
+    help = 'Checks every endpoint with a declared query budget against seeded data sets of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 10000],
+                            help='Row counts to seed for each run')
+
+    def handle(self, *args, **options):
+        endpoints = sorted(budgeted_endpoints())
+        failures = []
+
+        for rows in options['rows']:
+            with scratch_environment():
+                admin = User.objects.create_user(username='admin@example.com', email='admin@example.com',
+                                                 password='x', first_name='Admin', user_type=User.UserType.ADMIN)
+                with transaction.atomic():
+                    seed(admin, rows)
+
+                client = APIClient()
+                client.force_authenticate(admin)
+                for path, view in endpoints:
+                    client.get(path)  # warm up lazily created per-user rows
+                    label = f'GET {path} @ {rows} rows'
+                    try:
+                        with assert_max_queries(view.query_budget, label=label) as context:
+                            response = client.get(path)
+                        if response.status_code != 200:
+                            raise QueryBudgetExceeded(f'{label} returned {response.status_code}')
+                    except QueryBudgetExceeded as e:
+                        failures.append(str(e))
+                        self.stderr.write(self.style.ERROR(str(e)))
+                    else:
+                        self.stdout.write(f'{label}: {len(context)}/{view.query_budget} queries')
+
+        if failures:
+            raise CommandError(f'{len(failures)} endpoint(s) exceeded their query budget')
+        self.stdout.write(self.style.SUCCESS('All endpoints within their query budgets'))
@@ -0,0 +1,68 @@
+import json
+import os
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from files.benchmarking import Timer
+from files.storage import BACKENDS, get_storage
+
+
+class Command(BaseCommand):
+    help = 'Round-trips a test object through a storage backend (write, stat, ranged read, URL, delete)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backend', nargs='?', help=f'One of {", ".join(BACKENDS)}; defaults to the configured '
+                                                       'storage')
+        parser.add_argument('--size-kb', type=int, default=512, help='Size of the test object')
+
+    def handle(self, *args, **options):
+        storage = get_storage(options['backend']) if options['backend'] else default_storage
+        payload = os.urandom(options['size_kb'] * 1024)
+        name = f'healthcheck/{uuid.uuid4().hex}'
+        timings = {}
+
+        try:
+            with Timer() as timer:
+                saved = storage.save(name, ContentFile(payload))
+            timings['write_ms'] = timer.elapsed * 1000
+            if saved != name:
+                raise CommandError(f'storage renamed {name!r} to {saved!r}')
+
+            with Timer() as timer:
+                if not storage.exists(name) or storage.size(name) != len(payload):
+                    raise CommandError('object missing or wrong size after write')
+            timings['stat_ms'] = timer.elapsed * 1000
+
+            middle = len(payload) // 2
+            with Timer() as timer:
+                with storage.open(name, 'rb') as fileobj:
+                    fileobj.seek(middle)
+                    if fileobj.read(4096) != payload[middle:middle + 4096]:
+                        raise CommandError('ranged read returned the wrong bytes')
+            timings['ranged_read_ms'] = timer.elapsed * 1000
+
+            with Timer() as timer:
+                with storage.open(name, 'rb') as fileobj:
+                    if fileobj.read() != payload:
+                        raise CommandError('full read returned the wrong bytes')
+            timings['full_read_ms'] = timer.elapsed * 1000
+
+            try:
+                url = storage.url(name)
+            except NotImplementedError:
+                url = None
+        finally:
+            storage.delete(name)
+
+        if storage.exists(name):
+            raise CommandError('object still exists after delete')
+        self.stdout.write(json.dumps({
+            'backend': f'{storage.__class__.__module__}.{storage.__class__.__qualname__}',
+            'bytes': len(payload),
+            'url': url,
+            **{key: round(value, 3) for key, value in timings.items()},
+        }, indent=2))
+        self.stdout.write(self.style.SUCCESS('Storage round-trip OK'))
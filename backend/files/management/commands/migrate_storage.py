@@ -0,0 +1,96 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from files.models import Blob, File, UploadSession
+from files.storage import BACKENDS, ShardedFileSystemStorage, local_path
+
+
+def build_storage(alias, target=False):
+    try:
+        storage_class = import_string(BACKENDS.get(alias, alias))
+    except ImportError as e:
+        raise CommandError(f'Unknown storage {alias!r}; use one of {", ".join(BACKENDS)} or a dotted path ({e})')
+    if target and issubclass(storage_class, ShardedFileSystemStorage):
+        # Only a file at the new location counts as migrated
+        return storage_class(legacy_fallback=False)
+    return storage_class()
+
+
+class Command(BaseCommand):
+    help = 'Copies every stored blob (and legacy file) from one storage backend to another, verifying sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help=f'Storage to read from ({", ".join(BACKENDS)} or a dotted path)')
+        parser.add_argument('target', help='Storage to write to')
+        parser.add_argument('--delete-source', action='store_true',
+                            help='Delete each source object once its copy is verified')
+        parser.add_argument('--include-chunks', action='store_true',
+                            help='Also copy chunks of active upload sessions')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many objects (0 = all)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be copied')
+
+    def names(self, include_chunks):
+        yield from Blob.objects.order_by('id').values_list('file', flat=True).iterator()
+        yield from File.objects.filter(blob__isnull=True).order_by('id').values_list('file', flat=True).iterator()
+        if include_chunks:
+            for session in UploadSession.objects.filter(status='active').prefetch_related('chunks'):
+                for chunk in session.chunks.all():
+                    yield session.chunk_name(chunk.index)
+
+    def handle(self, *args, **options):
+        source = build_storage(options['source'])
+        target = build_storage(options['target'], target=True)
+        started = time.monotonic()
+        stats = {'copied': 0, 'skipped': 0, 'failed': 0, 'deleted_from_source': 0, 'bytes_copied': 0}
+
+        for count, name in enumerate(self.names(options['include_chunks']), 1):
+            if options['limit'] and count > options['limit']:
+                break
+            try:
+                size = source.size(name) if source.exists(name) else None
+                target_size = target.size(name) if target.exists(name) else None
+                if size is None:
+                    if target_size is None:
+                        raise CommandError('missing from both storages')
+                    stats['skipped'] += 1  # already moved by an earlier run
+                    continue
+                if target_size == size:
+                    stats['skipped'] += 1
+                elif options['dry_run']:
+                    stats['copied'] += 1
+                    stats['bytes_copied'] += size
+                    continue
+                else:
+                    self.copy(source, target, name, size)
+                    stats['copied'] += 1
+                    stats['bytes_copied'] += size
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'copied {name} ({size} bytes)')
+            except Exception as e:
+                stats['failed'] += 1
+                self.stderr.write(self.style.ERROR(f'{name}: {e}'))
+                continue
+
+            same_file = local_path(source, name) is not None and local_path(source, name) == local_path(target, name)
+            if options['delete_source'] and not options['dry_run'] and not same_file:
+                source.delete(name)
+                stats['deleted_from_source'] += 1
+
+        stats['duration_seconds'] = round(time.monotonic() - started, 3)
+        self.stdout.write(json.dumps(stats))
+        if stats['failed']:
+            raise CommandError(f"{stats['failed']} object(s) could not be migrated")
+
+    def copy(self, source, target, name, size):
+        with source.open(name, 'rb') as content:
+            saved = target.save(name, content)
+        if saved != name:
+            # The database stores names, so a renamed copy would be unreachable
+            target.delete(saved)
+            raise CommandError(f'target stored the object as {saved!r}')
+        if target.size(name) != size:
+            target.delete(name)
+            raise CommandError('size mismatch after copy')
@@ -0,0 +1,108 @@
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from files.models import File, UploadSession, UserStorage
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired files (and stale upload sessions) in bounded, rate-limited batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Files deleted per transaction')
+        parser.add_argument('--max-batches', type=int, default=0, help='Stop after this many batches (0 = no limit)')
+        parser.add_argument('--max-rows-per-second', type=float, default=0,
+                            help='Throughput ceiling so the reaper never competes with requests (0 = unlimited)')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+        parser.add_argument('--loop', action='store_true', help='Keep running as a daemon')
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between runs with --loop')
+        parser.add_argument('--metrics-file', help='Write Prometheus textfile-collector metrics to this path')
+
+    def handle(self, *args, **options):
+        while True:
+            metrics = self.run_once(options)
+            self.stdout.write(json.dumps(metrics))
+            if options['metrics_file']:
+                self.write_metrics(options['metrics_file'], metrics)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, options):
+        started = time.monotonic()
+        now = timezone.now()
+        rows, reclaimed, batches = 0, 0, 0
+
+        while not options['max_batches'] or batches < options['max_batches']:
+            batch_started = time.monotonic()
+            ids = list(File.objects.filter(expiry_date__lt=now).order_by('expiry_date')
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted, freed = File.objects.filter(id__in=ids).purge()
+            rows += deleted
+            reclaimed += freed
+            batches += 1
+
+            # Pace batches so the average stays under the configured ceiling
+            delay = options['pause']
+            if options['max_rows_per_second']:
+                delay = max(delay, deleted / options['max_rows_per_second'] - (time.monotonic() - batch_started))
+            if delay > 0:
+                time.sleep(delay)
+
+        sessions, released = self.abort_stale_sessions(now)
+        return {
+            'rows_reclaimed': rows,
+            'bytes_reclaimed': reclaimed,
+            'batches': batches,
+            'sessions_aborted': sessions,
+            'session_bytes_released': released,
+            'duration_seconds': round(time.monotonic() - started, 3),
+            'finished_at': int(time.time()),
+        }
+
+    def abort_stale_sessions(self, now):
+        cutoff = now - timedelta(hours=settings.FILES_UPLOAD_SESSION_TTL_HOURS)
+        aborted, released = 0, 0
+        stale = UploadSession.objects.filter(status='active', updated_at__lt=cutoff)
+        for session in stale.prefetch_related('chunks'):
+            # Claim the session first: a concurrent reaper, or a chunk that just revived it, leaves it alone
+            if not stale.filter(pk=session.pk).update(status='aborted'):
+                continue
+            for chunk in session.chunks.all():
+                default_storage.delete(session.chunk_name(chunk.index))
+            session.chunks.all().delete()
+            UserStorage.release(session.user_id, session.total_size)
+            aborted += 1
+            released += session.total_size
+        return aborted, released
+
+    def write_metrics(self, path, metrics):
+        lines = [
+            '# HELP files_reaper_rows_reclaimed Expired files deleted by the last reaper run.',
+            '# TYPE files_reaper_rows_reclaimed gauge',
+            f"files_reaper_rows_reclaimed {metrics['rows_reclaimed']}",
+            '# HELP files_reaper_bytes_reclaimed Bytes returned to quotas by the last reaper run.',
+            '# TYPE files_reaper_bytes_reclaimed gauge',
+            f"files_reaper_bytes_reclaimed {metrics['bytes_reclaimed']}",
+            '# HELP files_reaper_sessions_aborted Stale upload sessions aborted by the last reaper run.',
+            '# TYPE files_reaper_sessions_aborted gauge',
+            f"files_reaper_sessions_aborted {metrics['sessions_aborted']}",
+            '# HELP files_reaper_duration_seconds Wall time of the last reaper run.',
+            '# TYPE files_reaper_duration_seconds gauge',
+            f"files_reaper_duration_seconds {metrics['duration_seconds']}",
+            '# HELP files_reaper_last_run_timestamp_seconds Unix time the last reaper run finished.',
+            '# TYPE files_reaper_last_run_timestamp_seconds gauge',
+            f"files_reaper_last_run_timestamp_seconds {metrics['finished_at']}",
+        ]
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as handle:
+            handle.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)  # collectors never see a half-written file
@@ -0,0 +1,82 @@
+from authentication.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import BigIntegerField, Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from files.models import File, SiteStats, UploadSession, UserStorage
+
+ENCRYPTED = Q(encryption_key__isnull=False) & ~Q(encryption_key='')
+
+
+def usage_expression():
+    """Bytes a user should be charged: their files plus reservations held by open upload sessions."""
+    files = File.objects.filter(uploaded_by=OuterRef('user')).order_by().values('uploaded_by').annotate(
+        total=Sum('size')).values('total')
+    sessions = UploadSession.objects.filter(user=OuterRef('user'), status='active').order_by().values(
+        'user').annotate(total=Sum('total_size')).values('total')
+    return (Coalesce(Subquery(files, output_field=BigIntegerField()), Value(0)) +
+            Coalesce(Subquery(sessions, output_field=BigIntegerField()), Value(0)))
+
+
+def count_expression(queryset, column):
+    counts = queryset.filter(**{column: OuterRef('user')}).order_by().values(column).annotate(
+        total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=BigIntegerField()), Value(0))
+
+
+def expected_counters():
+    return {
+        'used_storage': usage_expression(),
+        'file_count': count_expression(File.objects.all(), 'uploaded_by'),
+        'shared_with_count': count_expression(File.shared_with.through.objects.all(), 'user'),
+    }
+
+
+def expected_site_stats():
+    return {
+        'users_without_mfa': User.objects.filter(is_mfa_enabled=False).count(),
+        'files_total': File.objects.count(),
+        'files_encrypted': File.objects.filter(ENCRYPTED).count(),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Recomputes UserStorage usage and dashboard counters from File rows, shares and open upload '
+            'sessions, and the site-wide SiteStats counters')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without correcting it')
+
+    def handle(self, *args, **options):
+        # Every user should have a row; receivers only adjust rows that exist
+        missing = User.objects.filter(userstorage__isnull=True)
+        if not options['dry_run']:
+            UserStorage.objects.bulk_create([UserStorage(user=user) for user in missing], ignore_conflicts=True)
+
+        counters = expected_counters()
+        annotated = UserStorage.objects.annotate(**{f'expected_{field}': expression
+                                                    for field, expression in counters.items()})
+        drift = Q()
+        for field in counters:
+            drift |= ~Q(**{field: F(f'expected_{field}')})
+        values = ['user__email'] + [name for field in counters for name in (field, f'expected_{field}')]
+        for row in annotated.filter(drift).values(*values):
+            changes = ', '.join(f"{field} recorded {row[field]}, actual {row[f'expected_{field}']} "
+                                f"({row[f'expected_{field}'] - row[field]:+d})"
+                                for field in counters if row[field] != row[f'expected_{field}'])
+            self.stdout.write(f"{row['user__email']}: {changes}")
+
+        stats = SiteStats.load()
+        site = expected_site_stats()
+        for field, actual in site.items():
+            if getattr(stats, field) != actual:
+                self.stdout.write(f'site {field}: recorded {getattr(stats, field)}, actual {actual} '
+                                  f'({actual - getattr(stats, field):+d})')
+
+        if options['dry_run']:
+            return
+
+        # A single UPDATE ... SET <counter> = (aggregate subquery), ... for every row
+        updated = UserStorage.objects.update(**expected_counters())
+        SiteStats.objects.filter(pk=stats.pk).update(**site)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {updated} storage record(s) and the site counters'))
@@ -0,0 +1,81 @@
+import json
+import os
+import signal
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from files.tasks import get_queue
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background tasks (post-upload processing and the like) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run every task that is due, then exit')
+        parser.add_argument('--max-tasks', type=int, default=0, help='Exit after this many tasks (0 = no limit)')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when no task is due')
+        parser.add_argument('--task', action='append', dest='names', help='Only run tasks with this name (repeatable)')
+        parser.add_argument('--stats', action='store_true', help='Print per-task counts and timings, then exit')
+        parser.add_argument('--metrics-file', help='Write Prometheus textfile-collector metrics to this path')
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if options['stats']:
+            self.stdout.write(json.dumps(queue.stats(), indent=2))
+            return
+
+        # Finish the task in hand on SIGTERM/SIGINT instead of abandoning it to a lease timeout
+        self.stopping = False
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.stop)
+
+        ran, last_prune = 0, 0.0
+        while not self.stopping and (not options['max_tasks'] or ran < options['max_tasks']):
+            close_old_connections()
+            if queue.run_next(options['names']):
+                ran += 1
+                continue
+            if options['once']:
+                break
+            if time.monotonic() - last_prune > 3600:
+                queue.prune(timezone.now() - timedelta(days=settings.FILES_TASK_RETENTION_DAYS))
+                last_prune = time.monotonic()
+            if options['metrics_file']:
+                self.write_metrics(options['metrics_file'], queue.stats())
+            time.sleep(options['poll'])
+
+        if options['metrics_file']:
+            self.write_metrics(options['metrics_file'], queue.stats())
+        self.stdout.write(json.dumps({'tasks_run': ran}))
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def write_metrics(self, path, stats):
+        lines = [
+            '# HELP files_tasks Background tasks by name and state.',
+            '# TYPE files_tasks gauge',
+        ]
+        for name, entry in stats.items():
+            for state in ('queued', 'running', 'done', 'failed'):
+                lines.append(f'files_tasks{{task="{name}",state="{state}"}} {entry[state]}')
+        lines += [
+            '# HELP files_task_retries Attempts beyond the first, by task name.',
+            '# TYPE files_task_retries gauge',
+        ]
+        lines += [f'files_task_retries{{task="{name}"}} {entry["retries"]}' for name, entry in stats.items()]
+        lines += [
+            '# HELP files_task_duration_mean_seconds Mean run time of finished tasks, by task name.',
+            '# TYPE files_task_duration_mean_seconds gauge',
+        ]
+        lines += [f'files_task_duration_mean_seconds{{task="{name}"}} {entry["mean_ms"] / 1000}'
+                  for name, entry in stats.items() if entry['mean_ms'] is not None]
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as handle:
+            handle.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)  # collectors never see a half-written file
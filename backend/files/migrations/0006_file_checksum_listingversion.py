@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_user_created_at'),
+        ('files', '0005_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing_version', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('uploaded_files', models.BigIntegerField(default=0)),
+                ('uploaded_files_modified', models.DateTimeField(default=django.utils.timezone.now)),
+                ('shared_files', models.BigIntegerField(default=0)),
+                ('shared_files_modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("files", "0006_file_checksum_listingversion"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["uploaded_by", "-uploaded_date", "-id"],
+                name="file_owner_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["-uploaded_date", "-id"], name="file_recent_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="roleupgraderequest",
+            index=models.Index(
+                fields=["status", "-request_date", "-id"],
+                name="rolerequest_status_recent_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:40
+
+import uuid
+
+from django.db import migrations, models
+
+
+def convert_links(apps, schema_editor):
+    """Keep every existing link that is already a UUID; anything else gets a fresh one."""
+    File = apps.get_model("files", "File")
+    seen = set()
+    batch = []
+    for file in File.objects.only("id", "download_link").iterator(chunk_size=2000):
+        try:
+            token = uuid.UUID(file.download_link or "")
+        except ValueError:
+            token = None
+        if token is None or token in seen:
+            token = uuid.uuid4()
+        seen.add(token)
+        file.download_token = token
+        batch.append(file)
+        if len(batch) >= 2000:
+            File.objects.bulk_update(batch, ["download_token"])
+            batch = []
+    if batch:
+        File.objects.bulk_update(batch, ["download_token"])
+
+
+def restore_links(apps, schema_editor):
+    File = apps.get_model("files", "File")
+    batch = []
+    for file in File.objects.only("id", "download_token").iterator(chunk_size=2000):
+        file.download_link = str(file.download_token)
+        batch.append(file)
+        if len(batch) >= 2000:
+            File.objects.bulk_update(batch, ["download_link"])
+            batch = []
+    if batch:
+        File.objects.bulk_update(batch, ["download_link"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("files", "0009_file_expiry_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="download_token",
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(convert_links, restore_links),
+        migrations.RemoveField(
+            model_name="file",
+            name="download_link",
+        ),
+        migrations.RenameField(
+            model_name="file",
+            old_name="download_token",
+            new_name="download_link",
+        ),
+        migrations.AlterField(
+            model_name="file",
+            name="download_link",
+            field=models.UUIDField(default=uuid.uuid4, unique=True),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:24
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    File = apps.get_model("files", "File")
+    UserStorage = apps.get_model("files", "UserStorage")
+    SiteStats = apps.get_model("files", "SiteStats")
+    Share = File.shared_with.through
+
+    UserStorage.objects.bulk_create(
+        [UserStorage(user_id=user_id) for user_id in User.objects.filter(userstorage__isnull=True).values_list(
+            "id", flat=True)], ignore_conflicts=True)
+    owned = File.objects.filter(uploaded_by=OuterRef("user")).order_by().values("uploaded_by").annotate(
+        total=Count("id")).values("total")
+    shared = Share.objects.filter(user=OuterRef("user")).order_by().values("user").annotate(
+        total=Count("id")).values("total")
+    UserStorage.objects.update(
+        file_count=Coalesce(Subquery(owned, output_field=BigIntegerField()), Value(0)),
+        shared_with_count=Coalesce(Subquery(shared, output_field=BigIntegerField()), Value(0)),
+    )
+    encrypted = Q(encryption_key__isnull=False) & ~Q(encryption_key="")
+    SiteStats.objects.update_or_create(pk=1, defaults={
+        "users_without_mfa": User.objects.filter(is_mfa_enabled=False).count(),
+        "files_total": File.objects.count(),
+        "files_encrypted": File.objects.filter(encrypted).count(),
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("files", "0010_file_download_link_uuid"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiteStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("users_without_mfa", models.BigIntegerField(default=0)),
+                ("files_total", models.BigIntegerField(default=0)),
+                ("files_encrypted", models.BigIntegerField(default=0)),
+                ("failed_decryptions", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="userstorage",
+            name="file_count",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userstorage",
+            name="shared_with_count",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    # Persistent: recorded in the database file, so every later connection uses WAL
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('PRAGMA journal_mode = WAL')
+
+
+class Migration(migrations.Migration):
+    # The journal mode cannot be changed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("files", "0011_dashboard_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, migrations.RunPython.noop, elidable=True),
+    ]
@@ -1,5 +1,153 @@
+import math
+import uuid
+from collections import Counter
+
 from authentication.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import link_cache
+from .signals import files_deleted, files_shared
+
+
+def blob_upload_to(instance, filename):
+    # Directory fan-out is up to the storage backend (see files.storage); older
+    # blobs keep the blobs/ab/cd/<sha> names they were stored under
+    return f'blobs/{instance.sha256}'
+
+
+class Blob(models.Model):
+    """Content-addressed bytes shared by every File whose contents hash the same."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_upload_to)
+    size = models.BigIntegerField()  # in bytes
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def ingest(cls, content, sha256):
+        """
+        Return the blob for ``content`` with one more reference taken.
+
+        The bytes are only written when no blob with this digest exists yet;
+        callers should run this in the same transaction as the File insert.
+        """
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(sha256=sha256).first()
+            if blob is None:
+                blob = cls(sha256=sha256, size=content.size)
+                blob.file.save(sha256, content, save=False)
+                try:
+                    with transaction.atomic():
+                        blob.save()
+                except IntegrityError:
+                    # Lost a race with a concurrent upload of the same content
+                    blob.file.delete(save=False)
+                    blob = cls.objects.select_for_update().get(sha256=sha256)
+            cls.objects.filter(pk=blob.pk).update(refcount=models.F('refcount') + 1)
+        blob.refcount += 1
+        return blob
+
+    @classmethod
+    def release(cls, blob_ids):
+        """Drop one reference per id (repeat ids for multiple references) and collect unreferenced blobs."""
+        counts = Counter(blob_id for blob_id in blob_ids if blob_id)
+        for blob_id, count in counts.items():
+            cls.objects.filter(pk=blob_id).update(refcount=models.F('refcount') - count)
+        if counts:
+            cls.collect_garbage(list(counts))
+
+    @classmethod
+    def collect_garbage(cls, blob_ids=None):
+        """Delete unreferenced blobs and their stored bytes; returns ``(blobs, bytes)`` reclaimed."""
+        candidates = cls.objects.filter(refcount__lte=0)
+        if blob_ids is not None:
+            candidates = candidates.filter(pk__in=blob_ids)
+
+        reclaimed, reclaimed_bytes = 0, 0
+        for blob_id in candidates.values_list('pk', flat=True):
+            with transaction.atomic():
+                blob = cls.objects.select_for_update().filter(pk=blob_id, refcount__lte=0).first()
+                if blob is None:
+                    continue  # re-referenced since it was selected
+                blob.file.delete(save=False)
+                blob.delete()
+                reclaimed += 1
+                reclaimed_bytes += blob.size
+        return reclaimed, reclaimed_bytes
+
+
+class FileQuerySet(models.QuerySet):
+    def purge(self):
+        """
+        Delete these files and everything hanging off them in a constant number of queries.
+
+        Releases blob references (collecting unreferenced blobs), removes legacy
+        per-row files, returns the bytes to each owner's quota and invalidates the
+        affected listings. Returns ``(rows, bytes)`` reclaimed.
+        """
+        rows = list(self.values_list('id', 'uploaded_by_id', 'size', 'blob_id', 'file', 'download_link',
+                                     'encryption_key'))
+        if not rows:
+            return 0, 0
+        ids = [row[0] for row in rows]
+        recipients = Counter(File.shared_with.through.objects.filter(file_id__in=ids).values_list('user_id', flat=True))
+
+        freed, owners = Counter(), Counter()
+        for _, owner_id, size, _, _, _, _ in rows:
+            freed[owner_id] += size
+            owners[owner_id] += 1
+        with transaction.atomic():
+            File.objects.filter(id__in=ids).delete()
+            for owner_id, size in freed.items():
+                UserStorage.release(owner_id, size)
+            ListingVersion.bump(uploaded_by=list(freed), shared_with=list(recipients))
+            link_cache.invalidate(row[5] for row in rows)
+            files_deleted.send(sender=File, owners=owners, recipients=recipients,
+                               encrypted=sum(1 for row in rows if row[6]))
+
+        Blob.release([row[3] for row in rows])
+        storage = File._meta.get_field('file').storage
+        for _, _, _, blob_id, name, _, _ in rows:
+            if blob_id is None and name:
+                storage.delete(name)
+        return len(rows), sum(freed.values())
+
+    def share(self, emails):
+        """
+        Share these files with the users registered under ``emails`` and rotate their public links.
+
+        Runs a fixed number of queries however many files or recipients are
+        involved. Returns ``(files, recipients, unknown_emails)``.
+        """
+        files = list(self.select_related('uploaded_by'))
+        wanted = list(dict.fromkeys(email.strip() for email in emails if email and email.strip()))
+        recipients = list(User.objects.filter(email__in=wanted)) if wanted else []
+        found = {user.email for user in recipients}
+        unknown = [email for email in wanted if email not in found]
+        if not files:
+            return files, recipients, unknown
+
+        through = File.shared_with.through
+        ids = [file.id for file in files]
+        old_links = [file.download_link for file in files]
+        for file in files:
+            file.status = 'public'
+            file.download_link = uuid.uuid4()
+        pairs = {(file_id, user.id) for file_id in ids for user in recipients}
+        if pairs:
+            pairs -= set(through.objects.filter(file_id__in=ids, user__in=recipients).values_list('file_id', 'user_id'))
+        with transaction.atomic():
+            through.objects.bulk_create([through(file_id=file_id, user_id=user_id) for file_id, user_id in pairs],
+                                        ignore_conflicts=True)
+            File.objects.bulk_update(files, ['status', 'download_link'])
+            shared_with = set(through.objects.filter(file_id__in=ids).values_list('user_id', flat=True))
+            ListingVersion.bump(uploaded_by=list({file.uploaded_by_id for file in files}),
+                                shared_with=list(shared_with))
+            link_cache.invalidate(old_links)
+            files_shared.send(sender=File, recipients=Counter(user_id for _, user_id in pairs))
+        return files, recipients, unknown
 
 
 class File(models.Model):
@@ -7,33 +155,156 @@ class File(models.Model):
         ('private', 'Private'),
         ('public', 'Public'),
     )
+    PROCESSING, READY, FAILED = 'processing', 'ready', 'failed'
+    PROCESSING_CHOICES = (
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
 
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to='uploads/')
     extension = models.CharField(max_length=10)
-    size = models.IntegerField()  # in bytes
+    size = models.BigIntegerField()  # in bytes
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_files')
     uploaded_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='private')
-    download_link = models.CharField(max_length=255, null=True, blank=True)
+    download_link = models.UUIDField(default=uuid.uuid4, unique=True)
     expiry_date = models.DateTimeField(null=True, blank=True)
     shared_with = models.ManyToManyField(User, related_name='shared_files', blank=True)
     encryption_key = models.TextField(null=True, blank=True)
     encryption_iv = models.BinaryField(null=True, blank=True)
+    checksum = models.CharField(max_length=64, blank=True, default='')  # sha256 hex digest of the stored blob
+    # Content-addressed storage; `file` names the same object. Rows uploaded before
+    # deduplication have no blob and own their `file` outright.
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='files')
+    # New uploads stay `processing` until the files.process_upload task has hashed, deduplicated and checked them
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default=READY)
+
+    objects = FileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expiry_date'], name='file_expiry_idx'),
+            # Keyset pagination of the uploaded/shared listings on (uploaded_date, id)
+            models.Index(fields=['uploaded_by', '-uploaded_date', '-id'], name='file_owner_recent_idx'),
+            models.Index(fields=['-uploaded_date', '-id'], name='file_recent_idx'),
+        ]
+
+    @property
+    def etag(self):
+        return f'"{self.checksum}"' if self.checksum else None
+
+    def delete(self, *args, **kwargs):
+        """Delete through ``purge()``, which also frees the quota, blob reference, listings and cached link."""
+        rows, _ = File.objects.filter(pk=self.pk).purge()
+        return rows, {self._meta.label: rows}
+
+
+class ListingVersion(models.Model):
+    """Per-user change counters that back conditional GETs on the file listings."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='listing_version')
+    uploaded_files = models.BigIntegerField(default=0)
+    uploaded_files_modified = models.DateTimeField(default=timezone.now)
+    shared_files = models.BigIntegerField(default=0)
+    shared_files_modified = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def bump(cls, uploaded_by=(), shared_with=()):
+        """Invalidate cached listings; users without a row have never been handed a validator."""
+        now = timezone.now()
+        if uploaded_by:
+            cls.objects.filter(user_id__in=uploaded_by).update(
+                uploaded_files=models.F('uploaded_files') + 1, uploaded_files_modified=now)
+        if shared_with:
+            cls.objects.filter(user_id__in=shared_with).update(
+                shared_files=models.F('shared_files') + 1, shared_files_modified=now)
 
 
 class UserStorage(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     used_storage = models.BigIntegerField(default=0)  # in bytes
+    # Dashboard counters, kept current by files.receivers and corrected by reconcile_storage
+    file_count = models.BigIntegerField(default=0)
+    shared_with_count = models.BigIntegerField(default=0)
 
     @property
     def allocated_storage(self):
-        if self.user.user_type == 'admin':
+        return self.allocation_for(self.user.user_type)
+
+    @staticmethod
+    def allocation_for(user_type):
+        if user_type == 'admin':
             return 50 * 1024 * 1024 * 1024  # 50GB
-        elif self.user.user_type == 'regular':
+        elif user_type == 'regular':
             return 1 * 1024 * 1024 * 1024  # 1GB
         return 500 * 1024 * 1024  # 500MB for guest
 
+    @classmethod
+    def reserve(cls, user, size):
+        """
+        Atomically charge ``size`` bytes to ``user`` if they fit the allocation.
+
+        The check and the increment are one conditional UPDATE, so concurrent
+        uploads cannot both pass the check or lose each other's increments.
+        Returns ``True`` when the bytes were reserved; callers must ``release``
+        them again if the upload does not go through.
+        """
+        limit = cls.allocation_for(user.user_type) - size
+        reserved = cls.objects.filter(user=user, used_storage__lte=limit).update(
+            used_storage=models.F('used_storage') + size)
+        if not reserved and not cls.objects.filter(user=user).exists():
+            cls.objects.bulk_create([cls(user=user)], ignore_conflicts=True)
+            reserved = cls.objects.filter(user=user, used_storage__lte=limit).update(
+                used_storage=models.F('used_storage') + size)
+        return bool(reserved)
+
+    @classmethod
+    def available(cls, user):
+        """Bytes ``user`` can still store. Only a snapshot: ``reserve`` is what enforces the allocation."""
+        used = cls.objects.filter(user=user).values_list('used_storage', flat=True).first() or 0
+        return cls.allocation_for(user.user_type) - used
+
+    @classmethod
+    def release(cls, user, size):
+        """Return ``size`` bytes to ``user`` (a User or its id)."""
+        cls.objects.filter(user=user).update(used_storage=Greatest(models.F('used_storage') - size, 0))
+
+    @classmethod
+    def adjust(cls, field, deltas):
+        """Add ``deltas`` (``{user id: delta}``) to counter ``field``, one UPDATE per distinct delta."""
+        by_delta = {}
+        for user_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(user_id)
+        for delta, user_ids in by_delta.items():
+            cls.objects.filter(user_id__in=user_ids).update(**{field: Greatest(models.F(field) + delta, 0)})
+
+
+class SiteStats(models.Model):
+    """Single row of site-wide counters behind the admin dashboard, kept current by files.receivers."""
+    SINGLETON_ID = 1
+
+    users_without_mfa = models.BigIntegerField(default=0)
+    files_total = models.BigIntegerField(default=0)
+    files_encrypted = models.BigIntegerField(default=0)  # files uploaded with client-side encryption metadata
+    failed_decryptions = models.BigIntegerField(default=0)
+
+    @classmethod
+    def load(cls):
+        return cls.objects.get_or_create(pk=cls.SINGLETON_ID)[0]
+
+    @classmethod
+    def add(cls, **deltas):
+        changes = {field: Greatest(models.F(field) + delta, 0) for field, delta in deltas.items() if delta}
+        if changes:
+            cls.objects.filter(pk=cls.SINGLETON_ID).update(**changes)
+
+    @property
+    def encryption_health(self):
+        """Percentage of stored files that are encrypted."""
+        return round(100 * self.files_encrypted / self.files_total) if self.files_total else 100
+
 
 class RoleUpgradeRequest(models.Model):
     STATUS_CHOICES = (
@@ -47,3 +318,82 @@ class RoleUpgradeRequest(models.Model):
     current_role = models.CharField(max_length=10)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     request_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-request_date', '-id'], name='rolerequest_status_recent_idx'),
+        ]
+
+
+class UploadSession(models.Model):
+    STATUS_CHOICES = (
+        ('active', 'Active'),
+        ('complete', 'Complete'),
+        ('aborted', 'Aborted'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()  # in bytes
+    chunk_size = models.IntegerField()  # in bytes
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    file_status = models.CharField(max_length=10, choices=File.STATUS_CHOICES, default='private')
+    expiry_days = models.IntegerField(default=7)
+    encryption_key = models.TextField(null=True, blank=True)
+    encryption_iv = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def total_chunks(self):
+        return max(1, math.ceil(self.total_size / self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+
+    def chunk_name(self, index):
+        return f'chunks/{self.id}/{index:06d}'
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()  # in bytes
+    checksum = models.CharField(max_length=64)  # sha256 hex digest
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+
+class Task(models.Model):
+    """A unit of background work in the database queue (see files.tasks)."""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # Enqueueing again under a key that is already present is a no-op
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)  # a running task's lease; expired leases are retried
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # seconds taken by the last attempt
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_due_idx'),
+        ]
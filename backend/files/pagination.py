@@ -0,0 +1,162 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a composite ordering such as ``('-uploaded_date', '-id')``.
+
+    The cursor carries the ordering values of the last row on the page, so each
+    page is a single indexed range scan regardless of how deep the client has
+    paged. Paging is opt-in: without ``limit`` or ``cursor`` the whole listing
+    is returned, as clients written before pagination expect. The body stays a
+    plain list either way; the next page is advertised through the ``Link`` and
+    ``X-Next-Cursor`` headers.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+        self.next_cursor = None
+        self.page_size = None
+        self.request = None
+
+    def get_page_size(self, request):
+        """Rows per page, or ``None`` when the client asked for neither a page size nor a cursor."""
+        params = request.query_params
+        if self.page_size_query_param not in params and self.cursor_query_param not in params:
+            return None
+        page_size = settings.FILES_PAGE_SIZE
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except ValueError:
+                raise ValidationError({'limit': 'A valid integer is required.'})
+        return max(1, min(page_size, settings.FILES_MAX_PAGE_SIZE))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self._page(list(self._window(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async variant of :meth:`paginate_queryset` using the async ORM."""
+        return self._page([row async for row in self._window(queryset, request)])
+
+    def _window(self, queryset, request):
+        """The requested page plus one lookahead row, which tells whether a next page exists."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(queryset.model, self.decode_cursor(cursor)))
+        if self.page_size is None:
+            return queryset
+        return queryset[:self.page_size + 1]
+
+    def _page(self, rows):
+        if self.page_size is not None and len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_cursor = self.encode_cursor(rows[-1])
+        return rows
+
+    def get_paginated_response(self, data):
+        response = Response(data)
+        if self.next_cursor:
+            next_url = replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                           self.next_cursor)
+            response['Link'] = f'<{next_url}>; rel="next"'
+            response['X-Next-Cursor'] = self.next_cursor
+        return response
+
+    def encode_cursor(self, row):
+        values = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return values
+
+    def _after(self, model, values):
+        """Build ``(a, b) < (x, y)`` (or ``>`` for ascending keys) as OR-ed prefix comparisons."""
+        try:
+            parsed = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                      for field, value in zip(self.ordering, values)]
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            prefix = {self.ordering[i].lstrip('-'): parsed[i] for i in range(position)}
+            condition |= Q(**prefix, **{f'{name}__{lookup}': parsed[position]})
+        return condition
+
+
+def requested_fields(request, serializer_class):
+    """Parse ``?fields=a,b`` into a list of serializer fields, or ``None`` for the full representation."""
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = set(fields) - set(serializer_class.Meta.fields)
+    if unknown:
+        raise ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}'})
+    return fields
+
+
+def project(queryset, serializer_class, fields, ordering=()):
+    """
+    Restrict ``queryset`` to the columns behind the requested serializer fields.
+
+    Fields backed by a relation (declared in ``Meta.projection``) bring their
+    join in through ``select_related``; everything else is deferred, so e.g.
+    ``fields=name,size`` neither loads the encryption columns nor joins the
+    uploader.
+    """
+    projection = getattr(serializer_class.Meta, 'projection', {})
+    if fields is None:
+        fields = serializer_class.Meta.fields
+        related = {column.split('__')[0] for name in fields for column in projection.get(name, ()) if '__' in column}
+        return queryset.select_related(*related) if related else queryset
+
+    declared = serializer_class().fields
+    columns = {'id', *(field.lstrip('-') for field in ordering)}
+    for name in fields:
+        if name in projection:
+            columns.update(projection[name])
+        else:
+            columns.add(declared[name].source.replace('.', '__'))
+    related = {column.split('__')[0] for column in columns if '__' in column}
+    if related:
+        # An argument-less select_related() would follow every foreign key
+        queryset = queryset.select_related(*related)
+    return queryset.only(*columns)
+
+
+class FieldProjectionMixin:
+    """Serializer mixin accepting ``fields=[...]`` to drop everything else from the representation."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
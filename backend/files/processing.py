@@ -0,0 +1,92 @@
+"""
+Post-upload processing, run in the background by the ``files.process_upload`` task.
+
+An upload is stored as-is and its ``File`` marked ``processing``. The task
+then runs the ``FILES_UPLOAD_PROCESSORS`` over the bytes, hashes them and
+moves them into the deduplicated blob store before marking the file
+``ready``. A processor refuses a file by raising ``Rejected``; the file is
+then marked ``failed`` and can no longer be downloaded.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import link_cache, log
+from .chunked import file_checksum
+from .models import Blob, File, ListingVersion
+from .tasks import enqueue_many, task
+
+logger = logging.getLogger('files')
+
+PROCESS_UPLOAD = 'files.process_upload'
+
+
+class Rejected(Exception):
+    """Raised by an upload processor to refuse a file (malware found, unsupported content...)."""
+
+
+def processors():
+    """The configured processors: callables taking ``(file, fileobj)``, ``fileobj`` positioned at the start."""
+    return [import_string(path) for path in settings.FILES_UPLOAD_PROCESSORS]
+
+
+def schedule(*files):
+    """Queue processing of freshly uploaded ``files``; call inside the transaction that created them."""
+    enqueue_many(PROCESS_UPLOAD, [(f'{PROCESS_UPLOAD}:{file.pk}', {'file_id': file.pk}) for file in files])
+
+
+def _invalidate(file):
+    """Invalidate the listings showing ``file`` (its owner's and every recipient's) and its cached link."""
+    recipients = File.shared_with.through.objects.filter(file_id=file.pk).values_list('user_id', flat=True)
+    ListingVersion.bump(uploaded_by=[file.uploaded_by_id], shared_with=list(recipients))
+    link_cache.invalidate([file.download_link])
+
+
+def _mark_failed(file_id):
+    with transaction.atomic():
+        file = File.objects.select_for_update().filter(pk=file_id, processing_status=File.PROCESSING).first()
+        if file is None:
+            return
+        file.processing_status = File.FAILED
+        file.save(update_fields=['processing_status'])
+        _invalidate(file)
+
+
+@task(PROCESS_UPLOAD, on_failure=_mark_failed)
+def process_upload(file_id):
+    file = File.objects.filter(pk=file_id, processing_status=File.PROCESSING).first()
+    if file is None:
+        return  # deleted, or finished by an earlier attempt
+
+    with file.file.open('rb') as content:
+        try:
+            for processor in processors():
+                processor(file, content)
+                content.seek(0)
+        except Rejected as e:
+            log.event(logger, 'upload.rejected', level=logging.WARNING, file_id=file_id, reason=str(e))
+            _mark_failed(file_id)
+            return
+
+        # Files assembled from upload sessions were hashed while their chunks were written out
+        checksum = file.checksum or file_checksum(content)
+        staged = None
+        with transaction.atomic():
+            locked = File.objects.select_for_update().filter(
+                pk=file_id, processing_status=File.PROCESSING).first()
+            if locked is None:
+                return
+            if locked.blob_id is None:
+                blob = Blob.ingest(content, checksum)
+                staged = locked.file.name
+                locked.blob, locked.file, locked.checksum = blob, blob.file.name, checksum
+            locked.processing_status = File.READY
+            locked.save(update_fields=['blob', 'file', 'checksum', 'processing_status'])
+            _invalidate(locked)
+
+    if staged and staged != locked.file.name:
+        File._meta.get_field('file').storage.delete(staged)
+    log.event(logger, 'upload.processed', sample=settings.FILES_LOG_SAMPLE_RATE, file_id=file_id, size=file.size,
+              deduplicated=locked.blob.refcount > 1 if staged else None)
@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    """
+    Declare how many SQL queries a view may run, independent of row counts.
+
+    Authentication is excluded (budgets are checked with an already
+    authenticated client); ``check_query_budgets`` enforces every declaration.
+    """
+
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(max_queries, label='block', using='default'):
+    """Fail with the captured SQL when the enclosed block runs more than ``max_queries`` queries."""
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    if len(context) > max_queries:
+        statements = '\n'.join(f'  {index}. {query["sql"]}' for index, query in enumerate(context.captured_queries, 1))
+        raise QueryBudgetExceeded(f'{label} ran {len(context)} queries, budget is {max_queries}:\n{statements}')
@@ -0,0 +1,80 @@
+"""
+Incremental maintenance of the dashboard counters (``UserStorage`` counters and ``SiteStats``).
+
+Every receiver applies a relative UPDATE, so concurrent requests never lose
+each other's changes. Paths that bypass these signals (raw SQL, cascades
+from deleting a user) are corrected by ``reconcile_storage``.
+"""
+from authentication.models import User
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import File, SiteStats, UserStorage
+from .signals import decryption_failed, files_created, files_deleted, files_shared
+
+
+@receiver(post_save, sender=File, dispatch_uid='files_stats_file_created')
+def file_created(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    UserStorage.adjust('file_count', {instance.uploaded_by_id: 1})
+    SiteStats.add(files_total=1, files_encrypted=int(bool(instance.encryption_key)))
+
+
+@receiver(files_created, dispatch_uid='files_stats_files_created')
+def files_added(sender, owners, encrypted, **kwargs):
+    UserStorage.adjust('file_count', owners)
+    SiteStats.add(files_total=sum(owners.values()), files_encrypted=encrypted)
+
+
+@receiver(files_deleted, dispatch_uid='files_stats_files_deleted')
+def files_removed(sender, owners, recipients, encrypted, **kwargs):
+    UserStorage.adjust('file_count', {user_id: -count for user_id, count in owners.items()})
+    UserStorage.adjust('shared_with_count', {user_id: -count for user_id, count in recipients.items()})
+    SiteStats.add(files_total=-sum(owners.values()), files_encrypted=-encrypted)
+
+
+@receiver(files_shared, dispatch_uid='files_stats_files_shared')
+def files_shared_with(sender, recipients, **kwargs):
+    UserStorage.adjust('shared_with_count', recipients)
+
+
+@receiver(decryption_failed, dispatch_uid='files_stats_decryption_failed')
+def count_decryption_failure(sender, **kwargs):
+    SiteStats.add(failed_decryptions=1)
+
+
+@receiver(post_init, sender=User, dispatch_uid='files_stats_user_mfa_loaded')
+def remember_mfa_state(sender, instance, **kwargs):
+    # The flag as loaded, so saving compares against it instead of reading the row back
+    instance._stats_mfa_was = instance.__dict__.get('is_mfa_enabled')
+
+
+@receiver(pre_save, sender=User, dispatch_uid='files_stats_user_mfa_before')
+def load_mfa_state(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Only users loaded without the flag (.only()/.defer()) read it back before a save that may change it
+    if raw or instance._state.adding or instance._stats_mfa_was is not None or \
+            (update_fields is not None and 'is_mfa_enabled' not in update_fields):
+        return
+    instance._stats_mfa_was = User.objects.filter(pk=instance.pk).values_list('is_mfa_enabled', flat=True).first()
+
+
+@receiver(post_save, sender=User, dispatch_uid='files_stats_user_saved')
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        UserStorage.objects.get_or_create(user=instance)
+        if not instance.is_mfa_enabled:
+            SiteStats.add(users_without_mfa=1)
+    elif update_fields is not None and 'is_mfa_enabled' not in update_fields:
+        return
+    elif instance._stats_mfa_was is not None and instance._stats_mfa_was != instance.is_mfa_enabled:
+        SiteStats.add(users_without_mfa=-1 if instance.is_mfa_enabled else 1)
+    instance._stats_mfa_was = instance.is_mfa_enabled
+
+
+@receiver(post_delete, sender=User, dispatch_uid='files_stats_user_deleted')
+def user_deleted(sender, instance, **kwargs):
+    if not instance.is_mfa_enabled:
+        SiteStats.add(users_without_mfa=-1)
@@ -1,22 +1,27 @@
-import logging
-import uuid
 from datetime import timedelta, datetime, timezone
 
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import File, UserStorage, RoleUpgradeRequest
+from .chunked import received_ranges
+from .encoding import encode_metadata, validate_metadata
+from .pagination import FieldProjectionMixin
+from .models import File, UserStorage, RoleUpgradeRequest, UploadSession
+from .processing import schedule
 
-logger = logging.getLogger('files')  # Match your app name
 
-
-class FileSerializer(serializers.ModelSerializer):
+class FileSerializer(FieldProjectionMixin, serializers.ModelSerializer):
     uploaded_by = serializers.SerializerMethodField()
     encryption_metadata = serializers.SerializerMethodField()
 
     class Meta:
         model = File
         fields = ['id', 'name', 'size', 'extension', 'status', 'expiry_date', 'uploaded_date', 'download_link',
-                  'uploaded_by', 'encryption_metadata']
+                  'uploaded_by', 'encryption_metadata', 'processing_status']
+        projection = {
+            'uploaded_by': ('uploaded_by__id', 'uploaded_by__first_name', 'uploaded_by__email'),
+            'encryption_metadata': ('encryption_key', 'encryption_iv'),
+        }
 
     def get_uploaded_by(self, obj):
         return {
@@ -26,10 +31,30 @@ class FileSerializer(serializers.ModelSerializer):
         }
 
     def get_encryption_metadata(self, obj):
-        return {
-            'key': obj.encryption_key if obj.encryption_key else None,
-            'iv': list(obj.encryption_iv) if obj.encryption_iv else []
-        }
+        return encode_metadata(obj.encryption_key, obj.encryption_iv, self.context.get('request'))
+
+
+class BulkShareSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False,
+                                     max_length=settings.FILES_MAX_BULK_SHARE)
+    # Not EmailField: addresses nobody registered under are reported back, not rejected
+    emails = serializers.ListField(child=serializers.CharField(max_length=254),
+                                   max_length=settings.FILES_MAX_BULK_SHARE)
+
+
+class BundleSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list,
+                                     max_length=settings.FILES_MAX_BUNDLE)
+    download_links = serializers.ListField(child=serializers.UUIDField(), required=False, default=list,
+                                           max_length=settings.FILES_MAX_BUNDLE)
+    format = serializers.ChoiceField(choices=['zip', 'tar'], default='zip')
+
+    def validate(self, data):
+        if not data['file_ids'] and not data['download_links']:
+            raise serializers.ValidationError("Send file_ids, download_links or both")
+        if len(data['file_ids']) + len(data['download_links']) > settings.FILES_MAX_BUNDLE:
+            raise serializers.ValidationError(f"A bundle may hold at most {settings.FILES_MAX_BUNDLE} files")
+        return data
 
 
 class UserStorageSerializer(serializers.ModelSerializer):
@@ -49,59 +74,120 @@ class FileUploadSerializer(serializers.ModelSerializer):
         model = File
         fields = ['file', 'status', 'expiry_days', 'encryption_metadata']
 
-    def create(self, validated_data):  # Moved outside Meta class
-        print("=====================================")
-        print("DIRECT PRINT - Starting file upload")
-        logger.error("=== Starting file upload ===")
-
-        print(f"DIRECT PRINT - Full validated_data: {validated_data}")
-        logger.error(f"Full validated_data: {validated_data}")
+    def validate_encryption_metadata(self, value):
+        return validate_metadata(value)
 
+    def create(self, validated_data):  # Moved outside Meta class
+        expiry_days = validated_data.pop('expiry_days', 7)
+        file_obj = validated_data.pop('file')
+        encryption_metadata = validated_data.pop('encryption_metadata', {})
+
+        # Create the file instance
+        new_file = File(
+            name=file_obj.name,
+            extension=file_obj.name.split('.')[-1],
+            size=file_obj.size,
+            uploaded_by=self.context['request'].user,
+            status=validated_data.get('status', 'private'),
+            expiry_date=datetime.now(timezone.utc) + timedelta(days=expiry_days),
+            encryption_key=encryption_metadata.get('key'),
+            encryption_iv=encryption_metadata.get('iv'),
+            processing_status=File.PROCESSING
+        )
+
+        # Store the bytes as uploaded; hashing and deduplication into the blob store happen in the background
+        new_file.file.save(file_obj.name, file_obj, save=False)
         try:
-            expiry_days = validated_data.pop('expiry_days', 7)
-            file_obj = validated_data.pop('file')
-            encryption_metadata = validated_data.pop('encryption_metadata', {})
-
-            print(f"DIRECT PRINT - Encryption metadata: {encryption_metadata}")
-            logger.error(f"Encryption metadata: {encryption_metadata}")
-
-            # Create the file instance
-            file_instance = File.objects.create(
-                name=file_obj.name,
-                file=file_obj,
-                extension=file_obj.name.split('.')[-1],
-                size=file_obj.size,
-                uploaded_by=self.context['request'].user,
-                status=validated_data.get('status', 'private'),
-                expiry_date=datetime.now(timezone.utc) + timedelta(days=expiry_days),
-                encryption_key=encryption_metadata.get('key'),
-                encryption_iv=bytes(encryption_metadata.get('iv', [])) if encryption_metadata.get('iv') else None,
-                download_link=str(uuid.uuid4())
-            )
-
-            return file_instance
-
-        except Exception as e:
-            print(f"DIRECT PRINT - Error: {str(e)}")
-            logger.error(f"Error creating file: {str(e)}")
+            new_file.save()
+        except Exception:
+            new_file.file.delete(save=False)
             raise
+        schedule(new_file)
+        return new_file
+
+
+class BatchUploadSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.FileField(), required=False, default=list,
+                                  max_length=settings.FILES_MAX_BATCH_UPLOAD)
+    archive = serializers.FileField(required=False)  # tar (optionally compressed) or zip
+    status = serializers.ChoiceField(choices=File.STATUS_CHOICES, default='private')
+    expiry_days = serializers.IntegerField(min_value=1, max_value=30, default=7)
+    # Keyed by file name (the member path for archives); files without an entry carry no metadata
+    encryption_metadata = serializers.JSONField(required=False, default=dict)
+
+    def validate_encryption_metadata(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Encryption metadata must be an object keyed by file name")
+        return {name: validate_metadata(metadata) for name, metadata in value.items()}
+
+    def validate(self, data):
+        if bool(data['files']) == ('archive' in data):
+            raise serializers.ValidationError("Send either files or one archive")
+        return data
+
 
+class UploadSessionCreateSerializer(serializers.ModelSerializer):
+    status = serializers.ChoiceField(choices=File.STATUS_CHOICES, source='file_status', default='private')
+    expiry_days = serializers.IntegerField(min_value=1, max_value=30, default=7)
+    encryption_metadata = serializers.DictField(required=False, default=dict)  # may carry raw bytes via msgpack
+
+    class Meta:
+        model = UploadSession
+        fields = ['file_name', 'total_size', 'status', 'expiry_days', 'encryption_metadata']
+
+    def validate_encryption_metadata(self, value):
+        return validate_metadata(value)
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("File must not be empty")
+        return value
 
-class RoleUpgradeRequestSerializer(serializers.ModelSerializer):
-    user_name = serializers.SerializerMethodField(method_name='get_user_name')
-    user_email = serializers.SerializerMethodField(method_name='get_user_email')
-    user_id = serializers.SerializerMethodField(method_name='get_user_id')
+    def create(self, validated_data):
+        encryption_metadata = validated_data.pop('encryption_metadata', {})
+        return UploadSession.objects.create(
+            user=self.context['request'].user,
+            chunk_size=self.context['chunk_size'],
+            encryption_key=encryption_metadata.get('key'),
+            encryption_iv=encryption_metadata.get('iv'),
+            **validated_data
+        )
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.ReadOnlyField()
+    received_chunks = serializers.SerializerMethodField()
+    received_bytes = serializers.SerializerMethodField()
 
     class Meta:
-        model = RoleUpgradeRequest
-        fields = ['id', 'user_id', 'user_name', 'user_email', 'current_role', 'requested_role', 'status',
-                  'request_date']
+        model = UploadSession
+        fields = ['id', 'file_name', 'total_size', 'chunk_size', 'total_chunks', 'status', 'received_chunks',
+                  'received_bytes', 'created_at']
+
+    def _chunks(self, obj):
+        if not hasattr(obj, '_received'):
+            obj._received = list(obj.chunks.order_by('index').values_list('index', 'size'))
+        return obj._received
+
+    def get_received_chunks(self, obj):
+        return received_ranges([index for index, _ in self._chunks(obj)])
 
-    def get_user_name(self, obj):
-        return obj.user.get_full_name()
+    def get_received_bytes(self, obj):
+        return sum(size for _, size in self._chunks(obj))
 
-    def get_user_email(self, obj):
-        return obj.user.email
 
-    def get_user_id(self, obj):
-        return obj.user.id
+class RoleUpgradeRequestSerializer(FieldProjectionMixin, serializers.ModelSerializer):
+    # Read through the select_related user (or the raw FK column) so listing pages never query per row
+    user_name = serializers.CharField(source='user.get_full_name', read_only=True)
+    user_email = serializers.EmailField(source='user.email', read_only=True)
+    user_id = serializers.ReadOnlyField()
+
+    class Meta:
+        model = RoleUpgradeRequest
+        fields = ['id', 'user_id', 'user_name', 'user_email', 'current_role', 'requested_role', 'status',
+                  'request_date']
+        projection = {
+            'user_id': ('user',),
+            'user_name': ('user__first_name', 'user__last_name'),
+            'user_email': ('user__email',),
+        }
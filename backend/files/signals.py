@@ -0,0 +1,19 @@
+from django.dispatch import Signal
+
+# Sent after bulk inserts of File rows, which send no post_save, with owners:
+# Counter of files created per owner id and encrypted: how many of them carry
+# client-side encryption metadata.
+files_created = Signal()
+
+# Sent by FileQuerySet.purge() (which File.delete() uses) once the rows are gone, with
+# owners: Counter of files deleted per owner id, recipients: Counter of shares
+# removed per recipient id, encrypted: how many of the files carried client-side
+# encryption metadata.
+files_deleted = Signal()
+
+# Sent by FileQuerySet.share() with recipients: Counter of newly created shares
+# per recipient id.
+files_shared = Signal()
+
+# Sent by files.encryption whenever stored ciphertext fails authentication.
+decryption_failed = Signal()
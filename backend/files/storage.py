@@ -0,0 +1,377 @@
+import hashlib
+import io
+import mimetypes
+import os
+import posixpath
+import shutil
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils._os import safe_join
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .encryption import HEADER, DecryptingReader, EncryptingReader, Envelope, is_encrypted, parse_keys, \
+    plaintext_size
+
+# FILES_STORAGE_BACKEND values (mirrored in settings.STORAGES) and the classes behind them
+BACKENDS = {
+    'local': 'django.core.files.storage.FileSystemStorage',
+    'sharded': 'files.storage.ShardedFileSystemStorage',
+    'multivolume': 'files.storage.MultiVolumeStorage',
+    's3': 'files.storage.S3Storage',
+    'encrypted': 'files.storage.EncryptedStorage',
+}
+
+
+def get_storage(alias, **options):
+    """Instantiate the storage registered as ``alias`` (or a dotted class path)."""
+    return import_string(BACKENDS.get(alias, alias))(**options)
+
+
+def local_path(storage, name):
+    """Filesystem path of ``name``, or ``None`` for storages without one (e.g. S3)."""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+@deconstructible(path='files.storage.ShardedFileSystemStorage')
+class ShardedFileSystemStorage(FileSystemStorage):
+    """
+    Local storage that fans files out as ``<dir>/ab/cd/<name>`` under the root.
+
+    ``ab/cd`` come from a hash of the whole name, so no directory holds more
+    than a sliver of the files. Callers keep using the logical name (the one
+    stored in the database); only the path on disk changes. Files written
+    before sharding are still found at their flat location unless
+    ``legacy_fallback`` is off.
+    """
+
+    def __init__(self, *args, legacy_fallback=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.legacy_fallback = legacy_fallback
+
+    @staticmethod
+    def shard(name):
+        directory, base = posixpath.split(name.replace('\\', '/'))
+        digest = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+        return posixpath.join(directory, digest[:2], digest[2:4], base)
+
+    @staticmethod
+    def unshard(name):
+        parts = name.replace('\\', '/').split('/')
+        return '/'.join(parts[:-3] + parts[-1:])
+
+    def roots(self):
+        return [self.location]
+
+    def locate(self, name):
+        """Return ``(root, full path)`` of an existing file, or ``None``."""
+        for root in self.roots():
+            path = self._path_under(root, self.shard(name))
+            if os.path.lexists(path):
+                return root, path
+            if self.legacy_fallback:
+                path = self._path_under(root, name)
+                if os.path.lexists(path):
+                    return root, path
+        return None
+
+    def path(self, name):
+        found = self.locate(name)
+        if found:
+            return found[1]
+        return self._path_under(self.choose_root(), self.shard(name))
+
+    def choose_root(self):
+        return self.location
+
+    def split_path(self, name):
+        """``(root, path relative to it)`` of ``name``, e.g. for ``X-Accel-Redirect``."""
+        found = self.locate(name)
+        root, path = found if found else (self.choose_root(), self.path(name))
+        return root, os.path.relpath(path, root).replace('\\', '/')
+
+    def _path_under(self, root, name):
+        return safe_join(root, name)
+
+    def _save(self, name, content):
+        saved = super()._save(name, content)
+        # FileSystemStorage reports the on-disk path relative to self.location; give back the logical name
+        full_path = os.path.normpath(os.path.join(self.location, saved))
+        for root in self.roots():
+            if os.path.commonpath([os.path.abspath(root), full_path]) == os.path.abspath(root):
+                return self.unshard(os.path.relpath(full_path, root).replace('\\', '/'))
+        return self.unshard(saved)
+
+    def listdir(self, path):
+        raise NotImplementedError('Sharded storage cannot list logical directories')
+
+
+@deconstructible(path='files.storage.MultiVolumeStorage')
+class MultiVolumeStorage(ShardedFileSystemStorage):
+    """
+    Sharded local storage spread over several volumes (typically one per disk).
+
+    New files go to the volume with the most free space; reads probe the
+    volumes in order. The first volume doubles as the legacy ``MEDIA_ROOT``.
+    """
+
+    def __init__(self, volumes=None, **kwargs):
+        self.volumes = [str(volume) for volume in (volumes or settings.FILES_STORAGE_VOLUMES)]
+        if not self.volumes:
+            raise ImproperlyConfigured('MultiVolumeStorage needs at least one entry in FILES_STORAGE_VOLUMES')
+        kwargs.setdefault('location', self.volumes[0])
+        super().__init__(**kwargs)
+
+    def roots(self):
+        return [os.path.abspath(volume) for volume in self.volumes]
+
+    def choose_root(self):
+        best, best_free = None, -1
+        for volume in self.roots():
+            os.makedirs(volume, exist_ok=True)
+            free = shutil.disk_usage(volume).free
+            if free > best_free:
+                best, best_free = volume, free
+        return best
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable reader over an S3 object.
+
+    Sequential reads share one streaming ``GetObject`` opened at the current
+    offset; a seek drops it, and the next read reopens with ``Range`` from the
+    new position.
+    """
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self._position = 0
+        self._body = None
+        self._size = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self.storage.size(self.name)
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        else:
+            position = self.size + offset
+        if position != self._position:
+            self._drop_body()
+            self._position = max(0, position)
+        return self._position
+
+    def readinto(self, buffer):
+        if self._body is None:
+            if self._position >= self.size:
+                return 0
+            response = self.storage.client.get_object(Bucket=self.storage.bucket, Key=self.storage.key(self.name),
+                                                      Range=f'bytes={self._position}-')
+            self._body = response['Body']
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _drop_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self):
+        self._drop_body()
+        super().close()
+
+
+class ReaderFile(DjangoFile):
+    """Django ``File`` over a seekable raw reader that knows its own size."""
+
+    def __init__(self, reader):
+        super().__init__(io.BufferedReader(reader, buffer_size=256 * 1024), name=reader.name)
+        self.reader = reader
+
+    @property
+    def size(self):
+        return self.reader.size
+
+
+@deconstructible(path='files.storage.S3Storage')
+class S3Storage(Storage):
+    """
+    Storage on S3 or any S3-compatible service (MinIO, Ceph, moto's server mode).
+
+    ``boto3`` is only imported when the first request is made. Point
+    ``FILES_S3_ENDPOINT_URL`` at a local MinIO or ``moto_server`` to run
+    ``check_storage s3`` without AWS.
+    """
+
+    def __init__(self, bucket=None, endpoint_url=None, region_name=None, access_key_id=None, secret_access_key=None,
+                 prefix=None, url_expiry=None):
+        self.bucket = bucket or settings.FILES_S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.FILES_S3_ENDPOINT_URL
+        self.region_name = region_name or settings.FILES_S3_REGION
+        self.access_key_id = access_key_id or settings.FILES_S3_ACCESS_KEY_ID
+        self.secret_access_key = secret_access_key or settings.FILES_S3_SECRET_ACCESS_KEY
+        self.prefix = (settings.FILES_S3_PREFIX if prefix is None else prefix).strip('/')
+        self.url_expiry = url_expiry or settings.FILES_S3_URL_EXPIRY
+        if not self.bucket:
+            raise ImproperlyConfigured('S3Storage needs FILES_S3_BUCKET')
+
+    @cached_property
+    def client(self):
+        try:
+            import boto3
+        except ImportError:
+            raise ImproperlyConfigured('S3Storage requires boto3 (pip install boto3)')
+        return boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region_name,
+                            aws_access_key_id=self.access_key_id, aws_secret_access_key=self.secret_access_key)
+
+    def key(self, name):
+        name = name.replace('\\', '/')
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _open(self, name, mode='rb'):
+        if 'r' not in mode or '+' in mode:
+            raise ValueError('S3Storage files are opened read-only')
+        return ReaderFile(S3ObjectReader(self, name))
+
+    def _save(self, name, content):
+        try:
+            content.seek(0)
+        except (AttributeError, io.UnsupportedOperation):
+            pass  # one-shot streams such as an incoming chunk
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(content, self.bucket, self.key(name), ExtraArgs={'ContentType': content_type})
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['LastModified']
+
+    def url(self, name):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self.key(name)},
+                                                  ExpiresIn=self.url_expiry)
+
+    def download_url(self, name, disposition, content_type):
+        """Presigned URL whose response carries the download's ``Content-Disposition`` and ``Content-Type``."""
+        return self.client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket, 'Key': self.key(name),
+            'ResponseContentDisposition': disposition, 'ResponseContentType': content_type,
+        }, ExpiresIn=self.url_expiry)
+
+    def listdir(self, path):
+        prefix = self.key(path).rstrip('/') + '/' if path else (f'{self.prefix}/' if self.prefix else '')
+        directories, files = [], []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix,
+                                                                         Delimiter='/'):
+            directories.extend(entry['Prefix'][len(prefix):].rstrip('/') for entry in page.get('CommonPrefixes', []))
+            files.extend(entry['Key'][len(prefix):] for entry in page.get('Contents', []))
+        return directories, files
+
+
+@deconstructible(path='files.storage.EncryptedStorage')
+class EncryptedStorage(Storage):
+    """
+    Wraps another storage so every object in it is encrypted at rest (see ``files.encryption``).
+
+    Uploads are encrypted chunk by chunk as they stream into the inner storage
+    and reads decrypt only the chunks they touch, so neither direction holds a
+    whole file in memory. Objects written before encryption was switched on
+    are served as they are. There is deliberately no ``path()`` or ``url()``:
+    the bytes on disk are ciphertext, so downloads are always streamed through
+    the application.
+    """
+
+    def __init__(self, inner=None, keys=None, chunk_size=None):
+        self.inner = inner if isinstance(inner, Storage) else get_storage(inner or settings.FILES_STORAGE_BACKEND)
+        self.master_keys = parse_keys(keys or settings.FILES_ENCRYPTION_KEYS)
+        if not self.master_keys:
+            raise ImproperlyConfigured('EncryptedStorage needs at least one key in FILES_ENCRYPTION_KEYS')
+        self.chunk_size = chunk_size or settings.FILES_ENCRYPTION_CHUNK_SIZE
+
+    def _open(self, name, mode='rb'):
+        if 'r' not in mode or '+' in mode:
+            raise ValueError('EncryptedStorage files are opened read-only')
+        fileobj = self.inner.open(name, 'rb')
+        header = fileobj.read(HEADER.size)
+        if not is_encrypted(header):
+            fileobj.seek(0)
+            return fileobj
+        envelope = Envelope.parse(header, self.master_keys)
+        return ReaderFile(DecryptingReader(fileobj, envelope, self.inner.size(name), name=name))
+
+    def _save(self, name, content):
+        try:
+            content.seek(0)
+        except (AttributeError, io.UnsupportedOperation):
+            pass  # one-shot streams such as an incoming chunk
+        envelope = Envelope.create(self.master_keys, self.chunk_size)
+        return self.inner._save(name, DjangoFile(EncryptingReader(content, envelope), name=name))
+
+    def size(self, name):
+        with self.inner.open(name, 'rb') as fileobj:
+            header = fileobj.read(HEADER.size)
+        stored_size = self.inner.size(name)
+        if not is_encrypted(header):
+            return stored_size
+        return plaintext_size(stored_size, HEADER.unpack(header)[2])
+
+    def delete(self, name):
+        self.inner.delete(name)
+
+    def exists(self, name):
+        return self.inner.exists(name)
+
+    def listdir(self, path):
+        return self.inner.listdir(path)
+
+    def get_modified_time(self, name):
+        return self.inner.get_modified_time(name)
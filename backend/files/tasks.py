@@ -0,0 +1,368 @@
+"""
+Background tasks.
+
+Work that need not finish before a response is registered with ``@task`` and
+queued with ``enqueue``; ``python manage.py run_tasks`` workers execute it.
+The queue is chosen by ``FILES_TASK_QUEUE``:
+
+- ``database``: the ``Task`` table. Tasks are inserted in the caller's
+  transaction, so they exist exactly when the rows they refer to do.
+- ``redis``: ``FILES_TASK_REDIS_URL`` (needs the ``redis`` package). Tasks
+  are pushed once the caller's transaction commits.
+- ``local``: runs each task in-process as soon as the caller's transaction
+  commits, retrying immediately. Meant for tests and for development
+  without a worker.
+
+A failed task is retried with exponential backoff up to ``max_attempts``
+times. Tasks may run more than once (a worker can die after finishing but
+before recording it, or a lease can expire), so they must be idempotent.
+An idempotency ``key`` keeps duplicate enqueues from queueing the same work
+twice.
+"""
+import json
+import logging
+import time
+import traceback
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from typing import Callable, NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import log
+
+logger = logging.getLogger('files')
+
+
+class TaskSpec(NamedTuple):
+    func: Callable
+    max_attempts: int
+    retry_delay: float  # seconds before the first retry; doubled for each later one
+    on_failure: Callable | None  # called with the task's kwargs once it has run out of attempts
+
+
+registry = {}
+
+
+def task(name, max_attempts=5, retry_delay=10, on_failure=None):
+    """Register the decorated function as the task ``name``; it is called with the enqueued keyword arguments."""
+    def decorator(func):
+        registry[name] = TaskSpec(func, max_attempts, retry_delay, on_failure)
+        return func
+    return decorator
+
+
+def enqueue(name, key=None, delay=0, **kwargs):
+    """Queue task ``name`` to run with ``kwargs`` (JSON-serialisable) in ``delay`` seconds or later."""
+    enqueue_many(name, [(key, kwargs)], delay)
+
+
+def enqueue_many(name, calls, delay=0):
+    """Queue one run of task ``name`` per ``(key, kwargs)`` in ``calls``, in as few round trips as the queue allows."""
+    if name not in registry:
+        raise KeyError(f'Unknown task {name!r}')
+    calls = list(calls)
+    if calls:
+        get_queue().push(name, calls, delay)
+
+
+def execute(name, payload, attempt):
+    """
+    Run one attempt of a task and log its outcome.
+
+    Returns ``None`` on success, otherwise ``(error, retry_in)`` where
+    ``retry_in`` is ``None`` once the task has run out of attempts.
+    """
+    spec = registry.get(name)
+    started = time.perf_counter()
+    try:
+        if spec is None:
+            raise KeyError(f'Unknown task {name!r}')
+        spec.func(**payload)
+    except Exception:
+        error = traceback.format_exc()
+        duration = time.perf_counter() - started
+        if spec is not None and attempt < spec.max_attempts:
+            retry_in = spec.retry_delay * 2 ** (attempt - 1)
+            log.event(logger, 'task.retry', level=logging.WARNING, exc_info=True, task=name, attempt=attempt,
+                      retry_in=retry_in, duration_ms=round(duration * 1000, 1))
+            return error, retry_in
+        log.event(logger, 'task.failed', level=logging.ERROR, exc_info=True, task=name, attempt=attempt,
+                  duration_ms=round(duration * 1000, 1))
+        if spec is not None and spec.on_failure is not None:
+            try:
+                spec.on_failure(**payload)
+            except Exception:
+                log.event(logger, 'task.on_failure_failed', level=logging.ERROR, exc_info=True, task=name)
+        return error, None
+    log.event(logger, 'task.done', task=name, attempt=attempt,
+              duration_ms=round((time.perf_counter() - started) * 1000, 1))
+    return None
+
+
+class DatabaseQueue:
+    """
+    Tasks stored as ``Task`` rows.
+
+    Workers claim a due task with a conditional UPDATE, so any number of them
+    can poll the same table without row locks. A claim holds a lease of
+    ``FILES_TASK_LEASE`` seconds; a task whose worker died is claimed again
+    once its lease runs out.
+    """
+
+    def __init__(self, lease=None):
+        self.lease = lease or settings.FILES_TASK_LEASE
+
+    @property
+    def model(self):
+        from .models import Task
+        return Task
+
+    def push(self, name, calls, delay=0):
+        Task = self.model
+        run_at = timezone.now() + timedelta(seconds=delay)
+        tasks = [Task(name=name, payload=payload, key=key, run_at=run_at) for key, payload in calls]
+        # ignore_conflicts turns a duplicate idempotency key into a no-op
+        Task.objects.bulk_create(tasks, ignore_conflicts=any(task.key is not None for task in tasks))
+
+    def due(self, now):
+        Task = self.model
+        return Task.objects.filter(models.Q(status=Task.QUEUED, run_at__lte=now) |
+                                   models.Q(status=Task.RUNNING, locked_until__lt=now))
+
+    def claim(self, names=None):
+        """Take the next due task, or return ``None``; ``names`` restricts the task names taken."""
+        Task = self.model
+        now = timezone.now()
+        due = self.due(now)
+        if names:
+            due = due.filter(name__in=names)
+        for task in due.order_by('run_at', 'id').only('id', 'status', 'locked_until')[:10]:
+            claimed = Task.objects.filter(pk=task.pk, status=task.status, locked_until=task.locked_until).update(
+                status=Task.RUNNING, attempts=models.F('attempts') + 1, started_at=now,
+                locked_until=now + timedelta(seconds=self.lease))
+            if claimed:
+                return Task.objects.get(pk=task.pk)
+        return None
+
+    def run_next(self, names=None):
+        """Claim and run one task; returns ``False`` when nothing was due."""
+        Task = self.model
+        task = self.claim(names)
+        if task is None:
+            return False
+        started = time.perf_counter()
+        outcome = execute(task.name, task.payload, task.attempts)
+        finished = {'finished_at': timezone.now(), 'duration': time.perf_counter() - started, 'locked_until': None}
+        if outcome is None:
+            Task.objects.filter(pk=task.pk).update(status=Task.DONE, last_error='', **finished)
+        else:
+            error, retry_in = outcome
+            if retry_in is None:
+                Task.objects.filter(pk=task.pk).update(status=Task.FAILED, last_error=error, **finished)
+            else:
+                Task.objects.filter(pk=task.pk).update(
+                    status=Task.QUEUED, last_error=error, run_at=timezone.now() + timedelta(seconds=retry_in),
+                    **finished)
+        return True
+
+    def prune(self, older_than):
+        """Delete tasks that finished successfully before ``older_than``; returns how many."""
+        Task = self.model
+        return Task.objects.filter(status=Task.DONE, finished_at__lt=older_than).delete()[0]
+
+    def stats(self):
+        Task = self.model
+        stats = defaultdict(_empty_stats)
+        rows = Task.objects.values('name', 'status').annotate(
+            count=models.Count('id'), attempts=models.Sum('attempts'), total=models.Sum('duration'),
+            longest=models.Max('duration'))
+        for row in rows:
+            entry = stats[row['name']]
+            entry[row['status']] += row['count']
+            entry['retries'] += max(0, (row['attempts'] or 0) - row['count'])
+            if row['status'] in (Task.DONE, Task.FAILED):
+                entry['total_s'] += row['total'] or 0.0
+                entry['max_s'] = max(entry['max_s'], row['longest'] or 0.0)
+        return _finish_stats(stats)
+
+
+class RedisQueue:
+    """
+    Tasks kept in Redis.
+
+    Due tasks sit in a sorted set scored by run time; a worker claims one by
+    removing it from that set (only one ``ZREM`` can succeed) and moving it
+    to a set of leases. Per-task counters accumulate under ``<prefix>:stats``.
+    """
+
+    def __init__(self, url=None, prefix='files:tasks', lease=None):
+        self.url = url or settings.FILES_TASK_REDIS_URL
+        self.prefix = prefix
+        self.lease = lease or settings.FILES_TASK_LEASE
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('The redis task queue requires the redis package (pip install redis)')
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix, *parts))
+
+    def push(self, name, calls, delay=0):
+        def push():
+            pipe = self.client.pipeline()
+            for key, payload in calls:
+                task_id = uuid.uuid4().hex
+                if key is not None and not self.client.set(
+                        self._key('key', key), task_id, nx=True, ex=settings.FILES_TASK_RETENTION_DAYS * 86400):
+                    continue
+                pipe.set(self._key('task', task_id), json.dumps({'name': name, 'payload': payload, 'attempts': 0}))
+                pipe.zadd(self._key('due'), {task_id: time.time() + delay})
+            pipe.execute()
+
+        transaction.on_commit(push)
+
+    def claim(self, names=None):
+        now = time.time()
+        # Tasks whose worker died without finishing are due again
+        for task_id in self.client.zrangebyscore(self._key('leased'), 0, now):
+            if self.client.zrem(self._key('leased'), task_id):
+                self.client.zadd(self._key('due'), {task_id: now})
+        for task_id in self.client.zrangebyscore(self._key('due'), 0, now, start=0, num=10):
+            raw = self.client.get(self._key('task', task_id.decode()))
+            if raw is None:
+                self.client.zrem(self._key('due'), task_id)
+                continue
+            record = json.loads(raw)
+            if names and record['name'] not in names:
+                continue
+            if self.client.zrem(self._key('due'), task_id):
+                self.client.zadd(self._key('leased'), {task_id: now + self.lease})
+                record['attempts'] += 1
+                return task_id.decode(), record
+        return None
+
+    def run_next(self, names=None):
+        claimed = self.claim(names)
+        if claimed is None:
+            return False
+        task_id, record = claimed
+        started = time.perf_counter()
+        outcome = execute(record['name'], record['payload'], record['attempts'])
+        duration_ms = int((time.perf_counter() - started) * 1000)
+
+        pipe = self.client.pipeline()
+        stats = self._key('stats', record['name'])
+        pipe.zrem(self._key('leased'), task_id)
+        pipe.hincrby(stats, 'retries', int(record['attempts'] > 1))
+        if outcome is not None and outcome[1] is not None:
+            pipe.set(self._key('task', task_id), json.dumps(record))
+            pipe.zadd(self._key('due'), {task_id: time.time() + outcome[1]})
+        else:
+            pipe.delete(self._key('task', task_id))
+            pipe.hincrby(stats, 'done' if outcome is None else 'failed', 1)
+            pipe.hincrby(stats, 'total_ms', duration_ms)
+            pipe.eval("local m = tonumber(redis.call('HGET', KEYS[1], 'max_ms') or '0') "
+                      "if tonumber(ARGV[1]) > m then redis.call('HSET', KEYS[1], 'max_ms', ARGV[1]) end",
+                      1, stats, duration_ms)
+        pipe.execute()
+        return True
+
+    def prune(self, older_than):
+        return 0  # finished tasks are deleted as they finish; idempotency keys expire on their own
+
+    def stats(self):
+        stats = defaultdict(_empty_stats)
+        for key in self.client.scan_iter(self._key('stats', '*')):
+            name = key.decode()[len(self._key('stats', '')):]
+            values = {field.decode(): int(value) for field, value in self.client.hgetall(key).items()}
+            entry = stats[name]
+            for field in ('done', 'failed', 'retries'):
+                entry[field] = values.get(field, 0)
+            entry['total_s'] = values.get('total_ms', 0) / 1000
+            entry['max_s'] = values.get('max_ms', 0) / 1000
+        stats['*']['queued'] = self.client.zcard(self._key('due'))
+        stats['*']['running'] = self.client.zcard(self._key('leased'))
+        return _finish_stats(stats)
+
+
+class LocalQueue:
+    """Runs tasks in this process when the enqueuing transaction commits; for tests and development."""
+
+    def __init__(self):
+        self.seen_keys = set()
+        self._stats = defaultdict(_empty_stats)
+
+    def push(self, name, calls, delay=0):
+        for key, payload in calls:
+            if key is not None:
+                if key in self.seen_keys:
+                    continue
+                self.seen_keys.add(key)
+            transaction.on_commit(lambda payload=payload: self.run(name, payload))
+
+    def run(self, name, payload):
+        entry = self._stats[name]
+        for attempt in range(1, (registry[name].max_attempts if name in registry else 1) + 1):
+            started = time.perf_counter()
+            outcome = execute(name, payload, attempt)
+            duration = time.perf_counter() - started
+            if outcome is None or outcome[1] is None:
+                entry['done' if outcome is None else 'failed'] += 1
+                entry['total_s'] += duration
+                entry['max_s'] = max(entry['max_s'], duration)
+                return
+            entry['retries'] += 1
+
+    def run_next(self, names=None):
+        return False  # nothing is ever left waiting
+
+    def prune(self, older_than):
+        return 0
+
+    def stats(self):
+        return _finish_stats(self._stats)
+
+
+def _empty_stats():
+    return {'queued': 0, 'running': 0, 'done': 0, 'failed': 0, 'retries': 0, 'total_s': 0.0, 'max_s': 0.0}
+
+
+def _finish_stats(stats):
+    result = {}
+    for name, entry in sorted(stats.items()):
+        finished = entry['done'] + entry['failed']
+        total = entry.pop('total_s')
+        entry['mean_ms'] = round(total / finished * 1000, 1) if finished else None
+        entry['max_ms'] = round(entry.pop('max_s') * 1000, 1)
+        result[name] = entry
+    return result
+
+
+QUEUES = {
+    'database': 'files.tasks.DatabaseQueue',
+    'redis': 'files.tasks.RedisQueue',
+    'local': 'files.tasks.LocalQueue',
+}
+
+_queues = {}
+
+
+def get_queue(alias=None):
+    """The queue registered as ``alias`` (default ``FILES_TASK_QUEUE``), one instance per process."""
+    alias = alias or settings.FILES_TASK_QUEUE
+    if alias not in _queues:
+        _queues[alias] = import_string(QUEUES.get(alias, alias))()
+    return _queues[alias]
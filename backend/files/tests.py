@@ -1 +1,1217 @@
-# Create your tests here.
+import asyncio
+import base64
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import logging.handlers
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from authentication.models import User
+from core import db_router, throttling
+from core import settings as project_settings
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import FileResponse, HttpResponse
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import empty
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import async_views, batch, bundles, downloads, encryption, link_cache, log, processing, renderers, tasks, views
+from .benchmarking import percentile, summarize
+from .management.commands.bench_api import compare
+from .management.commands.check_query_budgets import budgeted_endpoints, seed
+from .management.commands.reconcile_storage import usage_expression
+from .models import Blob, File, ListingVersion, UploadSession, UserStorage
+from .storage import EncryptedStorage, MultiVolumeStorage, S3Storage, ShardedFileSystemStorage
+
+
+class FilesTestMixin:
+    """
+    Per-test MEDIA_ROOT, request limits and bandwidth shaping off, and tasks
+    run in-process. Process-wide state (task queues, throttle buckets, caches)
+    is reset so database ids reused across tests never hit stale entries.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp(prefix='files-test-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root, FILES_STORAGE_VOLUMES=[media_root], THROTTLE_BUCKETS={},
+                                      FILES_DOWNLOAD_BANDWIDTH={}, FILES_TASK_QUEUE='local')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        default_storage._wrapped = empty
+        self.addCleanup(setattr, default_storage, '_wrapped', empty)
+        tasks._queues.clear()
+        throttling._stores.clear()
+        for cache in caches.all():
+            cache.clear()
+
+    def make_user(self, email, user_type=User.UserType.REGULAR, **extra):
+        return User.objects.create_user(username=email, email=email, password='pw', user_type=user_type, **extra)
+
+    def client_for(self, user):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def upload(self, client, name='data.bin', content=b'payload', **data):
+        return client.post('/api/files/upload/', {
+            'file': SimpleUploadedFile(name, content), 'encryption_metadata': '{}', **data}, format='multipart')
+
+    def upload_file(self, user, name='data.bin', content=b'payload', process=True, **data):
+        """Upload as ``user`` and return the ``File``; ``process`` runs the processing task as a worker would."""
+        with self.captureOnCommitCallbacks(execute=process):
+            response = self.upload(self.client_for(user), name, content, **data)
+        self.assertEqual(response.status_code, 201, response.data)
+        return File.objects.get(id=response.data['id'])
+
+    def download(self, client, file, **headers):
+        response = client.get(f'/api/files/download/{file.download_link}/', headers=headers)
+        # Exhausting streaming_content closes the response, as the test client does for the others
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+
+@override_settings(FILES_UPLOAD_CHUNK_SIZE=4)
+class UploadSessionTests(FilesTestMixin, TestCase):
+    CONTENT = b'0123456789'
+
+    def open_session(self, client, content=CONTENT):
+        response = client.post('/api/files/upload/sessions/', {'file_name': 'big.bin', 'total_size': len(content)},
+                               format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        session_id = response.data['id']
+        for index in range(response.data['total_chunks']):
+            chunk = content[index * 4:(index + 1) * 4]
+            response = client.put(f'/api/files/upload/sessions/{session_id}/chunks/{index}/', chunk,
+                                  content_type='application/octet-stream',
+                                  headers={'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest()})
+            self.assertEqual(response.status_code, 200, response.data)
+        return session_id
+
+    def complete(self, client, session_id, **data):
+        return client.post(f'/api/files/upload/sessions/{session_id}/complete/', data, format='json')
+
+    def test_chunks_are_read_once_and_hashed_while_assembling(self):
+        owner = self.make_user('owner@example.com')
+        client = self.client_for(owner)
+        session_id = self.open_session(client)
+        opened = []
+        storage_open = default_storage.open
+
+        def record_open(name, *args, **kwargs):
+            opened.append(name)
+            return storage_open(name, *args, **kwargs)
+
+        with mock.patch.object(default_storage, 'open', record_open), self.captureOnCommitCallbacks(execute=True):
+            response = self.complete(client, session_id, sha256=hashlib.sha256(self.CONTENT).hexdigest())
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(sorted(name for name in opened if name.startswith('chunks/')),
+                         [f'chunks/{session_id}/{index:06d}' for index in range(3)])
+
+        file = File.objects.get(id=response.data['id'])
+        self.assertEqual((file.processing_status, file.checksum),
+                         (File.READY, hashlib.sha256(self.CONTENT).hexdigest()))
+        self.assertEqual(self.download(self.client_for(None), file)[1], self.CONTENT)
+
+    def test_concurrent_completes_create_one_file(self):
+        owner = self.make_user('owner@example.com')
+        client = self.client_for(owner)
+        session_id = self.open_session(client)
+        racing = []
+        assemble = views.assemble_chunks
+
+        def complete_meanwhile(storage, session):
+            racing.append(self.complete(self.client_for(owner), session_id))
+            return assemble(storage, session)
+
+        with mock.patch.object(views, 'assemble_chunks', complete_meanwhile):
+            response = self.complete(client, session_id)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([r.status_code for r in racing], [404])
+        self.assertEqual(File.objects.filter(uploaded_by=owner).count(), 1)
+        self.assertEqual(UserStorage.objects.get(user=owner).used_storage, len(self.CONTENT))
+
+    def test_chunk_saved_under_another_name_is_rejected(self):
+        client = self.client_for(self.make_user('owner@example.com'))
+        response = client.post('/api/files/upload/sessions/', {'file_name': 'big.bin', 'total_size': 4},
+                               format='json')
+        session = UploadSession.objects.get(id=response.data['id'])
+        name = session.chunk_name(0)
+        storage_save = default_storage.save
+        saved = []
+
+        def save_after_racing_put(target, content, *args, **kwargs):
+            storage_save(name, ContentFile(b'othr'))
+            saved.append(storage_save(target, content, *args, **kwargs))
+            return saved[-1]
+
+        with mock.patch.object(default_storage, 'save', save_after_racing_put):
+            response = client.put(f'/api/files/upload/sessions/{session.id}/chunks/0/', b'data',
+                                  content_type='application/octet-stream',
+                                  headers={'X-Chunk-SHA256': hashlib.sha256(b'data').hexdigest()})
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertFalse(session.chunks.exists())
+        self.assertNotEqual(saved, [name])
+        self.assertFalse(default_storage.exists(saved[0]))
+        with default_storage.open(name) as chunk:
+            self.assertEqual(chunk.read(), b'othr')
+
+    def test_checksum_mismatch_leaves_the_session_open(self):
+        client = self.client_for(self.make_user('owner@example.com'))
+        session_id = self.open_session(client)
+        response = self.complete(client, session_id, sha256='0' * 64)
+        self.assertEqual(response.data, {'error': 'File checksum mismatch'})
+        self.assertEqual(UploadSession.objects.get(id=session_id).status, 'active')
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(default_storage.exists('uploads/big.bin'))
+        self.assertEqual(self.complete(client, session_id).status_code, 201)
+
+
+class DownloadTests(FilesTestMixin, TestCase):
+    CONTENT = b'0123456789abcdef'
+
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload_file(self.make_user('owner@example.com'), content=self.CONTENT)
+        self.anonymous = self.client_for(None)
+
+    def test_parse_range(self):
+        self.assertEqual(downloads.parse_range('bytes=2-5', 16), (2, 5))
+        self.assertEqual(downloads.parse_range('bytes=-4', 16), (12, 15))
+        self.assertEqual(downloads.parse_range('bytes=10-', 16), (10, 15))
+        self.assertEqual(downloads.parse_range('bytes=16-20', 16), downloads.UNSATISFIABLE)
+        self.assertIsNone(downloads.parse_range('bytes=0-1,4-5', 16))
+
+    def test_range_requests_get_partial_content(self):
+        for backend in ('stream', 'sendfile'):
+            with self.subTest(backend=backend), override_settings(FILES_DOWNLOAD_BACKEND=backend):
+                response, body = self.download(self.anonymous, self.file, Range='bytes=4-7')
+                self.assertEqual((response.status_code, body), (206, b'4567'))
+                self.assertEqual(response['Content-Range'], 'bytes 4-7/16')
+
+                response, _ = self.download(self.anonymous, self.file, Range='bytes=99-')
+                self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */16'))
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response, body = self.download(self.anonymous, self.file, Range='bytes=4-7', **{'If-Range': '"stale"'})
+        self.assertEqual((response.status_code, body), (200, self.CONTENT))
+
+    @override_settings(FILES_DOWNLOAD_BACKEND='x-accel-redirect')
+    def test_x_accel_redirect_hands_the_transfer_to_nginx(self):
+        response, body = self.download(self.anonymous, self.file)
+        self.assertEqual((response.status_code, body), (200, b''))
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected/'))
+        self.assertEqual(response['ETag'], f'"{self.file.checksum}"')
+
+
+class ConditionalGetTests(FilesTestMixin, TestCase):
+    def test_unchanged_download_is_not_modified(self):
+        file = self.upload_file(self.make_user('owner@example.com'))
+        client = self.client_for(None)
+        response, _ = self.download(client, file)
+        response, body = self.download(client, file, **{'If-None-Match': response['ETag']})
+        self.assertEqual((response.status_code, body), (304, b''))
+        response, _ = self.download(client, file, **{'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_listing_is_not_modified_until_an_upload_changes_it(self):
+        owner = self.make_user('owner@example.com')
+        client = self.client_for(owner)
+        first = client.get('/api/files/uploaded-files/')
+        with self.assertNumQueries(1):
+            again = client.get('/api/files/uploaded-files/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+        self.upload_file(owner)
+        changed = client.get('/api/files/uploaded-files/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual((changed.status_code, len(changed.data)), (200, 1))
+
+
+    def test_listing_changed_within_the_same_second_is_not_answered_from_if_modified_since(self):
+        owner = self.make_user('owner@example.com')
+        client = self.client_for(owner)
+        second = timezone.now().replace(microsecond=100000)
+        ListingVersion.objects.update_or_create(user=owner, defaults={'uploaded_files_modified': second})
+        first = client.get('/api/files/uploaded-files/')
+        with mock.patch('django.utils.timezone.now', return_value=second.replace(microsecond=600000)):
+            self.upload_file(owner)
+        changed = client.get('/api/files/uploaded-files/', headers={'If-Modified-Since': first['Last-Modified']})
+        self.assertEqual((changed.status_code, len(changed.data)), (200, 1))
+        self.assertEqual(changed['Last-Modified'], first['Last-Modified'])
+
+
+class PaginationTests(FilesTestMixin, TestCase):
+    def test_cursor_walks_every_file_once_newest_first(self):
+        owner = self.make_user('owner@example.com')
+        ids = [self.upload_file(owner, f'f{index}.bin', f'content {index}'.encode()).id for index in range(5)]
+        client = self.client_for(owner)
+        seen, cursor = [], None
+        while True:
+            response = client.get('/api/files/uploaded-files/', {'limit': 2, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data]
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                break
+            self.assertIn('rel="next"', response['Link'])
+        self.assertEqual(seen, ids[::-1])
+
+    def test_listings_are_unpaged_unless_a_page_is_asked_for(self):
+        owner = self.make_user('owner@example.com')
+        for index in range(3):
+            self.upload_file(owner, f'f{index}.bin', f'content {index}'.encode())
+        client = self.client_for(owner)
+        response = client.get('/api/files/uploaded-files/')
+        self.assertEqual(len(response.data), 3)
+        self.assertNotIn('X-Next-Cursor', response)
+
+        response = client.get('/api/files/uploaded-files/', {'limit': 2})
+        self.assertEqual(len(response.data), 2)
+        response = client.get('/api/files/uploaded-files/', {'cursor': response['X-Next-Cursor']})
+        self.assertEqual(len(response.data), 1)
+
+    def test_fields_projects_the_representation(self):
+        owner = self.make_user('owner@example.com')
+        self.upload_file(owner)
+        response = self.client_for(owner).get('/api/files/uploaded-files/', {'fields': 'name,size'})
+        self.assertEqual(response.data, [{'name': 'data.bin', 'size': 7}])
+
+    def test_malformed_cursor_is_rejected(self):
+        response = self.client_for(self.make_user('owner@example.com')).get('/api/files/uploaded-files/',
+                                                                            {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetTests(FilesTestMixin, TestCase):
+    def test_listing_and_role_views_run_a_constant_number_of_queries(self):
+        endpoints = sorted(budgeted_endpoints())
+        self.assertTrue({'/api/files/uploaded-files/', '/api/files/shared-files/', '/api/files/role-requests/',
+                         '/api/auth/users/', '/api/auth/mfa-pending/'} <= dict(endpoints).keys())
+        counts = {}
+        for rows in (10, 1000, 10000):
+            with transaction.atomic():
+                admin = self.make_user('admin@example.com', User.UserType.ADMIN)
+                seed(admin, rows)
+                client = self.client_for(admin)
+                for path, view in endpoints:
+                    client.get(path)  # lazily created per-user rows
+                    with CaptureQueriesContext(connection) as queries:
+                        response = client.get(path)
+                    self.assertEqual(response.status_code, 200, f'{path} @ {rows} rows')
+                    self.assertLessEqual(len(queries), view.query_budget, f'{path} @ {rows} rows')
+                    counts.setdefault(path, {})[rows] = len(queries)
+                transaction.set_rollback(True)
+        for path, by_rows in counts.items():
+            self.assertEqual(len(set(by_rows.values())), 1, f'{path}: {by_rows}')
+
+
+class EncryptionMetadataTests(FilesTestMixin, TestCase):
+    IV = bytes(range(12))
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner@example.com')
+        self.owner_client = self.client_for(self.owner)
+        response = self.upload(self.owner_client,
+                               encryption_metadata=json.dumps({'key': 'wrapped', 'iv': list(self.IV)}))
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def metadata(self, accept):
+        response = self.owner_client.get('/api/files/uploaded-files/', headers={'Accept': accept})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_version_1_keeps_the_byte_array(self):
+        self.assertEqual(self.metadata('application/json').data[0]['encryption_metadata'],
+                         {'key': 'wrapped', 'iv': list(self.IV)})
+
+    def test_version_2_uses_base64url(self):
+        metadata = self.metadata('application/json; version=2').data[0]['encryption_metadata']
+        self.assertEqual(metadata, {'v': 2, 'key': 'wrapped', 'iv': 'AAECAwQFBgcICQoL'})
+
+    @unittest.skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_msgpack_carries_raw_bytes(self):
+        body = renderers.msgpack.unpackb(self.metadata('application/msgpack').content, raw=False)
+        self.assertEqual(body[0]['encryption_metadata']['iv'], self.IV)
+
+    def test_uploads_accept_every_encoding(self):
+        for iv in ('AAECAwQFBgcICQoL', list(self.IV)):
+            response = self.upload(self.owner_client, encryption_metadata=json.dumps({'key': 'wrapped', 'iv': iv}))
+            self.assertEqual(bytes(File.objects.get(id=response.data['id']).encryption_iv), self.IV)
+        response = self.upload(self.owner_client, encryption_metadata=json.dumps({'key': 'wrapped', 'iv': [256]}))
+        self.assertEqual(response.status_code, 400)
+
+
+class DeduplicationTests(FilesTestMixin, TestCase):
+    def run_blobstats(self):
+        out = io.StringIO()
+        call_command('blobstats', '--json', stdout=out)
+        return out.getvalue()
+
+    def test_identical_uploads_share_one_blob_until_the_last_copy_is_deleted(self):
+        first, second = self.make_user('first@example.com'), self.make_user('second@example.com')
+        copies = [self.upload_file(first, 'a.bin', b'same bytes'), self.upload_file(second, 'b.bin', b'same bytes')]
+        blob = Blob.objects.get()
+        self.assertEqual((blob.refcount, [copy.blob_id for copy in copies]), (2, [blob.id, blob.id]))
+        self.assertEqual(UserStorage.objects.get(user=second).used_storage, len(b'same bytes'))
+
+        report = json.loads(self.run_blobstats())
+        self.assertEqual((report['blobs'], report['bytes_saved'], report['dedup_ratio']), (1, 10, 2.0))
+
+        response = self.client_for(first).delete(f'/api/files/delete/{copies[0].id}/')
+        self.assertEqual(response.status_code, 200)
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+        self.assertEqual(UserStorage.objects.get(user=first).used_storage, 0)
+
+        self.client_for(second).delete(f'/api/files/delete/{copies[1].id}/')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+
+class QuotaConcurrencyTests(FilesTestMixin, TransactionTestCase):
+    """Reservations, uploads and deletes from several threads, each on its own connection."""
+
+    ALLOCATION = 64 * 1024
+    THREADS = 6
+    ITERATIONS = 30
+
+    @mock.patch.object(UserStorage, 'allocation_for', staticmethod(lambda user_type: QuotaConcurrencyTests.ALLOCATION))
+    def test_concurrent_reservations_uploads_and_deletes_never_overcommit_or_drift(self):
+        # Queue processing instead of running it in the uploading threads
+        overrides = override_settings(FILES_TASK_QUEUE='database')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        user = self.make_user('stress@example.com')
+        UserStorage.objects.get_or_create(user=user)
+        lock = threading.Lock()
+        observed, rejected, errors = [], [], []
+
+        def record_usage():
+            used = UserStorage.objects.get(user=user).used_storage
+            with lock:
+                observed.append(used)
+
+        def worker(index):
+            rng = random.Random(index)
+            client = self.client_for(user)
+            uploaded = []
+            try:
+                for step in range(self.ITERATIONS):
+                    size = rng.randint(1, self.ALLOCATION // 8)
+                    action = rng.random()
+                    if action < 0.3:
+                        if UserStorage.reserve(user, size):
+                            record_usage()
+                            UserStorage.release(user, size)  # an upload that failed after reserving
+                        else:
+                            rejected.append(size)
+                    elif action < 0.8 or not uploaded:
+                        response = self.upload(client, f'stress{index}-{step}.bin', b'x' * size)
+                        if response.status_code == 201:
+                            uploaded.append(response.data['id'])
+                        elif response.data == {'error': 'Storage limit exceeded'}:
+                            rejected.append(size)
+                        else:
+                            errors.append(f'upload: {response.status_code} {response.data}')
+                    else:
+                        file_id = uploaded.pop(rng.randrange(len(uploaded)))
+                        response = client.delete(f'/api/files/delete/{file_id}/')
+                        if response.status_code != 200:
+                            errors.append(f'delete: {response.status_code} {response.data}')
+                    record_usage()
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(rejected, 'the allocation was never reached')
+        self.assertLessEqual(max(observed), self.ALLOCATION)
+        storage = UserStorage.objects.annotate(expected=usage_expression()).get(user=user)
+        self.assertEqual(storage.used_storage, storage.expected)
+
+
+class ReaperTests(FilesTestMixin, TestCase):
+    def reap(self, *args):
+        out = io.StringIO()
+        call_command('reap_expired_files', *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_expired_files_are_deleted_in_batches_and_their_quota_released(self):
+        owner = self.make_user('owner@example.com')
+        yesterday = timezone.now() - timedelta(days=1)
+        expired = [self.upload_file(owner, f'old{index}.bin', b'old %d' % index) for index in range(3)]
+        File.objects.filter(id__in=[file.id for file in expired]).update(expiry_date=yesterday)
+        kept = self.upload_file(owner, 'new.bin', b'still valid', expiry_date=timezone.now() + timedelta(days=1))
+
+        metrics = self.reap('--batch-size', '2')
+        self.assertEqual((metrics['rows_reclaimed'], metrics['bytes_reclaimed'], metrics['batches']), (3, 15, 2))
+        self.assertEqual(list(File.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(UserStorage.objects.get(user=owner).used_storage, kept.size)
+        self.assertFalse(any(default_storage.exists(file.file.name) for file in expired))
+
+    @override_settings(FILES_UPLOAD_CHUNK_SIZE=4)
+    def half_uploaded_session(self, owner):
+        client = self.client_for(owner)
+        response = client.post('/api/files/upload/sessions/', {'file_name': 'big.bin', 'total_size': 8},
+                               format='json')
+        session = UploadSession.objects.get(id=response.data['id'])
+        response = client.put(f'/api/files/upload/sessions/{session.id}/chunks/0/', b'half',
+                              content_type='application/octet-stream',
+                              headers={'X-Chunk-SHA256': hashlib.sha256(b'half').hexdigest()})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(UserStorage.objects.get(user=owner).used_storage, 8)
+        return session
+
+    def make_idle(self, session):
+        idle_since = timezone.now() - timedelta(hours=settings.FILES_UPLOAD_SESSION_TTL_HOURS + 1)
+        UploadSession.objects.filter(pk=session.pk).update(updated_at=idle_since)
+
+    def test_idle_upload_sessions_are_aborted_and_their_reservation_released(self):
+        owner = self.make_user('owner@example.com')
+        session = self.half_uploaded_session(owner)
+
+        self.assertEqual(self.reap()['sessions_aborted'], 0)
+        self.make_idle(session)
+        metrics = self.reap()
+        self.assertEqual((metrics['sessions_aborted'], metrics['session_bytes_released']), (1, 8))
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'aborted')
+        self.assertFalse(session.chunks.exists())
+        self.assertFalse(default_storage.exists(session.chunk_name(0)))
+        self.assertEqual(UserStorage.objects.get(user=owner).used_storage, 0)
+
+
+    def test_session_revived_before_it_is_claimed_keeps_its_chunks(self):
+        owner = self.make_user('owner@example.com')
+        session = self.half_uploaded_session(owner)
+        self.make_idle(session)
+        revived = []
+
+        def chunk_arrives_first(execute, sql, params, many, context):
+            if sql.startswith('UPDATE') and 'uploadsession' in sql and not revived:
+                revived.append(True)
+                UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(chunk_arrives_first):
+            self.assertEqual(self.reap()['sessions_aborted'], 0)
+        session.refresh_from_db()
+        self.assertEqual((revived, session.status), ([True], 'active'))
+        self.assertTrue(session.chunks.exists())
+        self.assertTrue(default_storage.exists(session.chunk_name(0)))
+        self.assertEqual(UserStorage.objects.get(user=owner).used_storage, 8)
+
+
+class FileDeleteTests(FilesTestMixin, TestCase):
+    def test_instance_delete_releases_everything_purge_does(self):
+        owner = self.make_user('owner@example.com')
+        file = self.upload_file(owner, content=b'to be deleted')
+        self.client_for(owner).get('/api/files/uploaded-files/')  # creates the listing version
+        version = ListingVersion.objects.get(user=owner).uploaded_files
+        blob = file.blob
+
+        self.assertEqual(file.delete()[0], 1)
+        self.assertEqual(UserStorage.objects.get(user=owner).used_storage, 0)
+        self.assertGreater(ListingVersion.objects.get(user=owner).uploaded_files, version)
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+
+class LinkCacheTests(FilesTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp(prefix='files-cache-')
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        overrides = override_settings(CACHES={**settings.CACHES, 'shared': shared}, FILES_LINK_CACHE_ALIAS='shared')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_download_while_processing_survives_processing_in_another_process(self):
+        owner = self.make_user('owner@example.com')
+        file = self.upload_file(owner, content=b'staged bytes', process=False)
+        self.assertEqual(file.processing_status, File.PROCESSING)
+        anonymous = self.client_for(None)
+
+        response, body = self.download(anonymous, file)
+        self.assertEqual((response.status_code, body), (200, b'staged bytes'))
+
+        # The worker's link eviction runs in its own process and never reaches this one
+        with self.captureOnCommitCallbacks(execute=False):
+            processing.process_upload(file.id)
+        file.refresh_from_db()
+        self.assertEqual(file.processing_status, File.READY)
+        self.assertFalse(default_storage.exists('uploads/data.bin'))
+
+        response, body = self.download(anonymous, file)
+        self.assertEqual((response.status_code, body), (200, b'staged bytes'))
+        self.assertEqual(response['ETag'], f'"{file.checksum}"')
+
+    def test_ready_links_are_cached_until_the_file_is_deleted(self):
+        owner = self.make_user('owner@example.com')
+        file = self.upload_file(owner)
+        self.download(self.client_for(None), file)
+        self.assertEqual(link_cache.get(file.download_link).storage_name, file.file.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_for(owner).delete(f'/api/files/delete/{file.id}/')
+        self.assertIsNone(link_cache.get(file.download_link))
+        response, _ = self.download(self.client_for(None), file)
+        self.assertEqual(response.status_code, 404)
+
+    def test_missing_stored_bytes_are_not_found(self):
+        file = self.upload_file(self.make_user('owner@example.com'))
+        self.download(self.client_for(None), file)
+        default_storage.delete(file.file.name)
+        response, _ = self.download(self.client_for(None), file)
+        self.assertEqual(response.status_code, 404)
+
+    def test_links_are_only_cached_in_a_shared_cache(self):
+        for alias in (None, 'default'):
+            with override_settings(FILES_LINK_CACHE_ALIAS=alias):
+                file = self.upload_file(self.make_user(f'{alias}@example.com'))
+                response, _ = self.download(self.client_for(None), file)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(link_cache.enabled())
+                self.assertIsNone(link_cache.get(file.download_link))
+
+
+class LegacyChecksumTests(FilesTestMixin, TestCase):
+    def legacy_file(self, **changes):
+        """A ready file as stored before checksums were recorded."""
+        file = self.upload_file(self.make_user('owner@example.com'), content=b'legacy bytes')
+        File.objects.filter(pk=file.pk).update(checksum='', **changes)
+        return file
+
+    def test_expired_rows_are_not_hashed(self):
+        file = self.legacy_file(expiry_date=timezone.now() - timedelta(days=1))
+        with mock.patch.object(views, 'file_checksum') as checksum:
+            response, _ = self.download(self.client_for(None), file)
+        self.assertEqual(response.status_code, 410)
+        checksum.assert_not_called()
+        file.refresh_from_db()
+        self.assertEqual(file.checksum, '')
+
+    def test_rows_are_hashed_once_when_served(self):
+        file = self.legacy_file()
+        response, _ = self.download(self.client_for(None), file)
+        file.refresh_from_db()
+        self.assertEqual(file.checksum, hashlib.sha256(b'legacy bytes').hexdigest())
+        self.assertEqual(response['ETag'], f'"{file.checksum}"')
+
+
+class BulkShareTests(FilesTestMixin, TestCase):
+    def share(self, client, file_ids, emails):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/files/share/', {'file_ids': file_ids, 'emails': emails}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data, len(queries)
+
+    def test_sharing_runs_a_constant_number_of_queries_and_reports_what_it_skipped(self):
+        owner = self.make_user('owner@example.com')
+        client = self.client_for(owner)
+        files = [self.upload_file(owner, f'{index}.bin', b'%d' % index) for index in range(2)]
+        emails = [self.make_user(f'user{index}@example.com').email for index in range(20)]
+        file_ids = [file.id for file in files]
+
+        _, few = self.share(client, file_ids, emails[:2])
+        data, many = self.share(client, file_ids + [0], emails + ['nobody@example.com'])
+        self.assertEqual(few, many)
+        self.assertEqual((data['unknown_emails'], data['missing_file_ids']), (['nobody@example.com'], [0]))
+        self.assertEqual(len(data['shared_with']), 20)
+
+        # Sharing again with someone who already has access adds no duplicate rows
+        self.share(client, file_ids, emails[:1])
+        self.assertEqual(File.shared_with.through.objects.count(), 40)
+
+    def test_files_of_other_users_are_not_found(self):
+        owner, other = self.make_user('owner@example.com'), self.make_user('other@example.com')
+        file = self.upload_file(owner)
+        response = self.client_for(other).post('/api/files/share/', {'file_ids': [file.id],
+                                                                     'emails': [other.email]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(file.shared_with.exists())
+
+
+class AsyncDownloadTests(FilesTestMixin, TestCase):
+    def test_link_lookup_and_response_run_off_the_event_loop(self):
+        file = self.upload_file(self.make_user('owner@example.com'), content=b'async bytes')
+        loops = {}
+
+        def off_loop(name, function):
+            def call(*args, **kwargs):
+                try:
+                    loops[name] = asyncio.get_running_loop()
+                except RuntimeError:
+                    loops[name] = None
+                return function(*args, **kwargs)
+            return call
+
+        request = APIRequestFactory().get(f'/api/files/download/{file.download_link}/')
+        with mock.patch.object(async_views, 'build_download_response',
+                               off_loop('build', downloads.build_download_response)), \
+                mock.patch.object(link_cache, 'get', off_loop('get', link_cache.get)), \
+                mock.patch.object(link_cache, 'put', off_loop('put', link_cache.put)):
+            response = async_to_sync(async_views.download_file)(request, download_link=str(file.download_link))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(loops, {'get': None, 'put': None, 'build': None})
+
+
+class StorageBackendTests(FilesTestMixin, TestCase):
+    def test_sharded_storage_fans_out_on_disk_but_keeps_logical_names(self):
+        storage = ShardedFileSystemStorage(location=settings.MEDIA_ROOT)
+        name = storage.save('uploads/report.pdf', ContentFile(b'sharded'))
+        self.assertEqual(name, 'uploads/report.pdf')
+        self.assertEqual(storage.path(name), os.path.join(settings.MEDIA_ROOT, storage.shard(name)))
+        self.assertEqual(storage.open(name).read(), b'sharded')
+
+        # Written before sharding was switched on
+        FileSystemStorage(location=settings.MEDIA_ROOT).save('uploads/flat.pdf', ContentFile(b'flat'))
+        self.assertEqual(storage.open('uploads/flat.pdf').read(), b'flat')
+        self.assertFalse(ShardedFileSystemStorage(location=settings.MEDIA_ROOT,
+                                                  legacy_fallback=False).exists('uploads/flat.pdf'))
+
+    def test_multivolume_storage_writes_to_the_emptiest_volume_and_reads_from_any(self):
+        volumes = [tempfile.mkdtemp(prefix='files-volume-') for _ in range(2)]
+        for volume in volumes:
+            self.addCleanup(shutil.rmtree, volume, ignore_errors=True)
+        storage = MultiVolumeStorage(volumes=volumes)
+        free = {volumes[0]: 10, volumes[1]: 20}
+        with mock.patch('shutil.disk_usage', lambda path: mock.Mock(free=free[path])):
+            storage.save('blobs/a', ContentFile(b'on the second volume'))
+            free[volumes[0]] = 30
+            storage.save('blobs/b', ContentFile(b'on the first volume'))
+        self.assertTrue(storage.path('blobs/a').startswith(volumes[1]))
+        self.assertTrue(storage.path('blobs/b').startswith(volumes[0]))
+        self.assertEqual(storage.open('blobs/a').read(), b'on the second volume')
+
+    def test_x_accel_redirect_points_each_volume_at_its_own_location(self):
+        volumes = [tempfile.mkdtemp(prefix='files-volume-') for _ in range(2)]
+        for volume in volumes:
+            self.addCleanup(shutil.rmtree, volume, ignore_errors=True)
+        storage = MultiVolumeStorage(volumes=volumes)
+        free = {volumes[0]: 10, volumes[1]: 20}
+        with mock.patch('shutil.disk_usage', lambda path: mock.Mock(free=free[path])):
+            storage.save('blobs/a', ContentFile(b'on the second volume'))
+        relative = storage.split_path('blobs/a')[1]
+
+        with self.assertRaises(ImproperlyConfigured):
+            downloads.check_x_accel_locations(storage)
+        with override_settings(FILES_X_ACCEL_REDIRECT_PREFIXES={volumes[1]: '/protected-2/'}):
+            downloads.check_x_accel_locations(storage)
+            self.assertEqual(downloads.x_accel_location(storage, 'blobs/a'), '/protected-2/' + relative)
+
+    def s3_storage(self):
+        from moto import mock_aws
+
+        # The root logger runs at DEBUG, where boto logs every request it signs and every transfer
+        for logger in map(logging.getLogger, ('boto3', 'botocore', 's3transfer')):
+            self.addCleanup(logger.setLevel, logger.level)
+            logger.setLevel(logging.INFO)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        storage = S3Storage(bucket='files', region_name='us-east-1', access_key_id='test',
+                            secret_access_key='test', prefix='media')
+        storage.client.create_bucket(Bucket='files')
+        return storage
+
+    @unittest.skipUnless(importlib.util.find_spec('moto'), 'moto is not installed')
+    def test_s3_downloads_redirect_with_the_file_name_unless_paced(self):
+        default_storage._wrapped = self.s3_storage()  # setUp already restores it
+        file = self.upload_file(self.make_user('owner@example.com'), name='report.pdf', content=b'%PDF')
+        anonymous = self.client_for(None)
+
+        with override_settings(FILES_DOWNLOAD_BACKEND='x-accel-redirect'):
+            response, _ = self.download(anonymous, file)
+            self.assertEqual(response.status_code, 302)
+            query = parse_qs(urlsplit(response['Location']).query)
+            self.assertEqual(query['response-content-disposition'], ['attachment; filename="report.pdf"'])
+            self.assertEqual(query['response-content-type'], ['application/pdf'])
+
+            with override_settings(FILES_DOWNLOAD_BANDWIDTH={'anonymous': 1 << 30}):
+                response, body = self.download(anonymous, file)
+            self.assertEqual((response.status_code, body), (200, b'%PDF'))
+
+    @unittest.skipUnless(importlib.util.find_spec('moto'), 'moto is not installed')
+    def test_s3_storage_round_trips_and_seeks_with_ranged_reads(self):
+        storage = self.s3_storage()
+        name = storage.save('blobs/abc', ContentFile(b'0123456789'))
+        self.assertEqual((name, storage.size(name)), ('blobs/abc', 10))
+        self.assertEqual(storage.listdir('blobs'), ([], ['abc']))
+        with storage.open(name) as content:
+            content.seek(6)
+            self.assertEqual(content.read(), b'6789')
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+
+    def test_migrate_storage_moves_blobs_to_another_backend(self):
+        file = self.upload_file(self.make_user('owner@example.com'), content=b'to be moved')
+        volume = tempfile.mkdtemp(prefix='files-volume-')
+        self.addCleanup(shutil.rmtree, volume, ignore_errors=True)
+
+        with override_settings(FILES_STORAGE_VOLUMES=[volume]):
+            call_command('migrate_storage', 'sharded', 'multivolume', '--delete-source', stdout=io.StringIO())
+            target = MultiVolumeStorage()
+        self.assertFalse(default_storage.exists(file.file.name))
+        self.assertTrue(target.path(file.file.name).startswith(volume))
+        self.assertEqual(target.open(file.file.name).read(), b'to be moved')
+
+
+@unittest.skipUnless(encryption.AESGCM, 'cryptography is not installed')
+class EncryptionAtRestTests(FilesTestMixin, TestCase):
+    PLAINTEXT = bytes(range(100))
+
+    def setUp(self):
+        super().setUp()
+        self.key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+        self.inner = ShardedFileSystemStorage(location=settings.MEDIA_ROOT)
+        self.storage = EncryptedStorage(inner=self.inner, keys=[self.key], chunk_size=16)
+
+    def test_objects_are_stored_encrypted_and_read_back_by_range(self):
+        name = self.storage.save('blobs/secret', ContentFile(self.PLAINTEXT))
+        stored = self.inner.open(name).read()
+        self.assertTrue(encryption.is_encrypted(stored))
+        self.assertNotIn(self.PLAINTEXT[:16], stored)
+        self.assertEqual(len(stored), encryption.encrypted_size(100, 16))
+        self.assertEqual(self.storage.size(name), 100)
+        with self.storage.open(name) as content:
+            content.seek(40)
+            self.assertEqual(content.read(10), self.PLAINTEXT[40:50])
+            content.seek(0)
+            self.assertEqual(content.read(), self.PLAINTEXT)
+
+        # Stored before encryption was switched on
+        self.inner.save('uploads/plain', ContentFile(b'legacy'))
+        self.assertEqual(self.storage.open('uploads/plain').read(), b'legacy')
+
+    def test_tampered_chunks_and_unknown_keys_fail_authentication(self):
+        name = self.storage.save('blobs/secret', ContentFile(self.PLAINTEXT))
+        path = self.inner.path(name)
+        with open(path, 'r+b') as stored:
+            stored.seek(encryption.HEADER.size + 2 * (16 + encryption.TAG_SIZE))
+            byte = stored.read(1)
+            stored.seek(-1, os.SEEK_CUR)
+            stored.write(bytes([byte[0] ^ 1]))
+
+        with self.storage.open(name) as content:
+            self.assertEqual(content.read(32), self.PLAINTEXT[:32])
+            with self.assertRaises(encryption.DecryptionError):
+                content.read()
+
+        other_key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+        with self.assertRaises(encryption.DecryptionError):
+            EncryptedStorage(inner=self.inner, keys=[other_key]).open(name)
+
+    def test_downloads_decrypt_only_the_requested_range(self):
+        default_storage._wrapped = self.storage  # setUp already restores it
+        file = self.upload_file(self.make_user('owner@example.com'), content=self.PLAINTEXT)
+        self.assertTrue(encryption.is_encrypted(self.inner.open(file.file.name).read(4)))
+        chunk = encryption.DecryptingReader._chunk
+        with mock.patch.object(encryption.DecryptingReader, '_chunk', autospec=True, side_effect=chunk) as opened:
+            response, body = self.download(self.client_for(None), file, Range='bytes=40-49')
+        self.assertEqual((response.status_code, body), (206, self.PLAINTEXT[40:50]))
+        self.assertEqual({call.args[1] for call in opened.call_args_list}, {2, 3})
+
+
+class StructuredLoggingTests(FilesTestMixin, TestCase):
+    def capture(self, logger):
+        handler = logging.handlers.BufferingHandler(capacity=1000)
+        handler.addFilter(log.RequestContextFilter())
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return handler.buffer
+
+    def test_upload_events_carry_the_request_context_and_nothing_is_printed(self):
+        owner = self.make_user('owner@example.com')
+        client = self.client_for(owner)
+        client.credentials(HTTP_X_REQUEST_ID='req-42')
+        records = self.capture(logging.getLogger('files'))
+        with mock.patch.object(log.random, 'random', return_value=0.0), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            response = self.upload(client)
+        self.assertEqual((response.status_code, response['X-Request-ID']), (201, 'req-42'))
+        self.assertEqual(stdout.getvalue(), '')
+
+        saved = json.loads(log.StructuredFormatter().format(
+            next(record for record in records if record.event == 'upload.saved')))
+        self.assertEqual({key: saved[key] for key in ('request_id', 'method', 'path', 'user_id', 'file_id')},
+                         {'request_id': 'req-42', 'method': 'POST', 'path': '/api/files/upload/',
+                          'user_id': owner.id, 'file_id': response.data['id']})
+        self.assertEqual(saved['sample_rate'], settings.FILES_LOG_SAMPLE_RATE)
+
+    def test_sampled_out_events_are_never_built(self):
+        logger = logging.getLogger('files')
+        records = self.capture(logger)
+        with mock.patch.object(log.random, 'random', return_value=0.5), \
+                mock.patch.object(logger, 'log', wraps=logger.log) as emitted:
+            log.event(logger, 'kept', sample=0.6)
+            log.event(logger, 'dropped', sample=0.4)
+        self.assertEqual([record.event for record in records], ['kept'])
+        self.assertEqual(emitted.call_count, 1)
+
+    def test_queue_hands_records_to_a_listener_thread_and_drops_when_full(self):
+        logger = logging.getLogger('files.tests.queue')
+        logger.propagate = False
+        self.addCleanup(setattr, logger, 'propagate', True)
+        target = logging.handlers.BufferingHandler(capacity=1000)
+        logger.addHandler(target)
+        handler = log.install_queue(logger.name, maxsize=1)
+        self.addCleanup(logger.removeHandler, handler)
+        self.assertEqual(logger.handlers, [handler])
+
+        listener = log._listeners.pop()
+        listener.stop()  # nothing drains the queue now
+        log.event(logger, 'first', items=1)
+        log.event(logger, 'second')
+        self.assertEqual(handler.dropped, 1)
+
+        listener.start()
+        listener.stop()
+        self.assertEqual([(record.event, record.fields) for record in target.buffer], [('first', {'items': 1})])
+
+
+class DashboardCounterTests(FilesTestMixin, TestCase):
+    def dashboard(self, user):
+        # One primary-key read, plus the SiteStats row for admins
+        with self.assertNumQueries(2 if user.user_type == User.UserType.ADMIN else 1):
+            response = self.client_for(user).get('/api/files/user-data/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_storage', *args, stdout=out)
+        return out.getvalue()
+
+    def test_counters_follow_uploads_shares_deletes_and_mfa_without_drift(self):
+        admin = self.make_user('admin@example.com', User.UserType.ADMIN)
+        owner, recipient = self.make_user('owner@example.com'), self.make_user('recipient@example.com')
+        files = [self.upload_file(owner, f'{index}.bin', b'%d' % index) for index in range(3)]
+        self.upload_file(owner, 'sealed.bin', encryption_metadata=json.dumps({'key': 'a2V5', 'iv': 'aXY'}))
+        self.client_for(owner).post('/api/files/share/', {'file_ids': [files[0].id, files[1].id],
+                                                          'emails': [recipient.email]}, format='json')
+        self.client_for(owner).delete(f'/api/files/delete/{files[1].id}/')
+        recipient.is_mfa_enabled = True
+        recipient.save()
+
+        self.assertEqual((self.dashboard(owner)['total_files_shared'],
+                          self.dashboard(recipient)['files_shared_with_me']), (3, 1))
+        stats = self.dashboard(admin)
+        self.assertEqual((stats['incomplete_mfa'], stats['encryption_health'], stats['failed_decryption_alerts']),
+                         (User.objects.filter(is_mfa_enabled=False).count(), 33, 0))
+        self.assertEqual(self.reconcile('--dry-run'), '')
+
+    def test_saving_a_user_does_not_read_the_row_back(self):
+        admin = self.make_user('admin@example.com', User.UserType.ADMIN)
+        self.make_user('user@example.com')
+        without_mfa = lambda: self.dashboard(admin)['incomplete_mfa']
+        self.assertEqual(without_mfa(), 2)
+        user = User.objects.get(email='user@example.com')
+        with self.assertNumQueries(1):
+            user.save()
+        user.is_mfa_enabled = True
+        with self.assertNumQueries(2):  # the UPDATE and the counter
+            user.save()
+        user.save()
+        self.assertEqual(without_mfa(), 1)
+
+        deferred = User.objects.only('email').get(email='user@example.com')
+        deferred.is_mfa_enabled = False
+        deferred.save()
+        self.assertEqual(without_mfa(), 2)
+
+    def test_reconciliation_corrects_drift(self):
+        owner = self.make_user('owner@example.com')
+        self.upload_file(owner)
+        UserStorage.objects.filter(user=owner).update(file_count=7, used_storage=0)
+
+        self.assertIn('file_count recorded 7, actual 1', self.reconcile('--dry-run'))
+        self.reconcile()
+        self.assertEqual(self.dashboard(owner)['total_files_shared'], 1)
+        self.assertEqual(self.dashboard(owner)['used_storage'], len(b'payload'))
+        self.assertEqual(self.reconcile('--dry-run'), '')
+
+
+@mock.patch.object(db_router, 'replicas', return_value=['replica1', 'replica2'])
+class ReplicaRoutingTests(SimpleTestCase):
+    router = db_router.PrimaryReplicaRouter()
+
+    def serve(self, request, view):
+        return db_router.ReplicaRoutingMiddleware(view)(request)
+
+    def reads(self, request, write=False):
+        """Aliases of a read, an optional write and another read made while serving ``request``."""
+        aliases = []
+
+        def view(request):
+            aliases.append(self.router.db_for_read(File))
+            if write:
+                self.router.db_for_write(File)
+            aliases.append(self.router.db_for_read(File))
+            return HttpResponse()
+
+        return aliases, self.serve(request, view)
+
+    def test_safe_requests_stick_to_one_replica_until_they_write(self, replicas):
+        factory = RequestFactory()
+        aliases, response = self.reads(factory.get('/'))
+        self.assertIn(aliases[0], replicas.return_value)
+        self.assertEqual(aliases[0], aliases[1])
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+
+        aliases, response = self.reads(factory.get('/'), write=True)
+        self.assertEqual(aliases[1], 'default')
+        self.assertEqual(response.cookies[db_router.PIN_COOKIE]['max-age'], settings.DATABASE_REPLICA_PIN_SECONDS)
+
+        self.assertEqual(self.reads(factory.post('/'))[0], ['default', 'default'])
+        self.assertEqual(self.router.db_for_read(File), 'default')  # outside any request
+
+    def test_pinned_clients_read_from_the_primary(self, replicas):
+        factory = RequestFactory()
+        request = factory.get('/')
+        request.COOKIES[db_router.PIN_COOKIE] = '1'
+        self.assertEqual(self.reads(request)[0], ['default', 'default'])
+
+        user = User(id=1)
+        with override_settings(DATABASE_PIN_CACHE_ALIAS='default'):
+            caches['default'].clear()
+            request = factory.post('/')
+            request.user = user
+            self.reads(request, write=True)
+            # A client that dropped the cookie is still pinned through the shared cache
+            request = factory.get('/')
+            request.user = user
+            self.assertEqual(self.reads(request)[0], ['default', 'default'])
+            request = factory.get('/')
+            request.user = User(id=2)
+            self.assertIn(self.reads(request)[0][0], replicas.return_value)
+
+
+class ThrottleTests(FilesTestMixin, TestCase):
+    def download_statuses(self, file, forwarded_for):
+        client = self.client_for(None)
+        return [self.download(client, file, **{'X-Forwarded-For': address})[0].status_code
+                for address in forwarded_for]
+
+    def test_forwarded_for_is_ignored_without_num_proxies(self):
+        file = self.upload_file(self.make_user('owner@example.com'))
+        with override_settings(THROTTLE_BUCKETS={'download_ip': (0.001, 2)}):
+            statuses = self.download_statuses(file, ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_forwarded_for_names_the_client_behind_num_proxies(self):
+        file = self.upload_file(self.make_user('owner@example.com'))
+        with override_settings(THROTTLE_BUCKETS={'download_ip': (0.001, 2)},
+                               REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            statuses = self.download_statuses(file, ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.1', '10.0.0.1'])
+        self.assertEqual(statuses, [200, 200, 200, 200, 429])
+
+    def test_downloads_use_sendfile_unless_a_bandwidth_limit_is_configured(self):
+        owner = self.make_user('owner@example.com')
+        file = self.upload_file(owner)
+        with override_settings(FILES_DOWNLOAD_BACKEND='sendfile',
+                               FILES_DOWNLOAD_BANDWIDTH=project_settings.FILES_DOWNLOAD_BANDWIDTH):
+            response, _ = self.download(self.client_for(owner), file)
+        self.assertIsInstance(response, FileResponse)
+        with override_settings(FILES_DOWNLOAD_BACKEND='sendfile', FILES_DOWNLOAD_BANDWIDTH={'regular': 1 << 20}):
+            response, _ = self.download(self.client_for(owner), file)
+        self.assertNotIsInstance(response, FileResponse)
+
+
+class ProcessingTests(FilesTestMixin, TestCase):
+    def shared_listing(self, client, **headers):
+        return client.get('/api/files/shared-files/', headers=headers)
+
+    def assert_recipient_sees(self, status_after, reject=False):
+        owner, recipient = self.make_user('owner@example.com'), self.make_user('recipient@example.com')
+        file = self.upload_file(owner, process=False)
+        response = self.client_for(owner).post('/api/files/share/', {'file_ids': [file.id],
+                                                                    'emails': [recipient.email]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        client = self.client_for(recipient)
+        before = self.shared_listing(client)
+        self.assertEqual(before.data[0]['processing_status'], File.PROCESSING)
+
+        with override_settings(FILES_UPLOAD_PROCESSORS=['files.tests.reject'] if reject else []):
+            processing.process_upload(file.id)
+
+        after = self.shared_listing(client, **{'If-None-Match': before['ETag']})
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.data[0]['processing_status'], status_after)
+
+    def test_processing_refreshes_recipients_shared_listings(self):
+        self.assert_recipient_sees(File.READY)
+
+    def test_rejection_refreshes_recipients_shared_listings(self):
+        self.assert_recipient_sees(File.FAILED, reject=True)
+
+
+def reject(file, content):
+    raise processing.Rejected('test')
+
+
+class BatchUploadTests(FilesTestMixin, TestCase):
+    def post_batch(self, user, *contents):
+        files = [SimpleUploadedFile(f'part{index}.bin', content) for index, content in enumerate(contents)]
+        return self.client_for(user).post('/api/files/upload/batch/', {'files': files}, format='multipart')
+
+    def assert_cleaned_up_after(self, failure, patch_target, attribute):
+        owner = self.make_user('owner@example.com')
+        storage = File._meta.get_field('file').storage
+        saved = []
+        storage_save = storage.save
+
+        def record_save(name, content, *args, **kwargs):
+            saved.append(storage_save(name, content, *args, **kwargs))
+            return saved[-1]
+
+        with mock.patch.object(storage, 'save', record_save), mock.patch.object(patch_target, attribute, failure), \
+                self.assertRaises(OSError):
+            self.post_batch(owner, b'first', b'second')
+        self.assertTrue(saved)
+        self.assertFalse([name for name in saved if storage.exists(name)])
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(UserStorage.available(owner), UserStorage.allocation_for(owner.user_type))
+
+    def test_failure_while_staging_discards_staged_files(self):
+        entries = batch.entries
+
+        def failing_entries(*args):
+            yield next(entries(*args))
+            raise OSError('connection reset')
+
+        self.assert_cleaned_up_after(failing_entries, batch, 'entries')
+
+    def test_failure_while_inserting_discards_staged_files_and_releases_quota(self):
+        self.assert_cleaned_up_after(mock.Mock(side_effect=OSError('disk I/O error')), File.objects, 'bulk_create')
+
+    def test_batch_is_stored(self):
+        response = self.post_batch(self.make_user('owner@example.com'), b'first', b'second')
+        self.assertEqual((response.status_code, response.data['created']), (201, 2))
+
+
+class BundleDownloadTests(FilesTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner, self.recipient = self.make_user('owner@example.com'), self.make_user('recipient@example.com')
+        self.mine = self.upload_file(self.recipient, 'notes.txt', b'my notes')
+        self.shared = self.upload_file(self.owner, 'notes.txt', b'shared notes')
+        self.shared.shared_with.add(self.recipient)
+        self.private = self.upload_file(self.owner, 'private.txt', b'not for you')
+
+    def bundle(self, client, **data):
+        response = client.post('/api/files/download/bundle/', data, format='json')
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_zip_holds_every_accessible_file_stored_under_unique_names(self):
+        response, body = self.bundle(self.client_for(self.recipient),
+                                     file_ids=[self.mine.id, self.shared.id, self.private.id, self.mine.id])
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/zip'))
+        self.assertEqual(response['X-Bundle-Missing'], str(self.private.id))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual([(info.filename, info.compress_type) for info in archive.infolist()],
+                             [('notes.txt', zipfile.ZIP_STORED), ('notes (2).txt', zipfile.ZIP_STORED)])
+            self.assertEqual(archive.read('notes (2).txt'), b'shared notes')
+            self.assertIsNone(archive.testzip())
+
+    def test_tar_by_download_link_has_an_exact_content_length(self):
+        response, body = self.bundle(self.client_for(None), format='tar',
+                                     download_links=[str(self.private.download_link)])
+        self.assertEqual(int(response['Content-Length']), len(body))
+        with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+            self.assertEqual(archive.extractfile('private.txt').read(), b'not for you')
+
+        response, _ = self.bundle(self.client_for(None), file_ids=[self.private.id])
+        self.assertEqual(response.status_code, 401)
+
+    def test_members_are_streamed_one_at_a_time(self):
+        opened = []
+
+        def member(name):
+            return bundles.Member(name, 3, 0, lambda: opened.append(name) or io.BytesIO(b'abc'))
+
+        for format in bundles.FORMATS:
+            opened.clear()
+            stream, sent = bundles.stream([member('first'), member('second')], format), b''
+            while b'abc' not in sent:
+                sent += next(stream)
+            self.assertEqual(opened, ['first'])
+            b''.join(stream)
+            self.assertEqual(opened, ['first', 'second'])
+
+
+class MetricsAccessTests(TestCase):
+    def scrape(self, address, **headers):
+        return self.client.get('/metrics', REMOTE_ADDR=address, headers=headers).status_code
+
+    def test_only_allowed_networks_can_scrape_without_a_token(self):
+        self.assertEqual(self.scrape('127.0.0.1'), 200)
+        self.assertEqual(self.scrape('203.0.113.7'), 403)
+        with override_settings(METRICS_ALLOWED_NETWORKS=['203.0.113.0/24']):
+            self.assertEqual(self.scrape('203.0.113.7'), 200)
+            self.assertEqual(self.scrape('127.0.0.1'), 403)
+
+    @override_settings(METRICS_TOKEN='s3cret', METRICS_ALLOWED_NETWORKS=[])
+    def test_token_grants_access_from_anywhere(self):
+        self.assertEqual(self.scrape('203.0.113.7', Authorization='Bearer s3cret'), 200)
+        self.assertEqual(self.scrape('203.0.113.7', Authorization='Bearer wrong'), 403)
+        self.assertEqual(self.scrape('127.0.0.1'), 403)
+
+
+class BenchmarkReportTests(SimpleTestCase):
+    def report(self, **metrics):
+        return {'scenarios': {'download': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries_mean': 0.0,
+                                           'throughput_rps': 100.0, **metrics}}}
+
+    def regressed(self, candidate, threshold=10):
+        return [row['metric'] for row in compare(self.report(), candidate, threshold) if row['regressed']]
+
+    def test_compare_flags_metrics_that_got_worse_beyond_the_threshold(self):
+        self.assertEqual(self.regressed(self.report(p95_ms=21.0)), [])
+        self.assertEqual(self.regressed(self.report(p95_ms=23.0, throughput_rps=80.0)), ['p95_ms', 'throughput_rps'])
+        self.assertEqual(self.regressed(self.report(p50_ms=5.0, throughput_rps=150.0)), [])
+
+    def test_growth_from_zero_queries_is_a_regression(self):
+        rows = compare(self.report(), self.report(queries_mean=1.0), 10)
+        row = next(row for row in rows if row['metric'] == 'queries_mean')
+        self.assertEqual((row['change_pct'], row['regressed']), (None, True))
+
+    def test_summarize_reports_percentiles_in_milliseconds(self):
+        summary = summarize([0.001 * n for n in range(1, 101)])
+        self.assertEqual((summary['requests'], summary['p50_ms'], summary['p99_ms']), (100, 51.0, 99.0))
+        self.assertEqual(percentile([], 50), 0.0)
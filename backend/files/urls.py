@@ -1,15 +1,27 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# Under ASGI the async variants keep slow transfers from pinning a worker thread each
+endpoints = async_views if settings.FILES_ASYNC_VIEWS else views
 
 urlpatterns = [
     path('user-data/', views.get_user_data, name='user-data'),
-    path('uploaded-files/', views.get_uploaded_files, name='uploaded-files'),
-    path('shared-files/', views.get_shared_files, name='shared-files'),
-    path('upload/', views.upload_file, name='upload-file'),
+    path('uploaded-files/', endpoints.get_uploaded_files, name='uploaded-files'),
+    path('shared-files/', endpoints.get_shared_files, name='shared-files'),
+    path('upload/', endpoints.upload_file, name='upload-file'),
+    path('upload/batch/', views.upload_batch, name='upload-batch'),
+    path('upload/sessions/', views.create_upload_session, name='upload-session-create'),
+    path('upload/sessions/<uuid:session_id>/', views.upload_session_detail, name='upload-session'),
+    path('upload/sessions/<uuid:session_id>/chunks/<int:index>/', views.upload_chunk, name='upload-chunk'),
+    path('upload/sessions/<uuid:session_id>/complete/', views.complete_upload_session,
+         name='upload-session-complete'),
     path('delete/<int:file_id>/', views.delete_file, name='delete-file'),
+    path('share/', views.share_files, name='share-files'),
     path('share/<int:file_id>/', views.share_file, name='share-file'),
-    path('download/<str:download_link>/', views.download_file, name='download-file'),
+    path('download/bundle/', views.download_bundle, name='download-bundle'),
+    path('download/<str:download_link>/', endpoints.download_file, name='download-file'),
 
     # role requests
     path('role-requests/', views.get_role_requests, name='role-requests'),
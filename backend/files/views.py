@@ -1,122 +1,446 @@
+import io
 import logging
+import mimetypes
+import posixpath
 import uuid
-from datetime import datetime, timezone
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 
 from authentication.models import User  # Add this import
+from core.throttling import DownloadLinkThrottle, DownloadThrottle, UploadThrottle, UserThrottle, download_shaper
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .models import File, UserStorage, RoleUpgradeRequest
-from .serializers import FileSerializer, FileUploadSerializer, RoleUpgradeRequestSerializer
+from . import batch, bundles, link_cache, log
+from .chunked import assemble_chunks, file_checksum, received_ranges, wrap_chunk
+from .conditional import listing_validators, not_modified, with_validators
+from .downloads import build_download_response
+from .pagination import KeysetPagination, project, requested_fields
+from .query_budget import query_budget
+from .models import File, ListingVersion, SiteStats, UserStorage, RoleUpgradeRequest, UploadSession, \
+    UploadChunk
+from .processing import schedule
+from .signals import files_created
+from .serializers import BatchUploadSerializer, BulkShareSerializer, BundleSerializer, FileSerializer, FileUploadSerializer, RoleUpgradeRequestSerializer, \
+    UploadSessionCreateSerializer, UploadSessionSerializer
 
 logger = logging.getLogger('files')
 
+FILE_LISTING_ORDER = ('-uploaded_date', '-id')
+
+
+def _max_upload_size(user, setting_name):
+    limits = getattr(settings, setting_name)
+    return limits.get(user.user_type, limits[User.UserType.REGULAR])
+
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_data(request):
     user = request.user
-    storage = UserStorage.objects.get_or_create(user=user)[0]
+    # Counters are maintained incrementally (files.receivers), so this is a primary-key read
+    storage = (UserStorage.objects.select_related('user').filter(user=user).first() or
+               UserStorage.objects.select_related('user').get_or_create(user=user)[0])
 
     data = {
         'name': user.first_name,
-        'total_files_shared': File.objects.filter(uploaded_by=user).count(),
+        'total_files_shared': storage.file_count,
+        'files_shared_with_me': storage.shared_with_count,
         'used_storage': storage.used_storage,
         'allocated_storage': storage.allocated_storage,
         'current_role': user.user_type,
     }
 
     if user.user_type == 'admin':
+        stats = SiteStats.load()
         data.update({
-            'incomplete_mfa': User.objects.filter(is_mfa_enabled=False).count(),
-            'encryption_health': 100,  # Placeholder
-            'failed_decryption_alerts': 0  # Placeholder
+            'incomplete_mfa': stats.users_without_mfa,
+            'encryption_health': stats.encryption_health,
+            'failed_decryption_alerts': stats.failed_decryptions
         })
 
     return Response(data)
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_uploaded_files(request):
-    files = File.objects.filter(uploaded_by=request.user)
-    serializer = FileSerializer(files, many=True)
-    return Response(serializer.data)
+    etag, last_modified = listing_validators(request, 'uploaded_files')
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    return _file_listing(request, File.objects.filter(uploaded_by=request.user), etag, last_modified)
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_shared_files(request):
-    files = File.objects.filter(shared_with=request.user).select_related('uploaded_by')
-    serializer = FileSerializer(files, many=True)
-    return Response(serializer.data)
+    etag, last_modified = listing_validators(request, 'shared_files')
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    return _file_listing(request, File.objects.filter(shared_with=request.user), etag, last_modified)
+
+
+def _file_listing(request, files, etag, last_modified):
+    fields = requested_fields(request, FileSerializer)
+    paginator = KeysetPagination(ordering=FILE_LISTING_ORDER)
+    page = paginator.paginate_queryset(project(files, FileSerializer, fields, FILE_LISTING_ORDER), request)
+    serializer = FileSerializer(page, many=True, fields=fields, context={'request': request})
+    return with_validators(paginator.get_paginated_response(serializer.data), etag, last_modified)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([UserThrottle, UploadThrottle])
 def upload_file(request):
-    print("=== Upload File View Started ===")
-    logger.error("=== Upload File View Started ===")
-
     # Check if user is guest
     if request.user.user_type == User.UserType.GUEST:
         return Response({
             'error': 'Guests cannot upload files'
         }, status=status.HTTP_403_FORBIDDEN)
 
-    print(f"Request Data: {request.data}")
-    logger.error(f"Request Data: {request.data}")
-
     serializer = FileUploadSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         file = request.FILES['file']
-        print(f"File name: {file.name}, Size: {file.size}")
-        logger.error(f"File name: {file.name}, Size: {file.size}")
 
         # Size checks...
-        max_size = 10485760 if request.user.user_type == User.UserType.ADMIN else 5242880
+        max_size = _max_upload_size(request.user, 'FILES_MAX_UPLOAD_SIZE')
         if file.size > max_size:
             return Response({
                 'error': f'File size exceeds limit. Maximum size allowed is {max_size / 1048576}MB'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Storage checks...
-        storage = UserStorage.objects.get_or_create(user=request.user)[0]
-        if storage.used_storage + file.size > storage.allocated_storage:
-            return Response({
-                'error': 'Storage limit exceeded'
-            }, status=status.HTTP_400_BAD_REQUEST)
+        return _save_upload(request, serializer, file.size)
 
-        try:
+    return Response(
+        serializer.errors,
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def _save_upload(request, serializer, size, **extra):
+    """Reserve ``size`` bytes of quota and save the validated upload; returns the response for either outcome."""
+    # Storage checks: reserve the bytes up front, give them back if the upload fails
+    if not UserStorage.reserve(request.user, size):
+        return Response({
+            'error': 'Storage limit exceeded'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        with transaction.atomic():
             # Use serializer's create method instead of direct File.objects.create
-            new_file = serializer.save()
+            new_file = serializer.save(**extra)
+            ListingVersion.bump(uploaded_by=[request.user.id])
+
+        log.event(logger, 'upload.saved', sample=settings.FILES_LOG_SAMPLE_RATE, file_id=new_file.id, size=size)
 
-            # Update storage
-            storage.used_storage += file.size
-            storage.save()
+        return Response(
+            FileSerializer(new_file, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+    except Exception as e:
+        UserStorage.release(request.user, size)
+        log.event(logger, 'upload.failed', level=logging.ERROR, exc_info=True, size=size)
+        return Response({
+            'error': f'Error uploading file: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            print("=== File Upload Successful ===")
-            logger.error("=== File Upload Successful ===")
 
-            return Response(
-                FileSerializer(new_file).data,
-                status=status.HTTP_201_CREATED
-            )
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([UserThrottle, UploadThrottle])
+def upload_batch(request):
+    """
+    Store several files (repeated ``files`` parts) or the members of one tar/zip ``archive`` at once.
+
+    Every file is written to storage first; the quota is then charged once
+    for the whole batch and all rows are inserted in one transaction.
+    Files that are individually unacceptable are reported and skipped;
+    a batch that does not fit the quota is rejected as a whole.
+    """
+    if request.user.user_type == User.UserType.GUEST:
+        return Response({
+            'error': 'Guests cannot upload files'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    serializer = BatchUploadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+
+    max_size = _max_upload_size(request.user, 'FILES_MAX_UPLOAD_SIZE')
+    field = File._meta.get_field('file')
+    # Stop storing as soon as the running total cannot fit, rather than after reading a whole archive
+    available = UserStorage.available(request.user)
+    results, staged, total, reserved = [], [], 0, False
+    try:
+        for index, (name, stream, size) in enumerate(batch.entries(data['files'], data.get('archive'))):
+            if index >= settings.FILES_MAX_BATCH_UPLOAD:
+                raise batch.BatchError(f'A batch may hold at most {settings.FILES_MAX_BATCH_UPLOAD} files')
+            name = batch.display_name(name)
+            if not name or size == 0:
+                results.append({'name': name, 'error': 'File is empty or has no name'})
+                continue
+            if size is not None and size > max_size:
+                results.append({'name': name, 'error': f'File size exceeds limit. Maximum size allowed is '
+                                                       f'{max_size / 1048576}MB'})
+                continue
+
+            content, reader = wrap_chunk(stream, max_size)
+            stored = field.storage.save(field.generate_filename(None, posixpath.basename(name)), content)
+            if reader.overflow:
+                field.storage.delete(stored)
+                results.append({'name': name, 'error': f'File size exceeds limit. Maximum size allowed is '
+                                                       f'{max_size / 1048576}MB'})
+                continue
+            staged.append((len(results), name, stored, reader.bytes_read))
+            results.append(None)
+            total += reader.bytes_read
+            if total > available:
+                raise batch.BatchError('Storage limit exceeded')
+
+        if not staged:
+            return Response({'error': 'No files were stored', 'results': results},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not UserStorage.reserve(request.user, total):
+            raise batch.BatchError('Storage limit exceeded')
+        reserved = True
+
+        expiry_date = datetime.now(timezone.utc) + timedelta(days=data['expiry_days'])
+        metadata = data['encryption_metadata']
+        rows = [File(
+            name=name,
+            file=stored,
+            extension=name.split('.')[-1][:10],
+            size=size,
+            uploaded_by=request.user,
+            status=data['status'],
+            expiry_date=expiry_date,
+            encryption_key=metadata.get(name, {}).get('key'),
+            encryption_iv=metadata.get(name, {}).get('iv'),
+            processing_status=File.PROCESSING
+        ) for _, name, stored, size in staged]
+        with transaction.atomic():
+            created = File.objects.bulk_create(rows)
+            files_created.send(sender=File, owners=Counter({request.user.id: len(created)}),
+                               encrypted=sum(1 for file in created if file.encryption_key))
+            ListingVersion.bump(uploaded_by=[request.user.id])
+            schedule(*created)
+    except batch.BatchError as e:
+        _discard_staged(field, staged)
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception:
+        # A broken stream, storage or database failure must not leave staged files or a reservation behind
+        if reserved:
+            UserStorage.release(request.user, total)
+        _discard_staged(field, staged)
+        log.event(logger, 'upload.batch_failed', level=logging.ERROR, exc_info=True, files=len(staged), size=total)
+        raise
+
+    serialized = FileSerializer(created, many=True, context={'request': request}).data
+    for (position, _, _, _), file_data in zip(staged, serialized):
+        results[position] = {'name': file_data['name'], 'file': file_data}
+    log.event(logger, 'upload.batch_saved', files=len(created), size=total, skipped=len(results) - len(created))
+    return Response({
+        'results': results,
+        'created': len(created),
+        'failed': len(results) - len(created),
+    }, status=status.HTTP_201_CREATED if len(created) == len(results) else status.HTTP_207_MULTI_STATUS)
+
+
+def _discard_staged(field, staged):
+    for _, _, stored, _ in staged:
+        field.storage.delete(stored)
+
+
+# Chunked (resumable) uploads
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([UserThrottle, UploadThrottle])
+def create_upload_session(request):
+    if request.user.user_type == User.UserType.GUEST:
+        return Response({
+            'error': 'Guests cannot upload files'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    serializer = UploadSessionCreateSerializer(data=request.data, context={
+        'request': request,
+        'chunk_size': settings.FILES_UPLOAD_CHUNK_SIZE,
+    })
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    total_size = serializer.validated_data['total_size']
+    max_size = _max_upload_size(request.user, 'FILES_MAX_CHUNKED_UPLOAD_SIZE')
+    if total_size > max_size:
+        return Response({
+            'error': f'File size exceeds limit. Maximum size allowed is {max_size / 1048576}MB'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # The session holds its reservation until it completes or is aborted
+    if not UserStorage.reserve(request.user, total_size):
+        return Response({
+            'error': 'Storage limit exceeded'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        session = serializer.save()
+    except Exception:
+        UserStorage.release(request.user, total_size)
+        raise
+    return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
 
-        except Exception as e:
-            print(f"Error uploading file: {str(e)}")
-            logger.error(f"Error uploading file: {str(e)}")
-            return Response({
-                'error': f'Error uploading file: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    print(f"Serializer errors: {serializer.errors}")
-    logger.error(f"Serializer errors: {serializer.errors}")
+def _discard_chunks(session):
+    for index in session.chunks.values_list('index', flat=True):
+        default_storage.delete(session.chunk_name(index))
+    session.chunks.all().delete()
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_session_detail(request, session_id):
+    try:
+        session = UploadSession.objects.get(id=session_id, user=request.user)
+    except UploadSession.DoesNotExist:
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'DELETE':
+        if session.status == 'active':
+            _discard_chunks(session)
+            session.status = 'aborted'
+            session.save()
+            UserStorage.release(request.user, session.total_size)
+        return Response({'message': 'Upload session aborted'})
+
+    return Response(UploadSessionSerializer(session).data)
+
+
+@api_view(['PUT'])
+@permission_classes([IsAuthenticated])
+def upload_chunk(request, session_id, index):
+    try:
+        session = UploadSession.objects.get(id=session_id, user=request.user, status='active')
+    except UploadSession.DoesNotExist:
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if index >= session.total_chunks:
+        return Response({'error': 'Chunk index out of range'}, status=status.HTTP_400_BAD_REQUEST)
+
+    checksum = request.headers.get('X-Chunk-SHA256', '').strip().lower()
+    if not checksum:
+        return Response({'error': 'X-Chunk-SHA256 header is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Stream the body straight into storage, hashing it on the way through
+    expected_size = session.expected_chunk_size(index)
+    name = session.chunk_name(index)
+    default_storage.delete(name)
+    content, reader = wrap_chunk(request.stream or io.BytesIO(), expected_size)
+    saved = default_storage.save(name, content)
+    if saved != name:
+        # Another upload of this index got there first; assembly only ever reads ``name``
+        default_storage.delete(saved)
+        return Response({'error': f'Chunk {index} is already being uploaded'}, status=status.HTTP_409_CONFLICT)
+
+    if reader.overflow or reader.bytes_read != expected_size:
+        default_storage.delete(name)
+        return Response({
+            'error': f'Chunk {index} must be exactly {expected_size} bytes'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if reader.hexdigest() != checksum:
+        default_storage.delete(name)
+        return Response({'error': 'Chunk checksum mismatch'}, status=status.HTTP_400_BAD_REQUEST)
+
+    UploadChunk.objects.update_or_create(session=session, index=index, defaults={
+        'size': reader.bytes_read,
+        'checksum': checksum,
+    })
+    session.save(update_fields=['updated_at'])
+
+    return Response({'index': index, 'size': reader.bytes_read, 'checksum': checksum})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def complete_upload_session(request, session_id):
+    try:
+        session = UploadSession.objects.get(id=session_id, user=request.user, status='active')
+    except UploadSession.DoesNotExist:
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    received = set(session.chunks.values_list('index', flat=True))
+    missing = [index for index in range(session.total_chunks) if index not in received]
+    if missing:
+        return Response({
+            'error': 'Upload incomplete',
+            'missing_chunks': received_ranges(missing)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # Claim the session before assembling it, so concurrent or repeated completes cannot both go ahead
+    if not UploadSession.objects.filter(pk=session.pk, status='active').update(status='complete'):
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    expected_checksum = (request.data.get('sha256') or '').strip().lower()
+    new_file = File(
+        name=session.file_name,
+        extension=session.file_name.split('.')[-1],
+        size=session.total_size,
+        uploaded_by=request.user,
+        status=session.file_status,
+        expiry_date=datetime.now(timezone.utc) + timedelta(days=session.expiry_days),
+        encryption_key=session.encryption_key,
+        encryption_iv=session.encryption_iv,
+        processing_status=File.PROCESSING
+    )
+    content, reader = assemble_chunks(default_storage, session)
+    try:
+        try:
+            # Staged like a direct upload; processing moves it into the blob store under this checksum
+            new_file.file.save(session.file_name, content, save=False)
+        finally:
+            content.close()
+        new_file.checksum = reader.hexdigest()
+        if expected_checksum and new_file.checksum != expected_checksum:
+            new_file.file.delete(save=False)
+            UploadSession.objects.filter(pk=session.pk).update(status='active')
+            return Response({'error': 'File checksum mismatch'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            new_file.save()
+            schedule(new_file)
+
+            # Bytes were reserved when the session was opened
+            ListingVersion.bump(uploaded_by=[request.user.id])
+
+    except Exception as e:
+        if new_file.file:
+            new_file.file.delete(save=False)
+        UploadSession.objects.filter(pk=session.pk).update(status='active')
+        log.event(logger, 'upload.assembly_failed', level=logging.ERROR, exc_info=True, session_id=session.id,
+                  size=session.total_size)
+        return Response({
+            'error': f'Error uploading file: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    _discard_chunks(session)
+
     return Response(
-        serializer.errors,
-        status=status.HTTP_400_BAD_REQUEST
+        FileSerializer(new_file, context={'request': request}).data,
+        status=status.HTTP_201_CREATED
     )
 
 
@@ -124,14 +448,10 @@ def upload_file(request):
 @permission_classes([IsAuthenticated])
 def delete_file(request, file_id):
     try:
-        file = File.objects.get(id=file_id, uploaded_by=request.user)
-        file_size = file.size
-        file.delete()
-
-        # Update user's storage usage
-        storage = UserStorage.objects.get(user=request.user)
-        storage.used_storage -= file_size
-        storage.save()
+        # Frees the blob reference, storage usage and cached listings along with the row
+        deleted, _ = File.objects.filter(id=file_id, uploaded_by=request.user).purge()
+        if not deleted:
+            raise File.DoesNotExist
 
         return Response({'message': 'File deleted successfully'})
     except File.DoesNotExist:
@@ -141,56 +461,156 @@ def delete_file(request, file_id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def share_file(request, file_id):
-    try:
-        file = File.objects.get(id=file_id, uploaded_by=request.user)
-        emails = request.data.get('emails', [])
+    files, _, _ = File.objects.filter(id=file_id, uploaded_by=request.user).share(request.data.get('emails', []))
+    if not files:
+        return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        for email in emails:
-            try:
-                user = User.objects.get(email=email)
-                file.shared_with.add(user)
-            except User.DoesNotExist:
-                pass
+    return Response(FileSerializer(files[0], context={'request': request}).data)
 
-        file.status = 'public'
-        file.download_link = str(uuid.uuid4())
-        file.save()
 
-        return Response(FileSerializer(file).data)
-    except File.DoesNotExist:
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def share_files(request):
+    serializer = BulkShareSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    file_ids = serializer.validated_data['file_ids']
+    files, recipients, unknown = File.objects.filter(id__in=file_ids, uploaded_by=request.user).share(
+        serializer.validated_data['emails'])
+    if not files:
         return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    found = {file.id for file in files}
+    return Response({
+        'files': FileSerializer(files, many=True, context={'request': request}).data,
+        'shared_with': [user.email for user in recipients],
+        'unknown_emails': unknown,
+        'missing_file_ids': [file_id for file_id in dict.fromkeys(file_ids) if file_id not in found],
+    })
+
+
+def _link_target(file):
+    """Describe ``file`` for the link cache."""
+    return link_cache.LinkTarget(
+        file_id=file.id,
+        name=file.name,
+        storage_name=file.file.name,
+        checksum=file.checksum,
+        uploaded=file.uploaded_date.timestamp(),
+        expiry=file.expiry_date.timestamp() if file.expiry_date else None,
+        content_type=mimetypes.guess_type(file.name)[0] or 'application/octet-stream',
+    )
 
-from django.http import FileResponse
-import mimetypes
+
+def _with_checksum(file, target):
+    """
+    ``target`` with the ETag checksum of a ready ``file``, hashing rows that predate stored checksums.
+
+    Hashing reads the whole file, so call this only once the download is
+    known to be served; the result is saved, so each row is hashed once.
+    """
+    if target.checksum or file.processing_status != File.READY:
+        return target
+    with file.file.open('rb'):
+        file.checksum = file_checksum(file.file)
+    file.save(update_fields=['checksum'])
+    return target._replace(checksum=file.checksum)
 
 
 @api_view(['GET'])
+@throttle_classes([DownloadThrottle, DownloadLinkThrottle])
 def download_file(request, download_link):
     try:
-        file = File.objects.get(download_link=download_link)
-
-        # Check expiry
-        if file.expiry_date and file.expiry_date < datetime.now(timezone.utc):
-            return Response({'error': 'File has expired'}, status=status.HTTP_410_GONE)
-
-        # Get file path and determine content type
-        file_path = file.file.path
-        content_type, _ = mimetypes.guess_type(file_path)
-        if not content_type:
-            content_type = 'application/octet-stream'
+        link = uuid.UUID(download_link)
+    except ValueError:
+        return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Create response
-        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
-        response['Content-Disposition'] = f'attachment; filename="{file.name}"'
+    # Hot links are served from the link cache without touching the database
+    file = None
+    target = link_cache.get(link)
+    if target is None:
+        try:
+            file = File.objects.only('id', 'name', 'file', 'checksum', 'uploaded_date', 'expiry_date',
+                                     'processing_status').get(download_link=link)
+        except File.DoesNotExist:
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+        if file.processing_status == File.FAILED:
+            return Response({'error': 'File failed processing'}, status=status.HTTP_409_CONFLICT)
+        target = _link_target(file)
+
+    # Check expiry
+    if target.expiry is not None and target.expiry < datetime.now(timezone.utc).timestamp():
+        return Response({'error': 'File has expired'}, status=status.HTTP_410_GONE)
+
+    if file is not None:
+        target = _with_checksum(file, target)
+        # While processing, the bytes are staged under a name the task will delete
+        if file.processing_status == File.READY:
+            link_cache.put(link, target)
+
+    file = File(id=target.file_id, name=target.name, file=target.storage_name, checksum=target.checksum,
+                uploaded_date=datetime.fromtimestamp(target.uploaded, timezone.utc))
+    try:
+        return build_download_response(request, file, content_type=target.content_type)
+    except FileNotFoundError:
+        # The row outlived its stored bytes (e.g. deleted while this request was in flight)
+        return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        return response
 
-    except File.DoesNotExist:
+@api_view(['POST'])
+@throttle_classes([UserThrottle, DownloadThrottle])
+def download_bundle(request):
+    """
+    Stream several files as one zip or tar archive.
+
+    Files are named by id (owned by or shared with the signed-in user) and/or
+    by public download link; access to all of them is checked in one query.
+    Requested files that are missing, expired or inaccessible are left out
+    and listed in ``X-Bundle-Missing``.
+    """
+    serializer = BundleSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    file_ids, links, format = (serializer.validated_data[key] for key in ('file_ids', 'download_links', 'format'))
+    if file_ids and not request.user.is_authenticated:
+        return Response({'error': 'Authentication required to bundle files by id'},
+                        status=status.HTTP_401_UNAUTHORIZED)
+
+    access = Q(download_link__in=links)
+    if file_ids:
+        access |= Q(id__in=file_ids) & (Q(uploaded_by=request.user) | Q(shared_with=request.user))
+    now = datetime.now(timezone.utc)
+    found = (File.objects.filter(access)
+             .filter(Q(expiry_date__isnull=True) | Q(expiry_date__gt=now))
+             .exclude(processing_status=File.FAILED)
+             .only('id', 'name', 'file', 'size', 'uploaded_date', 'download_link').distinct())
+    by_id = {file.id: file for file in found}
+    by_link = {file.download_link: file for file in by_id.values()}
+
+    # Keep the requested order, each file once
+    wanted = [by_id.get(file_id) for file_id in file_ids] + [by_link.get(link) for link in links]
+    files = list({file.id: file for file in wanted if file is not None}.values())
+    if not files:
         return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    members = list(bundles.members(files))
+    response = StreamingHttpResponse(bundles.stream(members, format, shaper=download_shaper(request)),
+                                     content_type=bundles.FORMATS[format])
+    if format == 'tar':
+        response['Content-Length'] = str(bundles.tar_size(members))
+    response['Content-Disposition'] = f'attachment; filename="files-{now:%Y%m%d-%H%M%S}.{format}"'
+    missing = [str(file_id) for file_id in file_ids if file_id not in by_id] + \
+              [str(link) for link in links if link not in by_link]
+    if missing:
+        response['X-Bundle-Missing'] = ','.join(missing)
+    log.event(logger, 'download.bundle', format=format, files=len(files), size=sum(file.size for file in files),
+              missing=len(missing))
+    return response
+
 
 # Role requests
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_role_requests(request):
@@ -198,9 +618,14 @@ def get_role_requests(request):
     if request.user.user_type != User.UserType.ADMIN:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
 
-    requests = RoleUpgradeRequest.objects.filter(status='pending')
-    serializer = RoleUpgradeRequestSerializer(requests, many=True)
-    return Response(serializer.data)
+    fields = requested_fields(request, RoleUpgradeRequestSerializer)
+    ordering = ('-request_date', '-id')
+    requests = project(RoleUpgradeRequest.objects.filter(status='pending'), RoleUpgradeRequestSerializer, fields,
+                       ordering)
+    paginator = KeysetPagination(ordering=ordering)
+    page = paginator.paginate_queryset(requests, request)
+    serializer = RoleUpgradeRequestSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['POST'])